@@ -0,0 +1,477 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import httpx
+from pymongo import UpdateOne
+from .core.auth import _hash_password, _verify_password, create_token, reserve_credits, verify_password
+from .core.config import settings
+from .core.database import (
+    INDEXES, PRICE_OBSERVATION_INDEXES, PRICE_TIMESERIES, client, db, ensure_indexes, index_report, close_db_connection
+)
+from .core.latest_prices import rebuild_latest_prices
+from .core.price_rollups import rebuild_price_daily
+from .core.price_store import migrate_prices, to_observation
+from .core.product_search import rebuild_product_search, search_entry, search_product_ids
+from .core.sellables import sellable_resolver
+from .core.system_import import import_file
+
+async def _indexes(args):
+    if args.apply:
+        await ensure_indexes()
+    return await index_report()
+
+async def _rebuild_latest_prices(args):
+    return await rebuild_latest_prices()
+
+async def _rebuild_price_daily(args):
+    return await rebuild_price_daily()
+
+async def _rebuild_product_search(args):
+    return await rebuild_product_search()
+
+async def _import_data(args):
+    # Same engine as POST /admin/system/import, without the request timeout for large backups
+    with open(args.path, "rb") as fileobj:
+        result = await import_file(fileobj, args.path, batch_size=args.batch_size,
+                                   concurrency=args.concurrency, collection=args.collection)
+    if "sellable_products" in result["results"]:
+        await sellable_resolver.mark_changed()
+    if "products" in result["results"]:
+        result["product_search"] = await rebuild_product_search()
+    if "prices" in result["results"]:
+        result["latest_prices"] = await rebuild_latest_prices()
+        result["price_daily"] = await rebuild_price_daily()
+    return result
+
+async def _backfill_comments_count(args):
+    # Posts created before comments_count was maintained have no counter; --all recounts every post.
+    # Counts come from the comments index one batch of posts at a time.
+    query = {} if args.all else {"comments_count": {"$exists": False}}
+    updated = 0
+
+    async def apply(post_ids):
+        counts = {c["_id"]: c["count"] async for c in db.comments.aggregate([
+            {"$match": {"post_id": {"$in": post_ids}}},
+            {"$group": {"_id": "$post_id", "count": {"$sum": 1}}},
+        ])}
+        ops = [UpdateOne({"id": pid}, {"$set": {"comments_count": counts.get(pid, 0)}}) for pid in post_ids]
+        result = await db.posts.bulk_write(ops, ordered=False)
+        return result.modified_count
+
+    batch = []
+    async for post in db.posts.find(query, {"_id": 0, "id": 1}):
+        batch.append(post["id"])
+        if len(batch) >= args.batch_size:
+            updated += await apply(batch)
+            batch = []
+    if batch:
+        updated += await apply(batch)
+    return {"updated": updated}
+
+async def _migrate_reactions(args):
+    # Moves the per-post user_reactions maps into post_reactions. The counters on the post were
+    # already maintained alongside the map, so they are left as they are.
+    migrated = posts = 0
+    async for post in db.posts.find({"user_reactions": {"$exists": True}}, {"_id": 0, "id": 1, "user_reactions": 1}):
+        ops = [
+            UpdateOne({"post_id": post["id"], "user_id": user_id}, {"$setOnInsert": {"reaction_type": reaction}}, upsert=True)
+            for user_id, reaction in (post.get("user_reactions") or {}).items()
+        ]
+        if ops:
+            result = await db.post_reactions.bulk_write(ops, ordered=False)
+            migrated += result.upserted_count
+        await db.posts.update_one({"id": post["id"]}, {"$unset": {"user_reactions": ""}})
+        posts += 1
+    return {"posts": posts, "reactions": migrated}
+
+async def _credits_load_test(args):
+    # Fires concurrent reservations at a throwaway user and checks that exactly the affordable
+    # number succeed, that the balance never goes negative and that retried keys are charged once
+    user_id = f"load-test-{uuid.uuid4()}"
+    await db.users.insert_one({"id": user_id, "name": "load test", "credits": args.credits, "points": 0})
+    try:
+        keys = [f"k{i % args.unique_keys}" if args.unique_keys else None for i in range(args.requests)]
+        started = time.monotonic()
+        results = await asyncio.gather(*[reserve_credits(user_id, args.amount, "load test", k) for k in keys])
+        elapsed = time.monotonic() - started
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "credits": 1})
+        charged = [r for r in results if r and not r["replayed"] and not r.get("pending")]
+        distinct = args.unique_keys or args.requests
+        expected = min(distinct, args.credits // args.amount)
+        return {
+            "requests": args.requests,
+            "charged": len(charged),
+            "replayed": sum(1 for r in results if r and r["replayed"]),
+            "in_flight": sum(1 for r in results if r and r.get("pending")),
+            "rejected": sum(1 for r in results if r is None),
+            "expected_charged": expected,
+            "final_balance": user["credits"],
+            "ok": len(charged) == expected and user["credits"] == args.credits - expected * args.amount,
+            "seconds": round(elapsed, 3),
+        }
+    finally:
+        await db.users.delete_one({"id": user_id})
+        await db.credit_history.delete_many({"user_id": user_id})
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(pct * (len(ordered) - 1))] if ordered else 0.0
+
+async def _password_bench(args):
+    # Latency of an unrelated endpoint while a burst of password checks runs, with bcrypt called
+    # inline on the event loop (the old handlers) and on the hashing pool
+    from .main import app
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    hashed = _hash_password("benchmark-password")
+    report = {"bcrypt_rounds": settings.BCRYPT_ROUNDS, "logins": args.logins}
+    for mode in ("inline", "pool"):
+        latencies = []
+        burst_end = None
+
+        async def login():
+            if mode == "inline":
+                _verify_password("benchmark-password", hashed)
+            else:
+                await verify_password("benchmark-password", hashed)
+
+        async def probe(client):
+            # Requests are due on a fixed 10 ms schedule and measured from when they were due,
+            # so time spent waiting for a blocked event loop counts as latency
+            due = time.perf_counter()
+            while burst_end is None or due < burst_end:
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                await client.get("/")
+                latencies.append((time.perf_counter() - due) * 1000)
+                due += 0.01
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            prober = asyncio.create_task(probe(client))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            await asyncio.gather(*[login() for _ in range(args.logins)])
+            burst_end = time.perf_counter()
+            burst = burst_end - started
+            await prober
+        report[mode] = {
+            "burst_seconds": round(burst, 3),
+            "probe_requests": len(latencies),
+            "p50_ms": round(_percentile(latencies, 0.50), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "max_ms": round(max(latencies, default=0.0), 2),
+        }
+    return report
+
+def _cpu_ms(func, iterations: int) -> float:
+    started = time.process_time()
+    for _ in range(iterations):
+        func()
+    return round((time.process_time() - started) * 1000 / iterations, 3)
+
+async def _serialization_bench(args):
+    # Bytes on the wire per encoding, and CPU per response for rendering with the stdlib encoder
+    # (the previous default response class) versus orjson, on the largest read endpoints
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from .core.compression import CODERS
+    from .main import app
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    user = await db.users.find_one({"email": args.email} if args.email else {"role": "admin"}, {"_id": 0, "id": 1, "email": 1, "role": 1})
+    if not user:
+        return {"error": "No user to authenticate as; pass --email"}
+    headers = {"Authorization": f"Bearer {create_token(user['id'], user.get('email'), user.get('role', 'user'))}",
+               "Accept-Encoding": "identity"}
+    report = {"iterations": args.iterations, "endpoints": {}}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for path in ("/api/public/products", "/api/prices?limit=1000", "/api/shopping-lists"):
+            response = await client.get(path, headers=headers)
+            if response.status_code != 200:
+                report["endpoints"][path] = {"status": response.status_code}
+                continue
+            payload = response.json()
+            body = response.content
+            entry = {
+                "items": len(payload) if isinstance(payload, list) else None,
+                "bytes": {"identity": len(body)},
+                "render_ms": {
+                    "stdlib": _cpu_ms(lambda: JSONResponse(payload).body, args.iterations),
+                    "orjson": _cpu_ms(lambda: ORJSONResponse(payload).body, args.iterations),
+                },
+                "compress_ms": {},
+            }
+            for encoding, coder in CODERS.items():
+                entry["bytes"][encoding] = len(coder(settings.COMPRESSION_LEVEL).finish(body))
+                entry["compress_ms"][encoding] = _cpu_ms(lambda: coder(settings.COMPRESSION_LEVEL).finish(body), args.iterations)
+            report["endpoints"][path] = entry
+    return report
+
+async def _response_bench(args):
+    # Compares the fast serialization path with the default one on the large list endpoints:
+    # the bodies must be byte-identical, and CPU is reported per 1,000 rows for each path
+    from .core.http_cache import response_cache
+    from .main import app
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    user = await db.users.find_one({"email": args.email} if args.email else {"role": "admin"}, {"_id": 0, "id": 1, "email": 1, "role": 1})
+    if not user:
+        return {"error": "No user to authenticate as; pass --email"}
+    headers = {"Authorization": f"Bearer {create_token(user['id'], user.get('email'), user.get('role', 'user'))}",
+               "Accept-Encoding": "identity"}
+    fast = settings.FAST_SERIALIZATION
+    report = {"iterations": args.iterations, "endpoints": {}}
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for path in ("/api/public/products", "/api/admin/products", "/api/prices?limit=1000", "/api/shopping-lists"):
+                bodies, cpu = {}, {}
+                for mode in ("default", "fast"):
+                    settings.FAST_SERIALIZATION = mode == "fast"
+                    # One untimed request so cache loads and first-call setup are not billed to either path
+                    await client.get(path, headers=headers)
+                    started = time.process_time()
+                    for _ in range(args.iterations):
+                        # Pre-serialized catalog bodies would hide the work being measured
+                        response_cache.clear()
+                        response = await client.get(path, headers=headers)
+                    cpu[mode] = (time.process_time() - started) / args.iterations
+                    bodies[mode] = response.content if response.status_code == 200 else None
+                rows = len(json.loads(bodies["default"])) if bodies["default"] else 0
+                per_1000 = 1000 / rows if rows else 0
+                report["endpoints"][path] = {
+                    "rows": rows,
+                    "identical": bodies["default"] is not None and bodies["default"] == bodies["fast"],
+                    "cpu_ms_per_1000_rows": {mode: round(t * 1000 * per_1000, 2) for mode, t in cpu.items()},
+                }
+    finally:
+        settings.FAST_SERIALIZATION = fast
+    report["ok"] = all(e["identical"] for e in report["endpoints"].values() if e["rows"])
+    return report
+
+async def _migrate_prices_timeseries(args):
+    # Leaves db.prices untouched; set PRICE_STORAGE=timeseries once the counts match
+    return await migrate_prices(batch_size=args.batch_size, after=args.after)
+
+def _synthetic_prices(rows: int, sellables: int, days: int, batch_size: int):
+    # Observations spread evenly over the period in time order, the way contributions arrive
+    rng = random.Random(42)
+    sp_ids = [f"bench-sp-{i}" for i in range(sellables)]
+    base = {sp_id: rng.uniform(0.5, 20) for sp_id in sp_ids}
+    start = datetime.now(timezone.utc) - timedelta(days=days)
+    step = days * 86400 / rows
+    batch = []
+    for i in range(rows):
+        sp_id = rng.choice(sp_ids)
+        n = int(sp_id.rsplit("-", 1)[1])
+        batch.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "sellable_product_id": sp_id,
+            "product_id": f"bench-p-{n // 4}",
+            "supermarket_id": f"bench-s-{n % 8}",
+            "brand_id": f"bench-b-{n % 50}",
+            "price": round(base[sp_id] * rng.uniform(0.8, 1.2), 2),
+            "quantity": 1,
+            "user_id": f"bench-u-{rng.randrange(10000)}",
+            "created_at": (start + timedelta(seconds=i * step)).isoformat(timespec="milliseconds"),
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _price_storage_bench(args):
+    # Loads the same synthetic history into a regular collection with the db.prices indexes and into a
+    # time-series collection, then compares on-disk size and the latency of a sellable product's history
+    bench_db = client[args.database]
+    regular, series = bench_db.prices_regular, bench_db.prices_timeseries
+    await regular.drop()
+    await series.drop()
+    await bench_db.create_collection("prices_timeseries", timeseries=PRICE_TIMESERIES)
+    await regular.create_indexes([m for m in INDEXES["prices"] if not m.document.get("unique")])
+    await series.create_indexes(PRICE_OBSERVATION_INDEXES)
+
+    started = time.monotonic()
+    pending = set()
+    for batch in _synthetic_prices(args.rows, args.sellables, args.days, 10000):
+        observations = [to_observation(doc) for doc in batch]
+        pending.add(asyncio.create_task(regular.insert_many(batch, ordered=False)))
+        pending.add(asyncio.create_task(series.insert_many(observations, ordered=False)))
+        if len(pending) >= 8:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+    if pending:
+        await asyncio.gather(*pending)
+    report = {"rows": args.rows, "sellables": args.sellables, "days": args.days,
+              "load_seconds": round(time.monotonic() - started, 1), "collections": {}}
+
+    rng = random.Random(7)
+    since = datetime.now(timezone.utc) - timedelta(days=args.window_days)
+    queries = {
+        "regular": lambda sp: regular.find(
+            {"sellable_product_id": sp, "created_at": {"$gte": since.isoformat()}}, {"_id": 0}
+        ).sort([("created_at", -1), ("_id", -1)]),
+        "timeseries": lambda sp: series.find(
+            {"meta.sellable_product_id": sp, "observed_at": {"$gte": since}}, {"_id": 0}
+        ).sort("observed_at", -1),
+    }
+    for name, coll in (("regular", regular), ("timeseries", series)):
+        stats = await bench_db.command("collStats", coll.name)
+        latencies = []
+        for _ in range(args.queries):
+            sp_id = f"bench-sp-{rng.randrange(args.sellables)}"
+            t0 = time.perf_counter()
+            await queries[name](sp_id).to_list(None)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        report["collections"][name] = {
+            "storage_mb": round(stats.get("storageSize", 0) / 2**20, 1),
+            "index_mb": round(stats.get("totalIndexSize", 0) / 2**20, 1),
+            "history_p50_ms": round(_percentile(latencies, 0.50), 2),
+            "history_p99_ms": round(_percentile(latencies, 0.99), 2),
+        }
+    if not args.keep:
+        await client.drop_database(args.database)
+    return report
+
+SEARCH_BENCH_WORDS = [
+    "Plátano", "Leche", "Entera", "Semidesnatada", "Yogur", "Griego", "Café", "Molido", "Azúcar", "Moreno",
+    "Aceite", "Oliva", "Virgen", "Jamón", "Serrano", "Queso", "Manchego", "Atún", "Claro", "Galletas",
+    "Chocolate", "Néctar", "Melocotón", "Pan", "Integral", "Arroz", "Bomba", "Tomate", "Triturado", "Limón",
+]
+SEARCH_BENCH_QUERIES = ["platano", "pla", "leche ent", "yog gri", "cafe", "jamon serrano", "aceite oliva virgen", "choc"]
+
+async def _search_bench(args):
+    # Latency of the indexed search against the previous unanchored case-insensitive $regex on products,
+    # for growing synthetic catalogs with accented Spanish names and a category filter on half the queries
+    bench_db = client[args.database]
+    rng = random.Random(42)
+    report = {"queries": args.queries, "sizes": {}}
+    try:
+        for size in (int(n) for n in args.sizes.split(",")):
+            await bench_db.products.drop()
+            await bench_db.product_search.drop()
+            await bench_db.product_search.create_indexes(INDEXES["product_search"])
+            await bench_db.products.create_index("category_id")
+            for start in range(0, size, 10000):
+                products = [{
+                    "id": f"bench-{i}",
+                    "name": " ".join(rng.sample(SEARCH_BENCH_WORDS, rng.randint(2, 4))) + f" {rng.randint(1, 999)}g",
+                    "category_id": f"bench-c-{i % 40}",
+                    "brand_id": f"bench-b-{i % 300}",
+                } for i in range(start, min(start + 10000, size))]
+                await bench_db.products.insert_many([dict(p) for p in products], ordered=False)
+                await bench_db.product_search.insert_many([search_entry(p) for p in products], ordered=False)
+
+            latencies = {"indexed": [], "regex": []}
+            for i in range(args.queries):
+                q = SEARCH_BENCH_QUERIES[i % len(SEARCH_BENCH_QUERIES)]
+                category_id = f"bench-c-{rng.randrange(40)}" if i % 2 else None
+                t0 = time.perf_counter()
+                await search_product_ids(q, category_id, None, 0, 100, collection=bench_db.product_search)
+                latencies["indexed"].append((time.perf_counter() - t0) * 1000)
+                query = {"name": {"$regex": q, "$options": "i"}}
+                if category_id:
+                    query["category_id"] = category_id
+                t0 = time.perf_counter()
+                await bench_db.products.find(query).to_list(100)
+                latencies["regex"].append((time.perf_counter() - t0) * 1000)
+            report["sizes"][size] = {
+                mode: {"p50_ms": round(_percentile(values, 0.50), 2), "p99_ms": round(_percentile(values, 0.99), 2)}
+                for mode, values in latencies.items()
+            }
+    finally:
+        if not args.keep:
+            await client.drop_database(args.database)
+    return report
+
+COMMANDS = {
+    "indexes": _indexes,
+    "rebuild-latest-prices": _rebuild_latest_prices,
+    "rebuild-price-daily": _rebuild_price_daily,
+    "rebuild-product-search": _rebuild_product_search,
+    "import-data": _import_data,
+    "migrate-prices-timeseries": _migrate_prices_timeseries,
+    "price-storage-bench": _price_storage_bench,
+    "backfill-comments-count": _backfill_comments_count,
+    "migrate-reactions": _migrate_reactions,
+    "credits-load-test": _credits_load_test,
+    "password-bench": _password_bench,
+    "serialization-bench": _serialization_bench,
+    "response-bench": _response_bench,
+    "search-bench": _search_bench,
+}
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="PriceHive maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("indexes", help="Report missing, extra and unused indexes")
+    p.add_argument("--apply", action="store_true", help="Create missing indexes before reporting")
+
+    sub.add_parser("rebuild-latest-prices", help="Rebuild the latest_prices collection from price history")
+
+    sub.add_parser("rebuild-price-daily", help="Backfill the price_daily rollups from price history")
+
+    sub.add_parser("rebuild-product-search", help="Rebuild the product_search index from the products collection")
+
+    p = sub.add_parser("import-data", help="Import an ndjson(.gz), csv(.zip), xlsx or ods export")
+    p.add_argument("path")
+    p.add_argument("--batch-size", type=int, default=None)
+    p.add_argument("--concurrency", type=int, default=None)
+    p.add_argument("--collection", default=None, help="Target collection for a single .csv file")
+
+    p = sub.add_parser("migrate-prices-timeseries", help="Copy db.prices into the price_observations time-series collection")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.add_argument("--after", default=None, help="Resume after this _id (the last_id of a previous run)")
+
+    p = sub.add_parser("price-storage-bench", help="Compare storage size and history latency of regular vs time-series prices")
+    p.add_argument("--rows", type=int, default=10_000_000)
+    p.add_argument("--sellables", type=int, default=20000)
+    p.add_argument("--days", type=int, default=730)
+    p.add_argument("--window-days", type=int, default=365, help="History range read by each query")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--database", default=f"{settings.DB_NAME}_bench", help="Scratch database, dropped afterwards")
+    p.add_argument("--keep", action="store_true", help="Keep the scratch database")
+
+    p = sub.add_parser("backfill-comments-count", help="Store the comment count on posts that lack it")
+    p.add_argument("--all", action="store_true", help="Recount every post, not only those without a count")
+    p.add_argument("--batch-size", type=int, default=1000)
+
+    sub.add_parser("migrate-reactions", help="Move reactions stored on posts into post_reactions")
+
+    p = sub.add_parser("credits-load-test", help="Check credit reservations under concurrent requests")
+    p.add_argument("--requests", type=int, default=500)
+    p.add_argument("--credits", type=int, default=100)
+    p.add_argument("--amount", type=int, default=3)
+    p.add_argument("--unique-keys", type=int, default=0, help="Reuse this many idempotency keys (0: no keys)")
+
+    p = sub.add_parser("password-bench", help="Measure endpoint latency during a burst of password checks")
+    p.add_argument("--logins", type=int, default=100)
+
+    p = sub.add_parser("serialization-bench", help="Measure payload size and JSON/compression CPU of large endpoints")
+    p.add_argument("--email", default=None, help="User to authenticate as (default: the first admin)")
+    p.add_argument("--iterations", type=int, default=20)
+
+    p = sub.add_parser("response-bench", help="Check fast serialization is byte-identical and compare its CPU")
+    p.add_argument("--email", default=None, help="User to authenticate as (default: the first admin)")
+    p.add_argument("--iterations", type=int, default=10)
+
+    p = sub.add_parser("search-bench", help="Compare indexed product search with the old $regex by catalog size")
+    p.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated catalog sizes")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--database", default=f"{settings.DB_NAME}_bench", help="Scratch database, dropped afterwards")
+    p.add_argument("--keep", action="store_true", help="Keep the scratch database")
+
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await COMMANDS[args.command](args)
+        finally:
+            await close_db_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from .config import settings
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+# Notifications and alert updates are written in chunks of this size
+ALERT_BATCH_SIZE = 1000
+# Remaining events get this long to drain on shutdown
+SHUTDOWN_DRAIN_SECONDS = 10.0
+
+def _matching_query(event: dict) -> dict:
+    # Each branch is a range scan on the (product_id, supermarket_id, alert_type, target_price)
+    # index, which only holds untriggered alerts, so no non-matching alert is ever read
+    scope = {
+        "product_id": event["product_id"],
+        "supermarket_id": {"$in": [event["supermarket_id"], None]},
+        "triggered": False,
+    }
+    return {"$or": [
+        {**scope, "alert_type": "below", "target_price": {"$gte": event["price"]}},
+        {**scope, "alert_type": "above", "target_price": {"$lte": event["price"]}},
+        {**scope, "alert_type": "any_change"},
+    ]}
+
+def _notification(alert: dict, event: dict, created_at: str) -> dict:
+    change = event["price"] - event["previous_price"]
+    change_text = f"+{change:.2f}€" if change > 0 else f"{change:.2f}€"
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": alert["user_id"],
+        "title": "Alerta de Precio",
+        "message": f"{event.get('product_name') or 'Producto'} en {event.get('supermarket_name') or 'Supermercado'}: {event['price']:.2f}€ ({change_text})",
+        "notification_type": "price_alert",
+        "read": False,
+        "created_at": created_at,
+    }
+
+async def evaluate_price_event(event: dict) -> int:
+    triggered = 0
+    batch = []
+    cursor = db.alerts.find(_matching_query(event), {"_id": 0, "id": 1, "user_id": 1}).batch_size(ALERT_BATCH_SIZE)
+    async for alert in cursor:
+        batch.append(alert)
+        if len(batch) >= ALERT_BATCH_SIZE:
+            triggered += await _trigger(batch, event)
+            batch = []
+    if batch:
+        triggered += await _trigger(batch, event)
+    return triggered
+
+async def _trigger(alerts: list, event: dict) -> int:
+    # Overlapping evaluations can match the same alerts. Each call stamps the alerts it flips with its
+    # own claim id and notifies only those, so no alert produces two notifications.
+    now = datetime.now(timezone.utc).isoformat()
+    claim = str(uuid.uuid4())
+    ids = [a["id"] for a in alerts]
+    await db.alerts.update_many(
+        {"id": {"$in": ids}, "triggered": False},
+        {"$set": {"triggered": True, "triggered_at": now, "trigger_claim": claim}}
+    )
+    claimed = {a["id"] async for a in db.alerts.find({"id": {"$in": ids}, "trigger_claim": claim}, {"_id": 0, "id": 1})}
+    notifications = [_notification(a, event, now) for a in alerts if a["id"] in claimed]
+    if notifications:
+        await db.notifications.insert_many(notifications, ordered=False)
+    return len(notifications)
+
+# Price submissions publish an event and return; a consumer task started with the app
+# evaluates alerts out of band. Events are held in memory only, like the other process-local state.
+class AlertEngine:
+    def __init__(self, max_queue: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._consumer: Optional[asyncio.Task] = None
+        self._overflow = set()
+        self.processed = 0
+        self.triggered = 0
+
+    def publish(self, event: dict):
+        if self._consumer is None:
+            # No consumer (CLI, scripts): still keep evaluation off the caller's path
+            self._spawn(event)
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Alert queue full, evaluating event in a separate task")
+            self._spawn(event)
+
+    def _spawn(self, event: dict):
+        task = asyncio.create_task(self._evaluate(event))
+        self._overflow.add(task)
+        task.add_done_callback(self._overflow.discard)
+
+    async def _evaluate(self, event: dict):
+        try:
+            self.triggered += await evaluate_price_event(event)
+        except Exception:
+            logger.exception(f"Alert evaluation failed for product {event.get('product_id')}")
+        self.processed += 1
+
+    async def _consume(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self._evaluate(event)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        if self._consumer is None:
+            self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        if self._consumer is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), SHUTDOWN_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} unprocessed price events on shutdown")
+        self._consumer.cancel()
+        self._consumer = None
+        if self._overflow:
+            await asyncio.gather(*list(self._overflow), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "processed": self.processed, "triggered": self.triggered}
+
+alert_engine = AlertEngine(settings.ALERT_QUEUE_MAX)
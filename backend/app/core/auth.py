@@ -1,64 +1,122 @@
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timezone, timedelta
+import asyncio
 import jwt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import bcrypt
 import uuid
 from .config import settings
 from .database import db
+from .auth_cache import auth_cache
+from .ledger import ledger
 
 security = HTTPBearer(auto_error=False)
 
-def hash_password(password: str) -> str:
+# A "pending" idempotent charge older than this was abandoned by a stopped process
+RESERVATION_TIMEOUT_SECONDS = 60
+# Ids of the last idempotent charges kept on the user document (see reserve_credits)
+RECENT_CHARGES = 20
+
+# bcrypt releases the GIL, so hashing runs on its own small pool instead of the event loop.
+# The pool is separate from the default executor so a login burst cannot starve other threaded work.
+_password_pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+def _hash_password(password: str) -> str:
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
-def verify_password(password: str, hashed: str) -> bool:
+def _verify_password(password: str, hashed: str) -> bool:
     try:
         return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
     except Exception:
         return False
 
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_password_pool, _hash_password, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_password_pool, _verify_password, password, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
 def create_token(user_id: str, email: str, role: str) -> str:
     payload = {
         "user_id": user_id,
         "email": email,
         "role": role,
+        "jti": str(uuid.uuid4()),
         "exp": datetime.now(timezone.utc) + timedelta(hours=settings.JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
 
+async def _load_user(user_id: str) -> Optional[dict]:
+    user = auth_cache.user(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if user:
+            auth_cache.set_user(user)
+    return user
+
+async def _session_user_id(session_token: str) -> Optional[str]:
+    user_id = auth_cache.credential(f"session:{session_token}")
+    if user_id:
+        return user_id
+    session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
+    if not session:
+        return None
+    expires_at = session.get("expires_at")
+    if isinstance(expires_at, str):
+        expires_at = datetime.fromisoformat(expires_at)
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= datetime.now(timezone.utc):
+        return None
+    auth_cache.set_credential(f"session:{session_token}", session["user_id"], expires_at)
+    return session["user_id"]
+
+def _token_user_id(token: str) -> Optional[str]:
+    # Keyed by the whole signed token rather than its unverified jti claim, so a forged token
+    # can never hit another token's entry; the jti keeps tokens issued in the same second distinct
+    key = f"jwt:{token}"
+    user_id = auth_cache.credential(key)
+    if user_id:
+        return user_id
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    auth_cache.set_credential(key, payload["user_id"], datetime.fromtimestamp(payload["exp"], tz=timezone.utc))
+    return payload["user_id"]
+
 async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
     # First try session token from cookie
     session_token = request.cookies.get("session_token")
 
     if session_token:
-        session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
-        if session:
-            expires_at = session.get("expires_at")
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-
-            if expires_at > datetime.now(timezone.utc):
-                user = await db.users.find_one({"id": session["user_id"]}, {"_id": 0})
-                if user:
-                    return user
+        user_id = await _session_user_id(session_token)
+        if user_id:
+            user = await _load_user(user_id)
+            if user:
+                return user
 
     # Fallback to JWT token from Authorization header
     if credentials:
-        try:
-            payload = jwt.decode(credentials.credentials, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-            user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+        user_id = _token_user_id(credentials.credentials)
+        if user_id:
+            user = await _load_user(user_id)
             if user:
                 return user
-        except jwt.ExpiredSignatureError:
-            pass
-        except jwt.InvalidTokenError:
-            pass
 
     raise HTTPException(status_code=401, detail="Not authenticated")
 
@@ -68,14 +126,11 @@ async def get_admin_user(user: dict = Depends(get_current_user)):
     return user
 
 async def add_points(user_id: str, points: int, reason: str):
-    await db.users.update_one({"id": user_id}, {"$inc": {"points": points}})
-    await db.point_history.insert_one({
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "points": points,
-        "reason": reason,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await ledger.award(user_id, points=points, reason=reason)
+
+async def award(user_id: str, amount: int, reason: str):
+    # Points and credits for the same contribution, buffered as one ledger entry per collection
+    await ledger.award(user_id, points=amount, credits=amount, reason=reason)
 
 async def create_notification(user_id: str, title: str, message: str, notification_type: str):
     await db.notifications.insert_one({
@@ -89,29 +144,80 @@ async def create_notification(user_id: str, title: str, message: str, notificati
     })
 
 async def add_credits(user_id: str, amount: int, reason: str):
-    await db.users.update_one({"id": user_id}, {"$inc": {"credits": amount}})
-    await db.credit_history.insert_one({
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "amount": amount,
-        "type": "earn",
-        "reason": reason,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await ledger.award(user_id, credits=amount, reason=reason)
 
-async def consume_credits(user_id: str, amount: int, reason: str) -> bool:
-    user = await db.users.find_one({"id": user_id})
-    if not user or user.get("credits", 0) < amount:
-        return False
-    
-    await db.users.update_one({"id": user_id}, {"$inc": {"credits": -amount}})
-    await db.credit_history.insert_one({
+async def reserve_credits(user_id: str, amount: int, reason: str, idempotency_key: Optional[str] = None) -> Optional[dict]:
+    # Atomic debit: the balance guard and the $inc are one find_one_and_update, so concurrent
+    # requests can never take the balance below zero. Returns the balance after the debit,
+    # or None when there are not enough credits.
+    # With an idempotency key the history entry is written first as "pending"; its unique
+    # (user_id, idempotency_key) index makes a retried request find the earlier attempt instead of
+    # paying twice. The entry becomes "charged" only once the debit has committed, and is removed if
+    # the debit fails, so a retry is reported as replayed only for a charge that really happened.
+    # A retry that arrives while the first attempt is still pending gets {"pending": True}.
+    if ledger.pending_for(user_id)["credits"]:
+        # Spending is exact: apply any buffered credits for this user before checking the balance
+        await ledger.flush([user_id])
+
+    entry = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
         "amount": amount,
         "type": "consume",
         "reason": reason,
         "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    return True
+    }
+    debit = {"$inc": {"credits": -amount}}
+    if idempotency_key:
+        entry["idempotency_key"] = idempotency_key
+        entry["status"] = "pending"
+        try:
+            await db.credit_history.insert_one(entry)
+        except DuplicateKeyError:
+            return await _resume_reservation(user_id, amount, reason, idempotency_key)
+        # The debit records the entry id on the user, so an entry left pending by a crash can later be
+        # told apart as charged or never charged
+        debit["$push"] = {"recent_charges": {"$each": [entry["id"]], "$slice": -RECENT_CHARGES}}
+
+    user = await db.users.find_one_and_update(
+        {"id": user_id, "credits": {"$gte": amount}},
+        debit,
+        projection={"_id": 0, "credits": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        if idempotency_key:
+            await db.credit_history.delete_one({"id": entry["id"]})
+        return None
+    auth_cache.invalidate_users([user_id])
+    if idempotency_key:
+        await db.credit_history.update_one({"id": entry["id"]}, {"$set": {"status": "charged"}})
+    else:
+        await db.credit_history.insert_one(entry)
+    return {"balance": user["credits"], "replayed": False}
 
+async def _resume_reservation(user_id: str, amount: int, reason: str, idempotency_key: str) -> dict:
+    earlier = await db.credit_history.find_one(
+        {"user_id": user_id, "idempotency_key": idempotency_key}, {"_id": 0, "id": 1, "status": 1, "created_at": 1}
+    )
+    if earlier is None:
+        # The earlier attempt failed and released the key in the meantime
+        return await reserve_credits(user_id, amount, reason, idempotency_key)
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "credits": 1, "recent_charges": 1}) or {}
+    balance = user.get("credits", 0)
+    # Entries written before the status field existed were only kept for committed charges
+    if earlier.get("status", "charged") != "pending":
+        return {"balance": balance, "replayed": True}
+    if earlier["id"] in (user.get("recent_charges") or []):
+        # The debit committed but the process stopped before marking the entry
+        await db.credit_history.update_one({"id": earlier["id"]}, {"$set": {"status": "charged"}})
+        return {"balance": balance, "replayed": True}
+    stale_before = (datetime.now(timezone.utc) - timedelta(seconds=RESERVATION_TIMEOUT_SECONDS)).isoformat()
+    if earlier.get("created_at", "") >= stale_before:
+        return {"balance": balance, "replayed": False, "pending": True}
+    # Abandoned before its debit: release the key and charge this request instead
+    await db.credit_history.delete_one({"id": earlier["id"], "status": "pending"})
+    return await reserve_credits(user_id, amount, reason, idempotency_key)
+
+async def consume_credits(user_id: str, amount: int, reason: str) -> bool:
+    return await reserve_credits(user_id, amount, reason) is not None
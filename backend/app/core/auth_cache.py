@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+from .cache import LRUCache
+from .config import settings
+
+# Short-lived cache in front of get_current_user.
+# Credentials (session token or JWT) map to (user_id, expires_at), and expires_at is checked on
+# every hit, so an expired session or token is never served. User documents are cached by id and
+# dropped whenever a handler changes fields other requests rely on (balances, sessions, role).
+class AuthCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._credentials = LRUCache(max_entries, ttl_seconds)
+        self._users = LRUCache(max_entries, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+
+    def credential(self, key: str) -> Optional[str]:
+        entry = self._credentials.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        user_id, expires_at = entry
+        if expires_at <= datetime.now(timezone.utc):
+            self._credentials.pop(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return user_id
+
+    def set_credential(self, key: str, user_id: str, expires_at: datetime):
+        self._credentials.set(key, (user_id, expires_at))
+
+    def user(self, user_id: str) -> Optional[dict]:
+        user = self._users.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Handlers may modify the user they receive
+        return dict(user)
+
+    def set_user(self, user: dict):
+        self._users.set(user["id"], dict(user))
+
+    def invalidate_credential(self, key: str):
+        self._credentials.pop(key)
+
+    def invalidate_users(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            self._users.pop(user_id)
+
+    def invalidate_user_credentials(self, user_id: str):
+        # Used when all of a user's sessions are replaced; credential entries are only scanned here
+        for key, (cached_user_id, _) in self._credentials.items():
+            if cached_user_id == user_id:
+                self._credentials.pop(key)
+        self._users.pop(user_id)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "credentials": len(self._credentials), "users": len(self._users)}
+
+auth_cache = AuthCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL_SECONDS)
@@ -0,0 +1,39 @@
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+class LRUCache:
+    # Size-bounded cache with per-entry expiry
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl_seconds:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def items(self):
+        return [(key, entry[1]) for key, entry in self._data.items()]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,166 @@
+import zlib
+from typing import List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Only textual payloads are worth compressing; exports that are already zip/gzip/xlsx pass through
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        # Sync flush so streamed rows reach the client as they are produced
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._c.compress(data) + self._c.flush()
+
+class _Brotli:
+    def __init__(self, level: int):
+        # Brotli's 0-11 scale is much slower than gzip's at the same number; keep dynamic responses cheap
+        self._c = brotli.Compressor(quality=min(level, 5))
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._c.process(data) + self._c.finish()
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._c = zstandard.ZstdCompressor(level=min(level, 19)).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._c.compress(data) + self._c.flush()
+
+CODERS = {"gzip": _Gzip}
+if brotli is not None:
+    CODERS["br"] = _Brotli
+if zstandard is not None:
+    CODERS["zstd"] = _Zstd
+
+def available_encodings(configured: List[str]) -> List[str]:
+    return [e for e in configured if e in CODERS]
+
+def choose_encoding(accept_encoding: str, preferred: List[str]) -> Optional[str]:
+    # Highest client q-value wins; ties go to the server's order of preference
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    candidates = [(accepted.get(e, accepted.get("*", 0.0)), -i, e) for i, e in enumerate(preferred)]
+    q, _, encoding = max(candidates, default=(0.0, 0, None))
+    return encoding if q > 0 else None
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES or media_type.endswith("+json")
+
+# gzip, plus br/zstd when their packages are installed. Small bodies are sent as they are; streamed
+# bodies are compressed chunk by chunk with a flush after each one, so NDJSON and CSV streams keep flowing.
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, level: int = 6, encodings: Tuple[str, ...] = ("br", "zstd", "gzip")):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.encodings = available_encodings(list(encodings))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(self, encoding, send).run(scope, receive)
+
+class _CompressedResponse:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start: Optional[Message] = None
+        self.coder = None
+        self.passthrough = False
+
+    async def run(self, scope: Scope, receive: Receive):
+        await self.middleware.app(scope, receive, self.on_send)
+
+    async def on_send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows whether compression pays off
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = message["status"] in (204, 304) or not _compressible(headers)
+            if message["status"] == 304:
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if self.passthrough or (not more_body and len(body) < self.middleware.minimum_size):
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            # The compressed bytes are a different representation, so a strong validator becomes weak
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            self.coder = CODERS[self.encoding](self.middleware.level)
+            if not more_body:
+                data = self.coder.finish(body)
+                headers["Content-Length"] = str(len(data))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": data})
+                return
+            await self.send(start)
+
+        if self.passthrough:
+            await self.send(message)
+        elif more_body:
+            await self.send({"type": "http.response.body", "body": self.coder.chunk(body), "more_body": True})
+        else:
+            await self.send({"type": "http.response.body", "body": self.coder.finish(body)})
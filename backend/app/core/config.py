@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -17,5 +18,30 @@ class Settings:
     BACKEND_URL: str = os.environ.get("BACKEND_URL", "http://localhost:10000").rstrip('/')
     GOOGLE_CLIENT_ID: str = os.environ.get("GOOGLE_CLIENT_ID")
     GOOGLE_CLIENT_SECRET: str = os.environ.get("GOOGLE_CLIENT_SECRET")
+    REFERENCE_CACHE_TTL_SECONDS: float = float(os.environ.get("REFERENCE_CACHE_TTL_SECONDS", "300"))
+    EXPORT_SPOOL_MAX_BYTES: int = int(os.environ.get("EXPORT_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+    EXPORT_BATCH_SIZE: int = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+    IMPORT_BATCH_SIZE: int = int(os.environ.get("IMPORT_BATCH_SIZE", "1000"))
+    IMPORT_CONCURRENCY: int = int(os.environ.get("IMPORT_CONCURRENCY", "4"))
+    JOB_WORKERS: int = int(os.environ.get("JOB_WORKERS", "2"))
+    JOB_ARTIFACT_DIR: str = os.environ.get("JOB_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "pricehive-jobs"))
+    JOB_RETENTION_HOURS: int = int(os.environ.get("JOB_RETENTION_HOURS", "24"))
+    ALERT_QUEUE_MAX: int = int(os.environ.get("ALERT_QUEUE_MAX", "10000"))
+    LEDGER_FLUSH_INTERVAL_SECONDS: float = float(os.environ.get("LEDGER_FLUSH_INTERVAL_SECONDS", "2"))
+    LEDGER_MAX_PENDING: int = int(os.environ.get("LEDGER_MAX_PENDING", "500"))
+    LEADERBOARD_RESYNC_SECONDS: float = float(os.environ.get("LEADERBOARD_RESYNC_SECONDS", "300"))
+    AUTH_CACHE_TTL_SECONDS: float = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "30"))
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000"))
+    BCRYPT_ROUNDS: int = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS: int = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+    SELLABLE_CACHE_MAX_ENTRIES: int = int(os.environ.get("SELLABLE_CACHE_MAX_ENTRIES", "20000"))
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+    # br and zstd are only used when the brotli / zstandard packages are installed; empty disables compression
+    COMPRESSION_ENCODINGS: str = os.environ.get("COMPRESSION_ENCODINGS", "br,zstd,gzip")
+    COMPRESSION_MINIMUM_SIZE: int = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", "1024"))
+    COMPRESSION_LEVEL: int = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+    # "collection" keeps observations in db.prices; "timeseries" writes them to the price_observations time-series collection
+    PRICE_STORAGE: str = os.environ.get("PRICE_STORAGE", "collection").lower()
+    FAST_SERIALIZATION: bool = os.environ.get("FAST_SERIALIZATION", "true").lower() == "true"
 
 settings = Settings()
@@ -1,4 +1,7 @@
+from typing import List
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
 from .config import settings
 
 import logging
@@ -10,6 +13,219 @@ db = client[settings.DB_NAME]
 
 logger.info(f"Connecting to MongoDB at {settings.MONGO_URL}, Database: {settings.DB_NAME}")
 
+def _unique_id():
+    # Legacy documents may only have an ObjectId `_id`, so uniqueness only applies to string ids
+    return IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                      partialFilterExpression={"id": {"$type": "string"}})
+
+# Index registry: every collection the routers query, with the indexes backing those queries.
+# Names are explicit so the report can diff them against what exists in the database.
+INDEXES = {
+    "users": [
+        _unique_id(),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True,
+                   partialFilterExpression={"email": {"$type": "string"}}),
+        IndexModel([("points", DESCENDING)], name="points_desc"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "categories": [_unique_id()],
+    "brands": [_unique_id()],
+    "supermarkets": [_unique_id()],
+    "attributes": [_unique_id()],
+    "units": [_unique_id()],
+    "products": [
+        _unique_id(),
+        IndexModel([("category_id", ASCENDING)], name="category_id"),
+        IndexModel([("brand_id", ASCENDING)], name="brand_id"),
+    ],
+    "product_search": [
+        IndexModel([("product_id", ASCENDING)], name="product_id_unique", unique=True),
+        # Multikey on the word prefixes; the filters follow so a filtered search stays inside the index
+        IndexModel([("terms", ASCENDING), ("category_id", ASCENDING), ("brand_id", ASCENDING)],
+                   name="terms_category_id_brand_id"),
+        IndexModel([("category_id", ASCENDING), ("name", ASCENDING)], name="category_id_name"),
+        IndexModel([("brand_id", ASCENDING), ("name", ASCENDING)], name="brand_id_name"),
+        IndexModel([("name", ASCENDING)], name="name"),
+    ],
+    "product_units": [
+        _unique_id(),
+        IndexModel([("product_id", ASCENDING), ("unit_id", ASCENDING)], name="product_id_unit_id"),
+    ],
+    "sellable_products": [
+        _unique_id(),
+        IndexModel([("product_id", ASCENDING), ("supermarket_id", ASCENDING), ("brand_id", ASCENDING)],
+                   name="product_id_supermarket_id_brand_id"),
+        IndexModel([("supermarket_id", ASCENDING), ("brand_id", ASCENDING)], name="supermarket_id_brand_id"),
+    ],
+    "sellable_product_units": [
+        _unique_id(),
+        IndexModel([("sellable_product_id", ASCENDING), ("unit_id", ASCENDING)], name="sellable_product_id_unit_id"),
+    ],
+    "brand_product_catalog": [
+        _unique_id(),
+        IndexModel([("brand_id", ASCENDING), ("product_id", ASCENDING)], name="brand_id_product_id"),
+    ],
+    "prices": [
+        _unique_id(),
+        # Every price listing sorts by (created_at, _id); _id breaks ties for keyset pagination
+        IndexModel([("sellable_product_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="sellable_product_id_created_at_desc_oid_desc"),
+        # Legacy prices recorded before sellable products existed
+        IndexModel([("product_id", ASCENDING), ("supermarket_id", ASCENDING), ("created_at", DESCENDING),
+                    ("_id", DESCENDING)],
+                   name="product_id_supermarket_id_created_at_desc_oid_desc"),
+        IndexModel([("supermarket_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="legacy_supermarket_id_created_at_desc_oid_desc",
+                   partialFilterExpression={"supermarket_id": {"$exists": True}}),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_id_created_at_desc_oid_desc"),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_desc_oid_desc"),
+    ],
+    "latest_prices": [
+        IndexModel([("sellable_product_id", ASCENDING), ("variant", ASCENDING)],
+                   name="sellable_product_id_variant_unique", unique=True),
+        IndexModel([("product_id", ASCENDING), ("variant", ASCENDING), ("created_at", DESCENDING)],
+                   name="product_id_variant_created_at_desc"),
+    ],
+    "price_daily": [
+        IndexModel([("sellable_product_id", ASCENDING), ("day", ASCENDING)],
+                   name="sellable_product_id_day_unique", unique=True),
+        IndexModel([("product_id", ASCENDING), ("supermarket_id", ASCENDING), ("day", ASCENDING)],
+                   name="product_id_supermarket_id_day"),
+        IndexModel([("product_id", ASCENDING), ("day", ASCENDING)], name="product_id_day"),
+    ],
+    "shopping_lists": [
+        _unique_id(),
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING)], name="user_id_updated_at_desc"),
+    ],
+    "posts": [
+        _unique_id(),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_desc_id_desc"),
+    ],
+    "comments": [
+        _unique_id(),
+        IndexModel([("post_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="post_id_created_at_desc_id_desc"),
+    ],
+    "post_reactions": [
+        IndexModel([("post_id", ASCENDING), ("user_id", ASCENDING)], name="post_id_user_id_unique", unique=True),
+    ],
+    "alerts": [
+        _unique_id(),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at_desc"),
+        # Active alerts only, with thresholds sorted so a price event is matched by a range scan
+        IndexModel([("product_id", ASCENDING), ("supermarket_id", ASCENDING), ("alert_type", ASCENDING),
+                    ("target_price", ASCENDING)],
+                   name="active_product_id_supermarket_id_alert_type_target_price",
+                   partialFilterExpression={"triggered": False}),
+    ],
+    "notifications": [
+        _unique_id(),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at_desc"),
+        IndexModel([("user_id", ASCENDING), ("read", ASCENDING)], name="user_id_read"),
+    ],
+    "point_history": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at_desc"),
+    ],
+    "credit_history": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at_desc"),
+        IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], name="user_id_idempotency_key_unique",
+                   unique=True, partialFilterExpression={"idempotency_key": {"$type": "string"}}),
+    ],
+    "jobs": [
+        _unique_id(),
+        IndexModel([("created_at", DESCENDING)], name="created_at_desc"),
+    ],
+}
+
+# Price observations in time-series storage: one bucket per meta value (the sellable product, product,
+# supermarket and brand ids of the observation) and hour. Time-series collections have no unique indexes.
+PRICE_OBSERVATIONS = "price_observations"
+PRICE_TIMESERIES = {"timeField": "observed_at", "metaField": "meta", "granularity": "hours"}
+PRICE_OBSERVATION_INDEXES = [
+    # Created automatically by MongoDB 6.3+, declared so older servers get it too and the report stays clean
+    IndexModel([("meta", ASCENDING), ("observed_at", ASCENDING)], name="meta_1_observed_at_1"),
+    IndexModel([("meta.sellable_product_id", ASCENDING), ("observed_at", DESCENDING)],
+               name="sellable_product_id_observed_at_desc"),
+    IndexModel([("meta.product_id", ASCENDING), ("meta.supermarket_id", ASCENDING), ("observed_at", DESCENDING)],
+               name="product_id_supermarket_id_observed_at_desc"),
+    IndexModel([("meta.supermarket_id", ASCENDING), ("observed_at", DESCENDING)],
+               name="supermarket_id_observed_at_desc"),
+    IndexModel([("user_id", ASCENDING), ("observed_at", DESCENDING)], name="user_id_observed_at_desc"),
+    IndexModel([("observed_at", DESCENDING)], name="observed_at_desc"),
+    IndexModel([("id", ASCENDING)], name="id"),
+]
+
+# Collections that must be created with options before create_indexes would implicitly create them
+TIME_SERIES = {}
+if settings.PRICE_STORAGE == "timeseries":
+    TIME_SERIES[PRICE_OBSERVATIONS] = PRICE_TIMESERIES
+    INDEXES[PRICE_OBSERVATIONS] = PRICE_OBSERVATION_INDEXES
+
+async def ensure_time_series(name: str, options: dict) -> bool:
+    if name in await db.list_collection_names(filter={"name": name}):
+        return False
+    await db.create_collection(name, timeseries=options)
+    return True
+
+async def _create_indexes(coll: str, models: List[IndexModel]):
+    # Unique indexes are created one at a time: legacy data with duplicate values can make them fail,
+    # and that must not take the hot-query indexes down with them. The non-unique ones go in one call,
+    # retried one by one if it fails so each bad spec only costs itself.
+    created, errors = [], {}
+
+    async def create(batch: List[IndexModel]) -> bool:
+        try:
+            created.extend(await db[coll].create_indexes(batch))
+            return True
+        except OperationFailure as e:
+            if len(batch) == 1:
+                name = batch[0].document["name"]
+                logger.error(f"Could not create index {name} on {coll}: {e}")
+                errors[name] = str(e)
+            return False
+
+    plain = [m for m in models if not m.document.get("unique")]
+    if len(plain) > 1 and await create(plain):
+        plain = []
+    for model in plain + [m for m in models if m.document.get("unique")]:
+        await create([model])
+    return {"created": created, "errors": errors} if errors else created
+
+async def ensure_indexes() -> dict:
+    # create_indexes is a no-op for indexes that already exist with the same spec.
+    # A failing index (e.g. a unique one over duplicate ids in legacy data) must not block the others.
+    results = {}
+    for coll, options in TIME_SERIES.items():
+        await ensure_time_series(coll, options)
+    for coll, models in INDEXES.items():
+        results[coll] = await _create_indexes(coll, models)
+    return results
+
+async def _index_usage(coll: str) -> dict:
+    try:
+        stats = await db[coll].aggregate([{"$indexStats": {}}]).to_list(None)
+    except OperationFailure:
+        # $indexStats requires clusterMonitor privileges on some deployments
+        return {}
+    return {s["name"]: s.get("accesses", {}).get("ops", 0) for s in stats}
+
+async def index_report() -> dict:
+    report = {}
+    for coll, models in INDEXES.items():
+        expected = {m.document["name"] for m in models}
+        existing = set((await db[coll].index_information()).keys()) - {"_id_"}
+        usage = await _index_usage(coll)
+        report[coll] = {
+            "missing": sorted(expected - existing),
+            "extra": sorted(existing - expected),
+            "unused": sorted(name for name in existing if usage.get(name) == 0),
+        }
+    return report
+
 async def get_db():
     return db
 
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import tempfile
+from typing import AsyncIterator, Iterable, List, Optional
+from openpyxl import Workbook
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "ods": "application/vnd.oasis.opendocument.spreadsheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+FILE_CHUNK_SIZE = 64 * 1024
+# Excel's hard limit, header row included
+XLSX_MAX_ROWS = 1_048_576
+
+def spooled_file():
+    # Stays in memory for small exports and rolls over to disk past EXPORT_SPOOL_MAX_BYTES
+    return tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_BYTES)
+
+def file_response(fileobj, media_type: str, filename: str) -> StreamingResponse:
+    # Streams a finished file so the Content-Length is known up front
+    size = fileobj.tell()
+    fileobj.seek(0)
+
+    def chunks():
+        try:
+            while True:
+                chunk = fileobj.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            fileobj.close()
+
+    return StreamingResponse(
+        chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}", "Content-Length": str(size)}
+    )
+
+def stream_response(body: AsyncIterator[bytes], media_type: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+def csv_line(values: Iterable) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(["" if v is None else v for v in values])
+    return buf.getvalue().encode("utf-8")
+
+def ndjson_line(row: dict) -> bytes:
+    return (json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+async def iter_csv(header: List[str], rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    yield csv_line(header)
+    async for row in rows:
+        yield csv_line(row.get(col) for col in header)
+
+async def iter_ndjson(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    async for row in rows:
+        yield ndjson_line(row)
+
+class XlsxStreamWriter:
+    # Write-only workbook: rows are serialized as they are appended instead of being kept as cell objects.
+    # Sheets that reach Excel's row limit continue on "<title> (2)", "<title> (3)", ...
+    def __init__(self):
+        self.workbook = Workbook(write_only=True)
+        self._sheet = None
+        self._title = None
+        self._header: Optional[List[str]] = None
+        self._rows = 0
+        self._part = 1
+
+    def add_sheet(self, title: str, header: List[str]):
+        self._title = title
+        self._header = header
+        self._part = 1
+        self._open_sheet(title)
+
+    def _open_sheet(self, title: str):
+        # Sheet titles are limited to 31 characters
+        self._sheet = self.workbook.create_sheet(title=title[:31])
+        self._sheet.append(self._header)
+        self._rows = 1
+
+    def append(self, values: list):
+        if self._rows >= XLSX_MAX_ROWS:
+            self._part += 1
+            self._open_sheet(f"{self._title[:26]} ({self._part})")
+        self._sheet.append(values)
+        self._rows += 1
+
+    async def save(self):
+        fileobj = spooled_file()
+        await run_in_threadpool(self.workbook.save, fileobj)
+        return fileobj
@@ -0,0 +1,74 @@
+import hashlib
+import json
+from typing import Awaitable, Callable, Iterable, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from .cache import LRUCache
+from .config import settings
+from .reference_cache import reference_cache
+
+# Conditional GET for read endpoints whose content is fully determined by a few cheap inputs
+# (reference-cache fingerprints, a user's list timestamps). The ETag is computed from those
+# inputs first, so a matching If-None-Match is answered with 304 before any query runs.
+# Bodies are kept pre-serialized per ETag: the same ETag always means the same bytes.
+PUBLIC = "public, no-cache"
+PRIVATE = "private, no-cache"
+
+def etag_for(*parts) -> str:
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+async def catalog_etag(key: str, colls: Iterable[str], *params) -> str:
+    return etag_for(key, params, [(coll, await reference_cache.fingerprint(coll)) for coll in colls])
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes added by proxies still match
+    return etag in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._bodies = LRUCache(max_entries, ttl_seconds)
+        self.not_modified = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def respond(
+        self,
+        request: Request,
+        etag: str,
+        build: Callable[[], Awaitable[object]],
+        cache_control: str = PUBLIC,
+        keep: bool = True,
+    ) -> Response:
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if not_modified(request, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        body: Optional[bytes] = self._bodies.get(etag) if keep else None
+        if body is None:
+            self.misses += 1
+            # Same rendering the app's default response class applies, so clients see identical JSON
+            built = await build()
+            if isinstance(built, Response):
+                body = built.body
+            else:
+                body = ORJSONResponse(content=jsonable_encoder(built)).body
+            if keep:
+                self._bodies.set(etag, body)
+        else:
+            self.hits += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        self._bodies.clear()
+
+    def stats(self) -> dict:
+        return {"bodies": len(self._bodies), "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES, settings.REFERENCE_CACHE_TTL_SECONDS)
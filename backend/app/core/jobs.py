@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, BinaryIO, Callable, Dict, Optional
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+# Progress is written at most this often; jobs call ctx.advance() as often as they like
+PROGRESS_INTERVAL_SECONDS = 1.0
+HEARTBEAT_INTERVAL_SECONDS = 10.0
+# How often expired artifacts are swept while the process runs
+PRUNE_INTERVAL_SECONDS = 3600.0
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    # Handed to the job function: progress reporting, cancellation checks and the artifact directory
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.done = 0
+        self.total: Optional[int] = None
+        self.message: Optional[str] = None
+        self.started = time.monotonic()
+        self._flushed_at = 0.0
+
+    @property
+    def artifact_dir(self) -> str:
+        path = os.path.join(settings.JOB_ARTIFACT_DIR, self.job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def artifact_path(self, filename: str) -> str:
+        return os.path.join(self.artifact_dir, filename)
+
+    def progress_doc(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "progress": {"done": self.done, "total": self.total, "message": self.message},
+            "rate_per_sec": round(self.done / elapsed, 1) if elapsed > 0 else None,
+            "heartbeat_at": _now(),
+        }
+
+    async def advance(self, n: int = 1, total: Optional[int] = None, message: Optional[str] = None):
+        self.done += n
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        if time.monotonic() - self._flushed_at >= PROGRESS_INTERVAL_SECONDS:
+            await self.flush()
+
+    async def flush(self):
+        self._flushed_at = time.monotonic()
+        # The cancel flag is read back on every flush so a cancel sent to another worker still lands
+        job = await db.jobs.find_one_and_update(
+            {"id": self.job_id}, {"$set": self.progress_doc()}, projection={"_id": 0, "cancel_requested": 1}
+        )
+        if job and job.get("cancel_requested"):
+            raise JobCancelled()
+
+JobFunc = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+# Runs admin jobs in the background of this process. At most JOB_WORKERS run at once;
+# the rest wait as "queued". State lives in db.jobs so any worker can report on it.
+class JobRunner:
+    def __init__(self, workers: int):
+        self._slots = asyncio.Semaphore(workers)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pruner: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._pruner is None:
+            self._pruner = asyncio.create_task(self._prune_periodically())
+
+    async def _prune_periodically(self):
+        # JOB_RETENTION_HOURS is enforced on a timer so long-running processes do not accumulate artifacts
+        while True:
+            try:
+                await run_in_threadpool(prune_artifacts)
+            except Exception:
+                logger.exception("Pruning job artifacts failed")
+            await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+
+    async def submit(self, job_type: str, func: JobFunc, user_id: Optional[str] = None, params: Optional[dict] = None) -> dict:
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "status": JOB_QUEUED,
+            "params": params or {},
+            "created_by": user_id,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"done": 0, "total": None, "message": None},
+            "rate_per_sec": None,
+            "result": None,
+            "error": None,
+            "artifact": None,
+            "cancel_requested": False,
+        }
+        await db.jobs.insert_one(dict(job))
+        task = asyncio.create_task(self._run(job["id"], func))
+        self._tasks[job["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job["id"], None))
+        return job
+
+    async def _run(self, job_id: str, func: JobFunc):
+        ctx = JobContext(job_id)
+        # Heartbeats start while the job waits for a slot, so a queued job shows this process is still alive
+        heartbeat = asyncio.create_task(self._heartbeat(ctx))
+        try:
+            try:
+                async with self._slots:
+                    job = await db.jobs.find_one_and_update(
+                        {"id": job_id, "status": JOB_QUEUED},
+                        {"$set": {"status": JOB_RUNNING, "started_at": _now(), "heartbeat_at": _now()}},
+                        projection={"_id": 0, "cancel_requested": 1}
+                    )
+                    if not job or job.get("cancel_requested"):
+                        raise JobCancelled()
+                    ctx.started = time.monotonic()
+                    result = await func(ctx) or {}
+            finally:
+                heartbeat.cancel()
+            artifact = result.pop("artifact", None)
+            await self._finish(job_id, ctx, JOB_SUCCEEDED, result=result, artifact=artifact)
+        except (JobCancelled, asyncio.CancelledError):
+            await self._finish(job_id, ctx, JOB_CANCELLED)
+            shutil.rmtree(os.path.join(settings.JOB_ARTIFACT_DIR, job_id), ignore_errors=True)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            await self._finish(job_id, ctx, JOB_FAILED, error=str(e))
+
+    async def _heartbeat(self, ctx: JobContext):
+        # Keeps heartbeat_at moving for jobs with long steps between progress updates
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            await db.jobs.update_one({"id": ctx.job_id}, {"$set": {"heartbeat_at": _now()}})
+
+    async def _finish(self, job_id: str, ctx: JobContext, status: str, result=None, error=None, artifact=None):
+        update = {**ctx.progress_doc(), "status": status, "finished_at": _now(), "result": result, "error": error}
+        if artifact:
+            update["artifact"] = artifact
+        await db.jobs.update_one({"id": job_id}, {"$set": update})
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "status": {"$nin": list(FINISHED_STATUSES)}},
+            {"$set": {"cancel_requested": True}},
+            projection={"_id": 0}
+        )
+        task = self._tasks.get(job_id)
+        if task:
+            task.cancel()
+        return job
+
+    async def shutdown(self):
+        # Jobs cannot survive the process; record them as cancelled instead of leaving them "running"
+        if self._pruner is not None:
+            self._pruner.cancel()
+            self._pruner = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def artifact(path: str, media_type: str, filename: Optional[str] = None) -> dict:
+    return {"path": path, "filename": filename or os.path.basename(path), "media_type": media_type, "size": os.path.getsize(path)}
+
+def save_file(fileobj: BinaryIO, path: str):
+    fileobj.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out)
+
+async def spool_upload(fileobj: BinaryIO, filename: str) -> str:
+    # Copies an upload next to the job artifacts so a background job can read it after the request
+    upload_dir = os.path.join(settings.JOB_ARTIFACT_DIR, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f"{uuid.uuid4()}-{os.path.basename(filename)}")
+    await run_in_threadpool(save_file, fileobj, path)
+    return path
+
+async def get_job(job_id: str) -> Optional[dict]:
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job or job["status"] not in (JOB_QUEUED, JOB_RUNNING):
+        return job
+    # A queued or running job whose worker stopped heartbeating will never finish
+    stale_before = (datetime.now(timezone.utc) - timedelta(seconds=HEARTBEAT_INTERVAL_SECONDS * 6)).isoformat()
+    last_seen = job.get("heartbeat_at") or job.get("started_at") or job.get("created_at") or ""
+    if last_seen < stale_before:
+        update = {"status": JOB_FAILED, "error": "El proceso que ejecutaba el trabajo se detuvo", "finished_at": _now()}
+        result = await db.jobs.update_one({"id": job_id, "status": job["status"]}, {"$set": update})
+        if result.modified_count:
+            job.update(update)
+        else:
+            job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    return job
+
+def prune_artifacts():
+    # Artifacts are kept for JOB_RETENTION_HOURS; the job documents themselves stay as an audit trail
+    root = settings.JOB_ARTIFACT_DIR
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - settings.JOB_RETENTION_HOURS * 3600
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+job_runner = JobRunner(settings.JOB_WORKERS)
@@ -0,0 +1,206 @@
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Iterable
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from .database import db
+from .price_store import price_store
+
+logger = logging.getLogger(__name__)
+
+# db.latest_prices holds one document per (sellable_product_id, variant).
+# variant "" is the latest observation for the sellable product regardless of attributes;
+# attribute-specific observations additionally get their own entry keyed by the canonical attribute values.
+BASE_VARIANT = ""
+REBUILD_BATCH_SIZE = 1000
+
+def variant_key(attribute_values: Optional[dict]) -> str:
+    if not attribute_values:
+        return BASE_VARIANT
+    return json.dumps(attribute_values, sort_keys=True, ensure_ascii=False)
+
+def _entry(price_doc: dict, sp: Optional[dict], variant: str) -> dict:
+    qty = price_doc.get("quantity", 1) or 1
+    return {
+        "sellable_product_id": price_doc["sellable_product_id"],
+        "variant": variant,
+        "attribute_values": price_doc.get("attribute_values") if variant else None,
+        "product_id": (sp or {}).get("product_id") or price_doc.get("product_id"),
+        "supermarket_id": (sp or {}).get("supermarket_id") or price_doc.get("supermarket_id"),
+        "brand_id": (sp or {}).get("brand_id") or price_doc.get("brand_id"),
+        "price_id": price_doc.get("id"),
+        "price": price_doc["price"],
+        "quantity": qty,
+        "unit_price": price_doc["price"] / qty,
+        "user_id": price_doc.get("user_id"),
+        "created_at": price_doc["created_at"],
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+def _upserts(price_doc: dict, sp: Optional[dict]) -> list:
+    if not price_doc.get("sellable_product_id"):
+        return []
+    variants = {BASE_VARIANT, variant_key(price_doc.get("attribute_values"))}
+    ops = []
+    for variant in variants:
+        entry = _entry(price_doc, sp, variant)
+        # Only replace an older observation. When the stored one is newer the filter misses,
+        # the upsert collides with the unique key and the write is discarded.
+        ops.append(UpdateOne(
+            {"sellable_product_id": entry["sellable_product_id"], "variant": variant,
+             "created_at": {"$lte": entry["created_at"]}},
+            {"$set": entry},
+            upsert=True
+        ))
+    return ops
+
+async def record_latest_price(price_doc: dict, sp: Optional[dict] = None):
+    await record_latest_prices([price_doc], {price_doc.get("sellable_product_id"): sp} if sp else None)
+
+async def record_latest_prices(price_docs: Iterable[dict], sellable_map: Optional[dict] = None):
+    sellable_map = sellable_map or {}
+    ops = []
+    for doc in price_docs:
+        ops.extend(_upserts(doc, sellable_map.get(doc.get("sellable_product_id"))))
+    if not ops:
+        return
+    try:
+        await db.latest_prices.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if errors:
+            raise
+    except DuplicateKeyError:
+        pass
+
+async def get_latest_price(sellable_product_id: str, attribute_values: Optional[dict] = None) -> Optional[dict]:
+    variants = [variant_key(attribute_values)]
+    if variants[0] != BASE_VARIANT:
+        variants.append(BASE_VARIANT)
+    entries = await db.latest_prices.find(
+        {"sellable_product_id": sellable_product_id, "variant": {"$in": variants}}, {"_id": 0}
+    ).to_list(len(variants))
+    by_variant = {e["variant"]: e for e in entries}
+    for variant in variants:
+        if variant in by_variant:
+            return by_variant[variant]
+    return None
+
+async def get_latest_prices(sellable_product_ids: Iterable[str]) -> dict:
+    # Latest observation per sellable product, regardless of attributes
+    ids = list({sid for sid in sellable_product_ids if sid})
+    if not ids:
+        return {}
+    entries = await db.latest_prices.find(
+        {"sellable_product_id": {"$in": ids}, "variant": BASE_VARIANT}, {"_id": 0}
+    ).to_list(None)
+    return {e["sellable_product_id"]: e for e in entries}
+
+async def get_latest_prices_by_product(product_ids: Iterable[str]) -> dict:
+    # Latest observation per product across all its sellable products, in one aggregation
+    # served by the (product_id, variant, created_at) index
+    ids = list({pid for pid in product_ids if pid})
+    if not ids:
+        return {}
+    pipeline = [
+        {"$match": {"product_id": {"$in": ids}, "variant": BASE_VARIANT}},
+        {"$sort": {"product_id": 1, "created_at": -1}},
+        {"$group": {"_id": "$product_id", "latest": {"$first": "$$ROOT"}}},
+    ]
+    result = {}
+    async for row in db.latest_prices.aggregate(pipeline):
+        row["latest"].pop("_id", None)
+        result[row["_id"]] = row["latest"]
+    return result
+
+async def get_product_latest_prices(product_id: str, include_variants: bool = False, since: Optional[str] = None) -> list:
+    # Every latest observation of a product's sellable products in a single indexed query
+    query = {"product_id": product_id}
+    if not include_variants:
+        query["variant"] = BASE_VARIANT
+    if since:
+        query["created_at"] = {"$gte": since}
+    return await db.latest_prices.find(query, {"_id": 0}).to_list(None)
+
+async def get_latest_price_variants(sellable_product_ids: Iterable[str]) -> dict:
+    # All variant entries for the given sellable products, keyed by (sellable_product_id, variant)
+    ids = list({sid for sid in sellable_product_ids if sid})
+    if not ids:
+        return {}
+    entries = await db.latest_prices.find({"sellable_product_id": {"$in": ids}}, {"_id": 0}).to_list(None)
+    return {(e["sellable_product_id"], e["variant"]): e for e in entries}
+
+def pick_latest(variant_map: dict, sellable_product_id: str, attribute_values: Optional[dict] = None) -> Optional[dict]:
+    # Same fallback as the history queries: exact variant first, then any price for the sellable product
+    latest = variant_map.get((sellable_product_id, variant_key(attribute_values)))
+    if not latest and attribute_values:
+        latest = variant_map.get((sellable_product_id, BASE_VARIANT))
+    return latest
+
+def _newest_by_variant(docs: Iterable[dict]) -> dict:
+    # Attribute maps that differ only in key order are grouped apart by the pipeline but share a variant
+    newest = {}
+    for doc in docs:
+        for variant in {BASE_VARIANT, variant_key(doc.get("attribute_values"))}:
+            current = newest.get(variant)
+            if current is None or doc["created_at"] > current["created_at"]:
+                newest[variant] = doc
+    return newest
+
+async def _write_rebuild_batch(batch: list, started_at: str) -> int:
+    sp_ids = [sp_id for sp_id, _ in batch]
+    sps = {sp["id"]: sp async for sp in db.sellable_products.find({"id": {"$in": sp_ids}}, {"_id": 0})}
+    now = datetime.now(timezone.utc).isoformat()
+    ops = []
+    for sp_id, docs in batch:
+        for variant, doc in _newest_by_variant(docs).items():
+            # Replaces whatever is stored, newer or not, unless a price was recorded after the rebuild began:
+            # then the filter misses, the upsert collides with the unique key and the live entry is kept
+            ops.append(ReplaceOne(
+                {"sellable_product_id": sp_id, "variant": variant, "updated_at": {"$not": {"$gte": started_at}}},
+                {**_entry(doc, sps.get(sp_id), variant), "updated_at": now},
+                upsert=True
+            ))
+    try:
+        await db.latest_prices.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+    return len(ops)
+
+async def rebuild_latest_prices() -> dict:
+    started_at = datetime.now(timezone.utc).isoformat()
+    # Newest first through the (sellable_product_id, created_at) index; the first document of each
+    # (sellable product, attribute values) group is its latest observation. Groups are then collected
+    # per sellable product so the base entry can be chosen among them.
+    pipeline = [
+        {"$match": {"sellable_product_id": {"$exists": True, "$ne": None}}},
+        {"$sort": {"sellable_product_id": 1, "created_at": -1}},
+        {"$group": {
+            "_id": {"sp": "$sellable_product_id", "attrs": "$attribute_values"},
+            "doc": {"$first": "$$ROOT"}
+        }},
+        {"$group": {"_id": "$_id.sp", "docs": {"$push": "$doc"}}},
+    ]
+    batch = []
+    sellable_products = entries = 0
+    async for row in price_store.aggregate(pipeline, allowDiskUse=True):
+        batch.append((row["_id"], row["docs"]))
+        sellable_products += 1
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            entries += await _write_rebuild_batch(batch, started_at)
+            batch = []
+    if batch:
+        entries += await _write_rebuild_batch(batch, started_at)
+
+    # Everything the rebuild did not rewrite (and no live write touched since it began) has no
+    # surviving history: deleted or corrected prices, removed variants and sellable products
+    stale = await db.latest_prices.delete_many({"updated_at": {"$not": {"$gte": started_at}}})
+    logger.info(f"Rebuilt latest_prices: {entries} entries, {stale.deleted_count} stale entries removed")
+    return {"entries": entries, "sellable_products": sellable_products, "stale_removed": stale.deleted_count}
+
+async def ensure_latest_prices():
+    # First start after upgrading: fill the collection from history so latest-price reads are not empty
+    if await db.latest_prices.estimated_document_count() == 0 and await price_store.estimated_document_count():
+        await rebuild_latest_prices()
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from .auth_cache import auth_cache
+from .config import settings
+from .database import db
+from .ranking import leaderboard
+
+logger = logging.getLogger(__name__)
+
+# Point and credit awards are buffered per user and written periodically: one bulk_write of $inc
+# for all balances and one insert_many per history collection, instead of two writes per award.
+# Balances therefore lag by at most LEDGER_FLUSH_INTERVAL_SECONDS; consume_credits flushes the
+# user's pending credits first so spending always sees what was earned.
+class Ledger:
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._balances: Dict[str, Dict[str, int]] = defaultdict(lambda: {"points": 0, "credits": 0})
+        self._history: Dict[str, List[dict]] = {"point_history": [], "credit_history": []}
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self.flushes = 0
+        self.entries_written = 0
+
+    def _pending_count(self) -> int:
+        return sum(len(docs) for docs in self._history.values())
+
+    async def award(self, user_id: str, points: int = 0, credits: int = 0, reason: str = ""):
+        now = datetime.now(timezone.utc).isoformat()
+        if points:
+            self._balances[user_id]["points"] += points
+            self._history["point_history"].append({
+                "id": str(uuid.uuid4()), "user_id": user_id, "points": points, "reason": reason, "created_at": now
+            })
+        if credits:
+            self._balances[user_id]["credits"] += credits
+            self._history["credit_history"].append({
+                "id": str(uuid.uuid4()), "user_id": user_id, "amount": credits, "type": "earn", "reason": reason, "created_at": now
+            })
+        if self._flusher is None:
+            # Not running inside the app (CLI, scripts): keep the old write-through behaviour
+            await self.flush()
+        elif self._pending_count() >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_for(self, user_id: str) -> Dict[str, int]:
+        return dict(self._balances.get(user_id) or {"points": 0, "credits": 0})
+
+    def _take(self, user_ids: Optional[Iterable[str]] = None):
+        if user_ids is None:
+            balances, self._balances = dict(self._balances), defaultdict(lambda: {"points": 0, "credits": 0})
+            history, self._history = self._history, {"point_history": [], "credit_history": []}
+            return balances, history
+        selected = set(user_ids)
+        balances = {uid: self._balances.pop(uid) for uid in selected if uid in self._balances}
+        history = {}
+        for coll, docs in self._history.items():
+            history[coll] = [d for d in docs if d["user_id"] in selected]
+            self._history[coll] = [d for d in docs if d["user_id"] not in selected]
+        return balances, history
+
+    def _restore(self, balances: dict, history: dict):
+        for uid, delta in balances.items():
+            for field, amount in delta.items():
+                self._balances[uid][field] += amount
+        for coll, docs in history.items():
+            self._history[coll] = docs + self._history[coll]
+
+    async def flush(self, user_ids: Optional[Iterable[str]] = None) -> int:
+        async with self._lock:
+            balances, history = self._take(user_ids)
+            uids = [uid for uid, delta in balances.items() if delta["points"] or delta["credits"]]
+            ops = [UpdateOne({"id": uid}, {"$inc": {k: v for k, v in balances[uid].items() if v}}) for uid in uids]
+            if not ops and not any(history.values()):
+                return 0
+            try:
+                if ops:
+                    await db.users.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: every op not listed in writeErrors was applied and must not be retried
+                failed = {uids[err["index"]] for err in e.details.get("writeErrors", [])}
+                self._restore(
+                    {uid: balances.pop(uid) for uid in failed},
+                    {coll: [d for d in docs if d["user_id"] in failed] for coll, docs in history.items()}
+                )
+                history = {coll: [d for d in docs if d["user_id"] not in failed] for coll, docs in history.items()}
+                logger.error(f"Ledger flush failed for {len(failed)} users, will retry them")
+            except Exception:
+                # No per-operation outcome (e.g. the connection failed before a reply); keep everything
+                # for the next attempt
+                self._restore(balances, history)
+                logger.exception("Ledger flush failed, will retry")
+                return 0
+            leaderboard.apply({uid: delta["points"] for uid, delta in balances.items()})
+            auth_cache.invalidate_users(balances)
+            # Balances are the source of truth; history is best effort once they are applied
+            written = 0
+            for coll, docs in history.items():
+                if not docs:
+                    continue
+                try:
+                    await db[coll].insert_many(docs, ordered=False)
+                    written += len(docs)
+                except Exception:
+                    logger.exception(f"Ledger could not write {len(docs)} {coll} entries")
+            self.flushes += 1
+            self.entries_written += written
+            return written
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._stopping = False
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # The flusher is woken rather than cancelled so a flush in progress is never cut in half,
+        # then whatever was awarded meanwhile is written before the process exits
+        if self._flusher is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending_users": len(self._balances),
+            "pending_entries": self._pending_count(),
+            "flushes": self.flushes,
+            "entries_written": self.entries_written,
+        }
+
+ledger = Ledger(settings.LEDGER_FLUSH_INTERVAL_SECONDS, settings.LEDGER_MAX_PENDING)
@@ -0,0 +1,54 @@
+import base64
+import binascii
+import json
+from typing import Callable, List, Optional, Tuple
+from fastapi import HTTPException, Response
+
+# Keyset pagination over (created_at, <tiebreak>). The cursor is the last row of the previous page, so
+# every page is a range scan on a (created_at, <tiebreak>) index no matter how far the client has scrolled.
+# ISO timestamps never contain a comma, which keeps the readable cursor simple: "<created_at>,<id>".
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+Cursor = Tuple[str, str]
+
+def parse_before(before: Optional[str]) -> Optional[Cursor]:
+    if not before:
+        return None
+    created_at, sep, doc_id = before.partition(",")
+    if not sep or not created_at or not doc_id:
+        raise HTTPException(status_code=400, detail="Invalid cursor, expected 'created_at,id'")
+    return created_at, doc_id
+
+def encode_cursor(created_at: str, tiebreak: str) -> str:
+    # Opaque variant for endpoints whose tiebreak is not meant to be client-facing
+    raw = json.dumps([created_at, tiebreak], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(token: Optional[str]) -> Optional[Cursor]:
+    if not token:
+        return None
+    try:
+        created_at, tiebreak = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(tiebreak, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, tiebreak
+
+def before_filter(cursor: Optional[Tuple[str, object]], tiebreak: str = "id") -> dict:
+    # Rows strictly older than the cursor in (created_at desc, tiebreak desc) order
+    if cursor is None:
+        return {}
+    created_at, value = cursor
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, tiebreak: {"$lt": value}},
+    ]}
+
+def cursor_of(doc: dict) -> str:
+    return f"{doc['created_at']},{doc['id']}"
+
+def set_next_cursor(response: Response, page: List[dict], limit: int, cursor: Callable[[dict], str] = cursor_of):
+    # A short page is the last one; otherwise the client passes this value back for the next page
+    if len(page) >= limit and page:
+        response.headers[NEXT_CURSOR_HEADER] = cursor(page[-1])
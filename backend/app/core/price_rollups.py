@@ -0,0 +1,234 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+from pymongo import ReplaceOne, UpdateOne
+from .database import db
+from .price_store import price_store
+
+logger = logging.getLogger(__name__)
+
+# db.price_daily holds one document per (sellable_product_id, day) with the open/high/low/close
+# price of that day, the observation count and the sums behind the mean price and unit price.
+# Days are UTC calendar dates as "YYYY-MM-DD", the same order as the ISO strings in prices.created_at.
+GRANULARITIES = ("day", "week", "month")
+REBUILD_BATCH_SIZE = 1000
+
+def day_of(created_at: str) -> str:
+    try:
+        observed = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return str(created_at)[:10]
+    if observed.tzinfo is not None:
+        observed = observed.astimezone(timezone.utc)
+    return observed.date().isoformat()
+
+def bucket_of(day: str, granularity: str) -> str:
+    # Weeks start on Monday and months on the 1st; the bucket is labelled by its first day
+    if granularity == "day":
+        return day
+    d = date.fromisoformat(day)
+    if granularity == "week":
+        return (d - timedelta(days=d.weekday())).isoformat()
+    return d.replace(day=1).isoformat()
+
+def _quantity(price_doc: dict) -> float:
+    return price_doc.get("quantity", 1) or 1
+
+def _summaries(price_docs: Iterable[dict], sellable_map: dict) -> dict:
+    # Folds a batch of observations into one partial rollup per (sellable product, day),
+    # so a list of prices bought together is a single write per sellable product
+    summaries = {}
+    for doc in price_docs:
+        sp_id = doc.get("sellable_product_id")
+        if not sp_id:
+            continue
+        sp = sellable_map.get(sp_id) or {}
+        price = doc["price"]
+        qty = _quantity(doc)
+        unit_price = price / qty
+        created_at = doc["created_at"]
+        key = (sp_id, day_of(created_at))
+        s = summaries.get(key)
+        if s is None:
+            summaries[key] = {
+                "product_id": sp.get("product_id") or doc.get("product_id"),
+                "supermarket_id": sp.get("supermarket_id") or doc.get("supermarket_id"),
+                "brand_id": sp.get("brand_id") or doc.get("brand_id"),
+                "open": price, "open_at": created_at,
+                "close": price, "close_at": created_at, "close_unit_price": unit_price, "close_quantity": qty,
+                "high": price, "low": price,
+                "min_unit_price": unit_price, "max_unit_price": unit_price,
+                "count": 1, "sum_price": price, "sum_unit_price": unit_price,
+            }
+            continue
+        if created_at < s["open_at"]:
+            s["open"], s["open_at"] = price, created_at
+        if created_at >= s["close_at"]:
+            s.update(close=price, close_at=created_at, close_unit_price=unit_price, close_quantity=qty)
+        s["high"] = max(s["high"], price)
+        s["low"] = min(s["low"], price)
+        s["min_unit_price"] = min(s["min_unit_price"], unit_price)
+        s["max_unit_price"] = max(s["max_unit_price"], unit_price)
+        s["count"] += 1
+        s["sum_price"] += price
+        s["sum_unit_price"] += unit_price
+    return summaries
+
+def _merge(key: tuple, s: dict, now: str) -> UpdateOne:
+    # Pipeline update: every expression sees the stored document as it was before this write,
+    # so open/close only move when the batch holds an earlier/later observation than the stored one
+    missing = {"$eq": [{"$type": "$count"}, "missing"]}
+    return UpdateOne(
+        {"sellable_product_id": key[0], "day": key[1]},
+        [{"$set": {
+            "product_id": s["product_id"],
+            "supermarket_id": s["supermarket_id"],
+            "brand_id": s["brand_id"],
+            "open": {"$cond": [{"$or": [missing, {"$lt": [s["open_at"], "$open_at"]}]}, s["open"], "$open"]},
+            "open_at": {"$min": ["$open_at", s["open_at"]]},
+            **{field: {"$cond": [{"$or": [missing, {"$gte": [s["close_at"], "$close_at"]}]}, s[field], f"${field}"]}
+               for field in ("close", "close_unit_price", "close_quantity")},
+            "close_at": {"$max": ["$close_at", s["close_at"]]},
+            "high": {"$max": ["$high", s["high"]]},
+            "low": {"$min": ["$low", s["low"]]},
+            "min_unit_price": {"$min": ["$min_unit_price", s["min_unit_price"]]},
+            "max_unit_price": {"$max": ["$max_unit_price", s["max_unit_price"]]},
+            **{field: {"$add": [{"$ifNull": [f"${field}", 0]}, s[field]]}
+               for field in ("count", "sum_price", "sum_unit_price")},
+            "updated_at": now,
+        }}],
+        upsert=True
+    )
+
+async def record_price_rollups(price_docs: Iterable[dict], sellable_map: Optional[dict] = None):
+    summaries = _summaries(price_docs, sellable_map or {})
+    if not summaries:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    await db.price_daily.bulk_write([_merge(key, s, now) for key, s in summaries.items()], ordered=False)
+
+async def record_price_rollup(price_doc: dict, sp: Optional[dict] = None):
+    await record_price_rollups([price_doc], {price_doc.get("sellable_product_id"): sp} if sp else None)
+
+def _rollup_query(product_id: str, supermarket_id: Optional[str], day_from: Optional[str], day_to: Optional[str]) -> dict:
+    query = {"product_id": product_id}
+    if supermarket_id:
+        query["supermarket_id"] = supermarket_id
+    days = {}
+    if day_from:
+        days["$gte"] = day_from
+    if day_to:
+        days["$lte"] = day_to
+    if days:
+        query["day"] = days
+    return query
+
+async def get_price_series(
+    product_id: str,
+    supermarket_id: Optional[str] = None,
+    day_from: Optional[str] = None,
+    day_to: Optional[str] = None,
+    granularity: str = "day",
+) -> list:
+    # One indexed range over the daily rollups of every sellable product of the product, folded into
+    # buckets oldest first. Open/close across sellable products follow the observation timestamps.
+    buckets = {}
+    cursor = db.price_daily.find(_rollup_query(product_id, supermarket_id, day_from, day_to), {"_id": 0}).sort("day", 1)
+    async for r in cursor:
+        key = bucket_of(r["day"], granularity)
+        b = buckets.get(key)
+        if b is None:
+            buckets[key] = {"date": key, **{k: r[k] for k in (
+                "open", "open_at", "close", "close_at", "close_unit_price", "close_quantity", "high", "low",
+                "min_unit_price", "max_unit_price", "count", "sum_price", "sum_unit_price")}}
+            continue
+        if r["open_at"] < b["open_at"]:
+            b["open"], b["open_at"] = r["open"], r["open_at"]
+        if r["close_at"] >= b["close_at"]:
+            b.update({k: r[k] for k in ("close", "close_at", "close_unit_price", "close_quantity")})
+        b["high"] = max(b["high"], r["high"])
+        b["low"] = min(b["low"], r["low"])
+        b["min_unit_price"] = min(b["min_unit_price"], r["min_unit_price"])
+        b["max_unit_price"] = max(b["max_unit_price"], r["max_unit_price"])
+        for field in ("count", "sum_price", "sum_unit_price"):
+            b[field] += r[field]
+    return list(buckets.values())
+
+async def delete_price_rollups(sellable_product_ids: Iterable[str]):
+    ids = list({sid for sid in sellable_product_ids if sid})
+    if ids:
+        await db.price_daily.delete_many({"sellable_product_id": {"$in": ids}})
+
+def _unit_price_expr() -> dict:
+    quantity = {"$ifNull": ["$quantity", 1]}
+    return {"$divide": ["$price", {"$cond": [{"$gt": [quantity, 0]}, quantity, 1]}]}
+
+async def _flush_rebuild_batch(batch: list) -> int:
+    sp_ids = list({row["_id"]["sp"] for row in batch})
+    sps = {sp["id"]: sp async for sp in db.sellable_products.find(
+        {"id": {"$in": sp_ids}}, {"_id": 0, "id": 1, "product_id": 1, "supermarket_id": 1, "brand_id": 1})}
+    now = datetime.now(timezone.utc).isoformat()
+    ops = []
+    for row in batch:
+        sp_id, day = row["_id"]["sp"], row["_id"]["day"]
+        sp = sps.get(sp_id) or {}
+        first, last = row["first"], row["last"]
+        doc = {
+            "sellable_product_id": sp_id,
+            "day": day,
+            "product_id": sp.get("product_id") or first.get("product_id"),
+            "supermarket_id": sp.get("supermarket_id") or first.get("supermarket_id"),
+            "brand_id": sp.get("brand_id") or first.get("brand_id"),
+            "open": first["price"], "open_at": first["created_at"],
+            "close": last["price"], "close_at": last["created_at"],
+            "close_unit_price": last["price"] / _quantity(last), "close_quantity": _quantity(last),
+            **{k: row[k] for k in ("high", "low", "min_unit_price", "max_unit_price", "count", "sum_price", "sum_unit_price")},
+            "updated_at": now,
+        }
+        ops.append(ReplaceOne({"sellable_product_id": sp_id, "day": day}, doc, upsert=True))
+    await db.price_daily.bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def rebuild_price_daily() -> dict:
+    # Backfill from history, grouped server-side through the (sellable_product_id, created_at) index.
+    # Observations recorded while the rebuild runs are merged into rows it later replaces, so run it
+    # after imports or during a quiet period rather than under live traffic.
+    started_at = datetime.now(timezone.utc).isoformat()
+    projected = {"price": 1, "quantity": 1, "created_at": 1, "product_id": 1, "supermarket_id": 1, "brand_id": 1}
+    day = {"$dateToString": {"format": "%Y-%m-%d", "date": {"$dateFromString": {
+        "dateString": "$created_at", "onError": None, "onNull": None}}}}
+    pipeline = [
+        {"$match": {"sellable_product_id": {"$exists": True, "$ne": None}}},
+        {"$sort": {"sellable_product_id": 1, "created_at": 1}},
+        {"$group": {
+            "_id": {"sp": "$sellable_product_id", "day": {"$ifNull": [day, {"$substrBytes": ["$created_at", 0, 10]}]}},
+            "first": {"$first": {k: f"${k}" for k in projected}},
+            "last": {"$last": {k: f"${k}" for k in projected}},
+            "high": {"$max": "$price"},
+            "low": {"$min": "$price"},
+            "min_unit_price": {"$min": _unit_price_expr()},
+            "max_unit_price": {"$max": _unit_price_expr()},
+            "count": {"$sum": 1},
+            "sum_price": {"$sum": "$price"},
+            "sum_unit_price": {"$sum": _unit_price_expr()},
+        }},
+    ]
+    batch = []
+    written = 0
+    async for row in price_store.aggregate(pipeline, allowDiskUse=True):
+        batch.append(row)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            written += await _flush_rebuild_batch(batch)
+            batch = []
+    if batch:
+        written += await _flush_rebuild_batch(batch)
+
+    # Days whose history no longer exists (deleted prices or sellable products) were not rewritten
+    stale = await db.price_daily.delete_many({"updated_at": {"$lt": started_at}})
+    logger.info(f"Rebuilt price_daily: {written} days, {stale.deleted_count} stale entries removed")
+    return {"days": written, "stale_removed": stale.deleted_count}
+
+async def ensure_price_daily():
+    # First start after upgrading: backfill from history so the analytics charts are not empty
+    if await db.price_daily.estimated_document_count() == 0 and await price_store.estimated_document_count():
+        await rebuild_price_daily()
@@ -0,0 +1,231 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from bson import ObjectId
+from .config import settings
+from .database import db, PRICE_OBSERVATIONS, PRICE_OBSERVATION_INDEXES, PRICE_TIMESERIES, ensure_time_series
+
+# Compatibility layer over price storage. Callers keep using the db.prices document shape
+# (flat ids, created_at as an ISO string) and the subset of the collection API they already used.
+# In "collection" mode every call goes straight to db.prices. In "timeseries" mode observations live in
+# db.price_observations: the ids below are nested under the metaField, created_at becomes the BSON date
+# timeField, and filters, sorts, projections and documents are translated on the way in and out.
+META_FIELDS = ("sellable_product_id", "product_id", "supermarket_id", "brand_id")
+TIME_FIELD = "observed_at"
+# Matches _iso below, so strings built server-side and client-side compare equal
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%S.%L+00:00"
+
+def to_datetime(value: str) -> datetime:
+    observed = datetime.fromisoformat(value)
+    if observed.tzinfo is None:
+        observed = observed.replace(tzinfo=timezone.utc)
+    return observed.astimezone(timezone.utc)
+
+def _iso(value: datetime) -> str:
+    # BSON dates hold milliseconds; naive values from the driver are UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="milliseconds")
+
+def _field(name: str) -> str:
+    if name in META_FIELDS:
+        return f"meta.{name}"
+    if name == "created_at":
+        return TIME_FIELD
+    return name
+
+def _time_value(value):
+    if isinstance(value, str):
+        return to_datetime(value)
+    if isinstance(value, list):
+        return [_time_value(v) for v in value]
+    if isinstance(value, dict):
+        return {op: _time_value(v) for op, v in value.items()}
+    return value
+
+def translate_filter(query: Optional[dict]) -> dict:
+    out = {}
+    for key, value in (query or {}).items():
+        if key in ("$and", "$or", "$nor"):
+            out[key] = [translate_filter(q) for q in value]
+        elif key == "created_at":
+            out[TIME_FIELD] = _time_value(value)
+        else:
+            out[_field(key)] = value
+    return out
+
+def translate_sort(key, direction=None) -> list:
+    if isinstance(key, str):
+        key = [(key, direction if direction is not None else 1)]
+    return [(_field(k), d) for k, d in key]
+
+def translate_projection(projection: Optional[dict]) -> Optional[dict]:
+    if not projection:
+        return projection
+    return {_field(k): v for k, v in projection.items()}
+
+def to_observation(doc: dict) -> dict:
+    # Raises ValueError for an unparsable created_at; a missing one is stamped with the insertion time
+    observation = {k: v for k, v in doc.items() if k not in META_FIELDS and k != "created_at"}
+    observation["meta"] = {k: doc[k] for k in META_FIELDS if doc.get(k) is not None}
+    created_at = doc.get("created_at")
+    observation[TIME_FIELD] = to_datetime(created_at) if isinstance(created_at, str) else (created_at or datetime.now(timezone.utc))
+    return observation
+
+def _observations(docs: List[dict]) -> tuple:
+    converted, invalid = [], 0
+    for doc in docs:
+        try:
+            converted.append(to_observation(doc))
+        except ValueError:
+            invalid += 1
+    return converted, invalid
+
+def from_observation(doc: dict) -> dict:
+    meta = doc.pop("meta", None) or {}
+    observed_at = doc.pop(TIME_FIELD, None)
+    doc.update(meta)
+    if observed_at is not None:
+        doc["created_at"] = _iso(observed_at)
+    return doc
+
+# Rebuilds the db.prices shape inside aggregation pipelines, after any leading $match/$sort
+LEGACY_SHAPE = [
+    {"$set": {
+        "created_at": {"$dateToString": {"format": ISO_FORMAT, "date": f"${TIME_FIELD}"}},
+        **{k: f"$meta.{k}" for k in META_FIELDS},
+    }},
+    {"$unset": ["meta", TIME_FIELD]},
+]
+
+def translate_pipeline(pipeline: List[dict]) -> List[dict]:
+    # Leading $match/$sort stages are rewritten so they still run on the indexes; the rest sees legacy documents
+    head = []
+    for stage in pipeline:
+        if "$match" in stage:
+            head.append({"$match": translate_filter(stage["$match"])})
+        elif "$sort" in stage:
+            head.append({"$sort": dict(translate_sort(list(stage["$sort"].items())))})
+        else:
+            break
+    return head + LEGACY_SHAPE + pipeline[len(head):]
+
+class ObservationCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, key, direction=None):
+        self._cursor = self._cursor.sort(translate_sort(key, direction))
+        return self
+
+    def limit(self, n: int):
+        self._cursor = self._cursor.limit(n)
+        return self
+
+    def skip(self, n: int):
+        self._cursor = self._cursor.skip(n)
+        return self
+
+    def batch_size(self, n: int):
+        self._cursor = self._cursor.batch_size(n)
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return [from_observation(doc) for doc in await self._cursor.to_list(length)]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        async for doc in self._cursor:
+            yield from_observation(doc)
+
+class TimeSeriesPrices:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None) -> ObservationCursor:
+        return ObservationCursor(self.collection.find(translate_filter(filter), translate_projection(projection)))
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None) -> Optional[dict]:
+        cursor = self.find(filter, projection)
+        if sort:
+            cursor.sort(sort)
+        docs = await cursor.limit(1).to_list(1)
+        return docs[0] if docs else None
+
+    async def insert_one(self, doc: dict):
+        # created_at is rewritten to the stored millisecond precision so callers return what a later read sees
+        observation = to_observation(doc)
+        doc["created_at"] = _iso(observation[TIME_FIELD])
+        result = await self.collection.insert_one(observation)
+        doc["_id"] = observation["_id"]
+        return result
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True):
+        observations = [to_observation(doc) for doc in docs]
+        for doc, observation in zip(docs, observations):
+            doc["created_at"] = _iso(observation[TIME_FIELD])
+        result = await self.collection.insert_many(observations, ordered=ordered)
+        for doc, observation in zip(docs, observations):
+            doc["_id"] = observation["_id"]
+        return result
+
+    async def count_documents(self, filter: Optional[dict] = None) -> int:
+        return await self.collection.count_documents(translate_filter(filter))
+
+    async def estimated_document_count(self) -> int:
+        return await self.collection.estimated_document_count()
+
+    def aggregate(self, pipeline: List[dict], **kwargs):
+        return self.collection.aggregate(translate_pipeline(pipeline), **kwargs)
+
+    async def import_batch(self, records: List[dict]) -> dict:
+        # Time-series collections cannot upsert by id, so rows whose id is already stored are skipped,
+        # as are rows whose created_at is not a date
+        ids = [rec["id"] for rec in records if rec.get("id")]
+        existing = {doc["id"] async for doc in self.collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})} if ids else set()
+        fresh, _ = _observations([rec for rec in records if not rec.get("id") or rec["id"] not in existing])
+        if fresh:
+            await self.collection.insert_many(fresh, ordered=False)
+        return {"nInserted": len(fresh), "nUpserted": 0, "nModified": 0}
+
+def timeseries_enabled() -> bool:
+    return settings.PRICE_STORAGE == "timeseries"
+
+price_store = TimeSeriesPrices(db[PRICE_OBSERVATIONS]) if timeseries_enabled() else db.prices
+
+def source(coll: str):
+    # Generic collection access (exports, counts) that resolves "prices" to the configured storage
+    return price_store if coll == "prices" else db[coll]
+
+async def migrate_prices(batch_size: int = 1000, after: Optional[str] = None) -> dict:
+    # Copies db.prices into the time-series collection in _id order, keeping each _id so keyset cursors
+    # handed out before the switch stay valid. Re-run with the returned last_id to resume.
+    target = db[PRICE_OBSERVATIONS]
+    await ensure_time_series(PRICE_OBSERVATIONS, PRICE_TIMESERIES)
+    await target.create_indexes(PRICE_OBSERVATION_INDEXES)
+
+    query = {"_id": {"$gt": ObjectId(after)}} if after else {}
+    copied = invalid = 0
+    last_id = after
+    batch = []
+
+    async def flush():
+        nonlocal copied, invalid, last_id
+        observations, skipped = _observations(batch)
+        if observations:
+            await target.insert_many(observations, ordered=False)
+        copied += len(observations)
+        invalid += skipped
+        last_id = str(batch[-1]["_id"])
+        batch.clear()
+
+    async for doc in db.prices.find(query).sort("_id", 1).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return {"copied": copied, "invalid_created_at": invalid, "last_id": last_id,
+            "source_count": await db.prices.count_documents({}),
+            "target_count": await target.count_documents({})}
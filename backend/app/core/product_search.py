@@ -0,0 +1,116 @@
+import logging
+import re
+import unicodedata
+from datetime import datetime, timezone
+from typing import List, Optional
+from pymongo import ReplaceOne
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+# db.product_search holds one document per product with its name lower-cased and accent-folded
+# ("Plátano de Canarias" -> "platano de canarias"), the words of that name and every prefix of each word.
+# A query matches when each of its words is a prefix of some word of the name, which is an equality
+# match on the multikey `terms` index, together with the category/brand filters in the same index.
+# Ranking: exact name, then names starting with the query, then whole-word hits, then shorter names.
+MAX_PREFIX = 20
+REBUILD_BATCH_SIZE = 1000
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+def normalize(text: Optional[str]) -> str:
+    folded = unicodedata.normalize("NFKD", text or "")
+    folded = "".join(c for c in folded if not unicodedata.combining(c)).lower()
+    return " ".join(_NON_WORD.split(folded)).strip()
+
+def words(text: Optional[str]) -> List[str]:
+    return normalize(text).split()
+
+def search_entry(product: dict) -> dict:
+    product_id = product.get("id") or str(product.get("_id"))
+    name_words = words(product.get("name"))
+    terms = {word[:n] for word in name_words for n in range(1, min(len(word), MAX_PREFIX) + 1)}
+    return {
+        "product_id": product_id,
+        "name": " ".join(name_words),
+        "words": sorted(set(name_words)),
+        "terms": sorted(terms),
+        "category_id": product.get("category_id"),
+        "brand_id": product.get("brand_id"),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+async def index_product(product: dict):
+    entry = search_entry(product)
+    await db.product_search.replace_one({"product_id": entry["product_id"]}, entry, upsert=True)
+
+async def unindex_product(product_id: str):
+    await db.product_search.delete_one({"product_id": product_id})
+
+def _filters(category_id: Optional[str], brand_id: Optional[str]) -> dict:
+    query = {}
+    if category_id:
+        query["category_id"] = category_id
+    if brand_id:
+        query["brand_id"] = brand_id
+    return query
+
+async def search_product_ids(
+    q: str = "",
+    category_id: Optional[str] = None,
+    brand_id: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 50,
+    collection=None,
+) -> List[str]:
+    collection = collection if collection is not None else db.product_search
+    query_words = list(dict.fromkeys(word[:MAX_PREFIX] for word in words(q)))
+    match = _filters(category_id, brand_id)
+    if not query_words:
+        # Browsing a category or brand: alphabetical, served by the (filter, name) indexes
+        cursor = collection.find(match, {"_id": 0, "product_id": 1}).sort([("name", 1), ("product_id", 1)])
+        return [row["product_id"] async for row in cursor.skip(offset).limit(limit)]
+
+    phrase = " ".join(query_words)
+    match["terms"] = query_words[0] if len(query_words) == 1 else {"$all": query_words}
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {
+            "score": {"$add": [
+                {"$cond": [{"$eq": ["$name", phrase]}, 4, 0]},
+                {"$cond": [{"$eq": [{"$indexOfCP": ["$name", phrase]}, 0]}, 2, 0]},
+                {"$size": {"$setIntersection": ["$words", query_words]}},
+            ]},
+            "length": {"$strLenCP": "$name"},
+        }},
+        {"$sort": {"score": -1, "length": 1, "name": 1, "product_id": 1}},
+        {"$skip": offset},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "product_id": 1}},
+    ]
+    return [row["product_id"] async for row in collection.aggregate(pipeline)]
+
+async def rebuild_product_search() -> dict:
+    started_at = datetime.now(timezone.utc).isoformat()
+    projection = {"id": 1, "name": 1, "category_id": 1, "brand_id": 1}
+    batch = []
+    indexed = 0
+    async for product in db.products.find({}, projection):
+        entry = search_entry(product)
+        batch.append(ReplaceOne({"product_id": entry["product_id"]}, entry, upsert=True))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            await db.product_search.bulk_write(batch, ordered=False)
+            indexed += len(batch)
+            batch = []
+    if batch:
+        await db.product_search.bulk_write(batch, ordered=False)
+        indexed += len(batch)
+
+    # Products deleted since the last rebuild were not rewritten
+    stale = await db.product_search.delete_many({"updated_at": {"$lt": started_at}})
+    logger.info(f"Rebuilt product_search: {indexed} products, {stale.deleted_count} stale entries removed")
+    return {"products": indexed, "stale_removed": stale.deleted_count}
+
+async def ensure_product_search():
+    # First start after upgrading: build the index once so search does not come back empty
+    if await db.product_search.estimated_document_count() == 0 and await db.products.estimated_document_count():
+        await rebuild_product_search()
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from sortedcontainers import SortedList
+from .config import settings
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+# In-memory leaderboard ordered by (-points, user_id). Point awards are applied as the ledger
+# flushes them; a periodic resync from Mongo picks up changes made by other workers.
+# Top-N and rank lookups are O(log n) instead of a sort or count over the users collection.
+class Leaderboard:
+    def __init__(self, resync_seconds: float):
+        self.resync_seconds = resync_seconds
+        self._order = SortedList()
+        self._users: Dict[str, Tuple[int, Optional[str]]] = {}
+        # Users seen in an award but not yet loaded; their real totals are read on the next lookup
+        self._unknown = set()
+        # Users awarded while a resync scans Mongo; None when no resync is running
+        self._touched: Optional[set] = None
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._syncer: Optional[asyncio.Task] = None
+
+    async def _resync(self):
+        # An award applied during the scan may have been read before its write reached Mongo, so the
+        # users it touched are read again after the scan, until no award lands during a re-read.
+        # The swap itself has no await in between, so nothing can be applied to the old snapshot after it.
+        order = SortedList()
+        users = {}
+
+        def load(u: dict):
+            current = users.get(u["id"])
+            if current is not None:
+                order.remove((-current[0], u["id"]))
+            points = u.get("points", 0) or 0
+            users[u["id"]] = (points, u.get("name"))
+            order.add((-points, u["id"]))
+
+        self._touched = set()
+        try:
+            async for u in db.users.find({}, {"_id": 0, "id": 1, "name": 1, "points": 1}):
+                if u.get("id"):
+                    load(u)
+            while self._touched:
+                ids, self._touched = list(self._touched), set()
+                async for u in db.users.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "name": 1, "points": 1}):
+                    load(u)
+        finally:
+            self._touched = None
+        self._order, self._users = order, users
+        self._unknown.clear()
+        self._loaded_at = time.monotonic()
+        logger.debug(f"Leaderboard resynced with {len(users)} users")
+
+    async def _ready(self):
+        if self._loaded_at is None:
+            async with self._lock:
+                if self._loaded_at is None:
+                    await self._resync()
+        if self._unknown:
+            ids = list(self._unknown)
+            self._unknown.difference_update(ids)
+            async for u in db.users.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "name": 1, "points": 1}):
+                self._set(u["id"], u.get("points", 0) or 0, u.get("name"))
+
+    def _set(self, user_id: str, points: int, name: Optional[str]):
+        current = self._users.get(user_id)
+        if current is not None:
+            self._order.remove((-current[0], user_id))
+        self._users[user_id] = (points, name)
+        self._order.add((-points, user_id))
+
+    def apply(self, deltas: Dict[str, int]):
+        # Called with the point increments that were just written to Mongo
+        if self._touched is not None:
+            self._touched.update(deltas)
+        if self._loaded_at is None:
+            return
+        for user_id, delta in deltas.items():
+            current = self._users.get(user_id)
+            if current is None:
+                self._unknown.add(user_id)
+            elif delta:
+                self._set(user_id, current[0] + delta, current[1])
+
+    async def top(self, limit: int) -> List[dict]:
+        await self._ready()
+        return [
+            {"user_id": user_id, "user_name": self._users[user_id][1], "points": -neg_points, "rank": i + 1}
+            for i, (neg_points, user_id) in enumerate(self._order.islice(0, limit))
+        ]
+
+    async def rank(self, user_id: str, points: Optional[int] = None) -> int:
+        # Same definition as before: one more than the number of users with strictly more points
+        await self._ready()
+        if points is None:
+            points = self._users.get(user_id, (0, None))[0]
+        return self._order.bisect_left((-points, "")) + 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resync_seconds)
+            try:
+                async with self._lock:
+                    await self._resync()
+            except Exception:
+                logger.exception("Leaderboard resync failed")
+
+    def start(self):
+        if self._syncer is None:
+            self._syncer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._syncer is not None:
+            self._syncer.cancel()
+            self._syncer = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "pending_lookups": len(self._unknown),
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            "resync_seconds": self.resync_seconds,
+        }
+
+leaderboard = Leaderboard(settings.LEADERBOARD_RESYNC_SECONDS)
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Optional
+from .config import settings
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+# Catalog collections that change only through the admin handlers
+REFERENCE_COLLECTIONS = ("brands", "categories", "units", "supermarkets", "attributes", "products")
+
+# Process-local copy of the catalog collections, keyed by id.
+# Entries are reloaded when an admin handler invalidates them or, as a safety net for
+# writes made by other workers, once they are older than the TTL.
+class ReferenceCache:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._docs: Dict[str, Dict[str, dict]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._versions: Dict[str, int] = {coll: 0 for coll in REFERENCE_COLLECTIONS}
+        self._fingerprints: Dict[str, str] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, coll: str) -> bool:
+        loaded_at = self._loaded_at.get(coll)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds
+
+    async def _load(self, coll: str):
+        docs = {}
+        async for doc in db[coll].find({}):
+            doc_id = doc.get("id") or str(doc.get("_id"))
+            doc.pop("_id", None)
+            doc["id"] = doc_id
+            docs[doc_id] = doc
+        self._docs[coll] = docs
+        # Digest of the loaded content: unlike the version counter it is the same on every worker
+        # that holds the same data, so it can back ETags
+        self._fingerprints[coll] = hashlib.sha256(
+            json.dumps(docs, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        self._loaded_at[coll] = time.monotonic()
+        logger.debug(f"Loaded {len(docs)} {coll} into the reference cache")
+
+    async def docs(self, coll: str) -> Dict[str, dict]:
+        # Shared documents: callers must copy before mutating
+        if self._fresh(coll):
+            self.hits += 1
+            return self._docs[coll]
+        lock = self._locks.setdefault(coll, asyncio.Lock())
+        async with lock:
+            # Another request may have reloaded while we waited for the lock
+            if self._fresh(coll):
+                self.hits += 1
+            else:
+                self.misses += 1
+                await self._load(coll)
+        return self._docs[coll]
+
+    async def get(self, coll: str, doc_id: Optional[str]) -> Optional[dict]:
+        if not doc_id:
+            return None
+        return (await self.docs(coll)).get(doc_id)
+
+    async def names(self, coll: str) -> Dict[str, str]:
+        return {doc_id: doc.get("name") for doc_id, doc in (await self.docs(coll)).items()}
+
+    async def name(self, coll: str, doc_id: Optional[str]) -> Optional[str]:
+        doc = await self.get(coll, doc_id)
+        return doc.get("name") if doc else None
+
+    async def fingerprint(self, coll: str) -> str:
+        await self.docs(coll)
+        return self._fingerprints[coll]
+
+    def invalidate(self, *colls: str):
+        for coll in colls or REFERENCE_COLLECTIONS:
+            self._loaded_at.pop(coll, None)
+            self._docs.pop(coll, None)
+            self._fingerprints.pop(coll, None)
+            self._versions[coll] = self._versions.get(coll, 0) + 1
+
+    def version(self, coll: str) -> int:
+        return self._versions.get(coll, 0)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds,
+            "collections": {
+                coll: {
+                    "version": self._versions.get(coll, 0),
+                    "size": len(self._docs.get(coll, {})),
+                    "fresh": self._fresh(coll),
+                }
+                for coll in REFERENCE_COLLECTIONS
+            },
+        }
+
+reference_cache = ReferenceCache(settings.REFERENCE_CACHE_TTL_SECONDS)
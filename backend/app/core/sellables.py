@@ -0,0 +1,101 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from .cache import LRUCache
+from .config import settings
+from .database import db
+
+def _doc_id(sp: dict) -> str:
+    return sp.get("id") or str(sp.get("_id"))
+
+# Resolves sellable products referenced by a page of prices or a shopping list without
+# loading the whole collection. Documents are cached by id and legacy candidates by
+# (product_id, supermarket_id); admin writes to sellable_products clear both.
+class SellableResolver:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._by_id = LRUCache(max_entries, ttl_seconds)
+        self._by_key = LRUCache(max_entries, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, sellable_product_id: Optional[str]) -> Optional[dict]:
+        if not sellable_product_id:
+            return None
+        return (await self.get_many([sellable_product_id])).get(sellable_product_id)
+
+    async def get_many(self, ids: Iterable[Optional[str]]) -> Dict[str, dict]:
+        found = {}
+        missing = []
+        for sid in {i for i in ids if i}:
+            sp = self._by_id.get(sid)
+            if sp is not None:
+                self.hits += 1
+                found[sid] = sp
+            else:
+                self.misses += 1
+                missing.append(sid)
+        if missing:
+            # Legacy documents may only be addressable by their ObjectId
+            query = {"id": {"$in": missing}}
+            oids = [ObjectId(sid) for sid in missing if ObjectId.is_valid(sid)]
+            if oids:
+                query = {"$or": [query, {"_id": {"$in": oids}}]}
+            async for sp in db.sellable_products.find(query):
+                sid = _doc_id(sp)
+                self._by_id.set(sid, sp)
+                found[sid] = sp
+        return found
+
+    async def candidates(self, pairs: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], List[dict]]:
+        found = {}
+        missing = []
+        for key in {p for p in pairs if p[0] and p[1]}:
+            cached = self._by_key.get(key)
+            if cached is not None:
+                self.hits += 1
+                found[key] = cached
+            else:
+                self.misses += 1
+                missing.append(key)
+        if missing:
+            fetched = {key: [] for key in missing}
+            query = {"$or": [{"product_id": pid, "supermarket_id": sm_id} for pid, sm_id in missing]}
+            async for sp in db.sellable_products.find(query):
+                fetched[(sp["product_id"], sp["supermarket_id"])].append(sp)
+            for key, sps in fetched.items():
+                self._by_key.set(key, sps)
+                for sp in sps:
+                    self._by_id.set(_doc_id(sp), sp)
+            found.update(fetched)
+        return found
+
+    async def for_items(self, items: Iterable[dict], list_supermarket_id: Optional[str] = None) -> Tuple[dict, dict]:
+        # Returns the (sellable_map, sellable_lookup) pair expected by _resolve_sellable_product,
+        # restricted to what the given items reference
+        items = list(items)
+        sellable_map = await self.get_many(item.get("sellable_product_id") for item in items)
+        pairs = [
+            (item.get("product_id"), item.get("supermarket_id") or list_supermarket_id)
+            for item in items
+            if item.get("sellable_product_id") not in sellable_map
+        ]
+        sellable_lookup = await self.candidates(pairs) if pairs else {}
+        return sellable_map, sellable_lookup
+
+    def invalidate(self):
+        self._by_id.clear()
+        self._by_key.clear()
+
+    async def mark_changed(self):
+        # Called after every write to sellable_products: clears this worker's caches and bumps the shared
+        # version, which other workers' responses (shopping-list ETags) depend on
+        self.invalidate()
+        await db.catalog_versions.update_one({"_id": "sellable_products"}, {"$inc": {"version": 1}}, upsert=True)
+
+    async def version(self) -> int:
+        doc = await db.catalog_versions.find_one({"_id": "sellable_products"})
+        return (doc or {}).get("version", 0)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "cached_ids": len(self._by_id), "cached_keys": len(self._by_key)}
+
+sellable_resolver = SellableResolver(settings.SELLABLE_CACHE_MAX_ENTRIES, settings.REFERENCE_CACHE_TTL_SECONDS)
@@ -0,0 +1,28 @@
+from functools import lru_cache
+from typing import Iterable, List, Type, Union
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, TypeAdapter
+from .config import settings
+
+# Fast path for large list responses. Handlers hand over plain row dicts shaped like the response
+# schema; the whole list is validated in one TypeAdapter call and dumped once. The default path builds
+# each model in the handler, then FastAPI dumps it and validates it again against response_model.
+# Handlers opt in per endpoint by returning model_list(...); FAST_SERIALIZATION=false restores the
+# default path everywhere, which is what `cli response-bench` compares against.
+# model_construct was measured too: skipping validation is slower than pydantic-core validating in bulk.
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def render_list(model: Type[BaseModel], rows: Iterable[dict]) -> bytes:
+    # Same JSON the app's default response class renders for a validated response_model
+    adapter = _list_adapter(model)
+    items = adapter.validate_python(list(rows))
+    return ORJSONResponse(adapter.dump_python(items, mode="json", by_alias=True)).body
+
+def model_list(model: Type[BaseModel], rows: Iterable[dict]) -> Union[Response, List[BaseModel]]:
+    if settings.FAST_SERIALIZATION:
+        return Response(content=render_list(model, rows), media_type="application/json")
+    return [model(**row) for row in rows]
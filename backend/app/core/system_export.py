@@ -0,0 +1,148 @@
+import hashlib
+import json
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from .price_store import source
+from starlette.concurrency import run_in_threadpool
+import pandas as pd
+from .exports import MEDIA_TYPES, XlsxStreamWriter, csv_line, ndjson_line, spooled_file
+
+# Called with the number of documents written since the last call, once per cursor batch
+Progress = Optional[Callable[[int], Awaitable[None]]]
+
+CATALOG_COLLECTIONS = [
+    "categories", "brands", "supermarkets", "attributes",
+    "units", "products", "product_units", "brand_product_catalog",
+    "sellable_products", "sellable_product_units"
+]
+
+SYSTEM_EXPORT_FORMATS = {
+    "ndjson.gz": "application/gzip",
+    "csv.zip": "application/zip",
+    "xlsx": MEDIA_TYPES["xlsx"],
+    "ods": MEDIA_TYPES["ods"],
+}
+
+# Documents are schemaless, so tabular formats need the union of keys before the first row is written.
+# The scan runs server-side and only the distinct key names come back.
+async def collection_fields(coll: str) -> List[str]:
+    pipeline = [
+        {"$project": {"_id": 0, "kv": {"$objectToArray": "$$ROOT"}}},
+        {"$unwind": "$kv"},
+        {"$group": {"_id": "$kv.k"}},
+    ]
+    keys = [row["_id"] async for row in source(coll).aggregate(pipeline, allowDiskUse=True)]
+    keys = [k for k in keys if k != "_id"]
+    # Keep the id first so exports read naturally and imports can upsert on it
+    return sorted(keys, key=lambda k: (k != "id", k))
+
+def _cell(value):
+    # Nested values are written as JSON so the importer can restore them
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+async def _documents(coll: str, batch_size: int, progress: Progress = None) -> AsyncIterator[dict]:
+    count = 0
+    async for doc in source(coll).find({}, {"_id": 0}).batch_size(batch_size):
+        yield doc
+        count += 1
+        if progress and count % batch_size == 0:
+            await progress(batch_size)
+    if progress and count % batch_size:
+        await progress(count % batch_size)
+
+def _manifest(fmt: str, collections: dict) -> dict:
+    return {
+        "format": fmt,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "collections": collections,
+    }
+
+async def iter_ndjson_gz(collections: List[str], batch_size: int, progress: Progress = None) -> AsyncIterator[bytes]:
+    # One gzip stream of {"collection", "doc"} lines, closed by a {"manifest"} line.
+    # Compressed chunks are yielded as they are produced, so memory stays flat whatever the size.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    stats = {}
+    for coll in collections:
+        digest = hashlib.sha256()
+        count = 0
+        async for doc in _documents(coll, batch_size, progress):
+            line = ndjson_line({"collection": coll, "doc": doc})
+            digest.update(line)
+            count += 1
+            chunk = compressor.compress(line)
+            if chunk:
+                yield chunk
+        stats[coll] = {"count": count, "sha256": digest.hexdigest()}
+    yield compressor.compress(ndjson_line({"manifest": _manifest("ndjson.gz", stats)}))
+    yield compressor.flush()
+
+async def write_csv_zip(collections: List[str], batch_size: int, progress: Progress = None):
+    # One <collection>.csv member per collection plus manifest.json, in a spooled temp file.
+    # Rows are encoded here and deflated in the threadpool one cursor batch at a time, off the event loop.
+    fileobj = spooled_file()
+    stats = {}
+    archive = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED)
+    try:
+        for coll in collections:
+            fields = await collection_fields(coll)
+            digest = hashlib.sha256()
+            count = 0
+            member = archive.open(f"{coll}.csv", "w", force_zip64=True)
+            try:
+                pending = [csv_line(fields)]
+                async for doc in _documents(coll, batch_size, progress):
+                    pending.append(csv_line(_cell(doc.get(f)) for f in fields))
+                    count += 1
+                    if len(pending) >= batch_size:
+                        chunk = b"".join(pending)
+                        pending.clear()
+                        digest.update(chunk)
+                        await run_in_threadpool(member.write, chunk)
+                chunk = b"".join(pending)
+                digest.update(chunk)
+                await run_in_threadpool(member.write, chunk)
+            finally:
+                await run_in_threadpool(member.close)
+            stats[coll] = {"count": count, "sha256": digest.hexdigest(), "member": f"{coll}.csv", "fields": fields}
+        manifest = json.dumps(_manifest("csv.zip", stats), ensure_ascii=False, indent=2)
+        await run_in_threadpool(archive.writestr, "manifest.json", manifest)
+    finally:
+        await run_in_threadpool(archive.close)
+    return fileobj, stats
+
+async def write_xlsx(collections: List[str], batch_size: int, progress: Progress = None):
+    # One sheet per collection; slower than the other formats and limited by Excel's row cap
+    writer = XlsxStreamWriter()
+    stats = {}
+    for coll in collections:
+        fields = await collection_fields(coll)
+        writer.add_sheet(coll, fields)
+        count = 0
+        async for doc in _documents(coll, batch_size, progress):
+            writer.append([_cell(doc.get(f)) for f in fields])
+            count += 1
+        stats[coll] = {"count": count}
+    return await writer.save(), stats
+
+async def write_ods(collections: List[str], batch_size: int, progress: Progress = None):
+    # odfpy has no streaming writer, so this path still builds one DataFrame per collection
+    frames = {}
+    stats = {}
+    for coll in collections:
+        fields = await collection_fields(coll)
+        rows = [[_cell(doc.get(f)) for f in fields] async for doc in _documents(coll, batch_size, progress)]
+        frames[coll] = pd.DataFrame(rows, columns=fields)
+        stats[coll] = {"count": len(rows)}
+
+    def save(fileobj):
+        with pd.ExcelWriter(fileobj, engine="odf") as writer:
+            for coll, df in frames.items():
+                df.to_excel(writer, sheet_name=coll, index=False)
+
+    fileobj = spooled_file()
+    await run_in_threadpool(save, fileobj)
+    return fileobj, stats
@@ -0,0 +1,297 @@
+import ast
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import re
+import time
+import zipfile
+from collections import defaultdict
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+import pandas as pd
+from openpyxl import load_workbook
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .database import db
+from .price_store import price_store, timeseries_enabled
+from .system_export import CATALOG_COLLECTIONS, Progress
+
+logger = logging.getLogger(__name__)
+
+IMPORTABLE_COLLECTIONS = CATALOG_COLLECTIONS + ["prices"]
+IMPORT_EXTENSIONS = (".ndjson.gz", ".ndjson", ".jsonl", ".csv.zip", ".zip", ".csv", ".xlsx", ".xls", ".ods")
+# Cells that look like a serialized dict/list; older spreadsheet exports wrote Python reprs, newer ones JSON.
+# DOTALL so pretty-printed values spanning several lines match too.
+_JSON_LIKE = re.compile(r"^\s*(\{.*\}|\[.*\])\s*$", re.S)
+# Errors kept per batch so a bad file does not produce a huge response
+MAX_ERRORS_PER_BATCH = 5
+
+Chunk = Tuple[str, List[dict]]
+
+def import_format(filename: str) -> Optional[str]:
+    name = (filename or "").lower()
+    for ext in IMPORT_EXTENSIONS:
+        if name.endswith(ext):
+            return ext.lstrip(".")
+    return None
+
+def _parse_literal(value: str):
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+def _present(value) -> bool:
+    if isinstance(value, (dict, list)):
+        return True
+    return pd.notna(value)
+
+def _frame_records(df: pd.DataFrame) -> List[dict]:
+    # Only string cells that look like a dict/list go through the per-value parser. Object columns can
+    # also hold booleans or numbers next to blanks, where the .str accessor would raise.
+    for col in df.select_dtypes(include=["object", "string"]).columns:
+        mask = df[col].map(lambda v: isinstance(v, str) and _JSON_LIKE.match(v) is not None).astype(bool)
+        if mask.any():
+            df[col] = df[col].astype(object)
+            df.loc[mask, col] = df.loc[mask, col].map(_parse_literal)
+    # NaN means "no value" for every tabular format; Mongo should not receive it
+    return [{k: v for k, v in rec.items() if _present(v)} for rec in df.to_dict(orient="records")]
+
+def _id_dtypes(columns) -> dict:
+    # Identifiers stay strings even when they look numeric
+    return {c: str for c in columns if c == "id" or c.endswith("_id")}
+
+def _iter_csv(fileobj, collection: str, batch_size: int) -> Iterator[Chunk]:
+    try:
+        header = pd.read_csv(fileobj, nrows=0).columns
+    except pd.errors.EmptyDataError:
+        # Empty collections are exported without a header row
+        return
+    fileobj.seek(0)
+    for df in pd.read_csv(fileobj, chunksize=batch_size, dtype=_id_dtypes(header)):
+        yield collection, _frame_records(df)
+
+def _iter_csv_zip(fileobj, batch_size: int) -> Iterator[Chunk]:
+    with zipfile.ZipFile(fileobj) as archive:
+        for name in archive.namelist():
+            if not name.endswith(".csv"):
+                continue
+            with archive.open(name) as member:
+                yield from _iter_csv(member, name.rsplit("/", 1)[-1][:-4], batch_size)
+
+def _iter_xlsx(fileobj, batch_size: int) -> Iterator[Chunk]:
+    # Read-only mode parses rows lazily instead of building the whole workbook
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header:
+                continue
+            columns = [str(c) if c is not None else f"column_{i}" for i, c in enumerate(header)]
+            ids = [i for i, c in enumerate(columns) if c == "id" or c.endswith("_id")]
+            batch = []
+            for row in rows:
+                row = list(row)
+                for i in ids:
+                    if row[i] is not None:
+                        row[i] = str(row[i])
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield ws.title, _frame_records(pd.DataFrame(batch, columns=columns))
+                    batch = []
+            if batch:
+                yield ws.title, _frame_records(pd.DataFrame(batch, columns=columns))
+    finally:
+        wb.close()
+
+def _iter_spreadsheet(fileobj, batch_size: int) -> Iterator[Chunk]:
+    # .xls and .ods have no streaming reader; each sheet is parsed whole and written in batches
+    for sheet_name, df in pd.read_excel(fileobj, sheet_name=None).items():
+        for start in range(0, len(df), batch_size):
+            yield sheet_name, _frame_records(df.iloc[start:start + batch_size].copy())
+
+class _NdjsonReader:
+    # Lines are {"collection": ..., "doc": {...}} as written by the ndjson export, with an optional
+    # trailing {"manifest": ...}. Checksums are recomputed on the raw lines for the manifest check.
+    def __init__(self, fileobj, batch_size: int):
+        self.fileobj = fileobj
+        self.batch_size = batch_size
+        self.manifest = None
+        self.digests = defaultdict(hashlib.sha256)
+
+    def __iter__(self) -> Iterator[Chunk]:
+        buffers = defaultdict(list)
+        for line in self.fileobj:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if "manifest" in row:
+                self.manifest = row["manifest"]
+                continue
+            coll = row.get("collection")
+            self.digests[coll].update(line)
+            buffers[coll].append(row.get("doc") or {})
+            if len(buffers[coll]) >= self.batch_size:
+                yield coll, buffers.pop(coll)
+        for coll, docs in buffers.items():
+            yield coll, docs
+
+    def verify(self, stats: dict) -> Optional[dict]:
+        if not self.manifest:
+            return None
+        mismatches = {}
+        for coll, expected in self.manifest.get("collections", {}).items():
+            rows = stats.get(coll, {}).get("rows", 0)
+            digest = self.digests[coll].hexdigest() if coll in self.digests else hashlib.sha256().hexdigest()
+            if rows != expected.get("count") or digest != expected.get("sha256"):
+                mismatches[coll] = {"expected": expected.get("count"), "read": rows}
+        return {"ok": not mismatches, "mismatches": mismatches}
+
+class BulkImporter:
+    # Batches are written as unordered bulk upserts keyed by id. Parsing waits for a free slot
+    # before scheduling the next write, so at most `concurrency` batches are held in memory.
+    def __init__(self, batch_size: int, concurrency: int, progress: Progress = None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self._written = 0
+        self._reported = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._buffers = defaultdict(list)
+        self.stats = {}
+        self.skipped = set()
+
+    def _coll_stats(self, coll: str) -> dict:
+        return self.stats.setdefault(coll, {"rows": 0, "upserted": 0, "modified": 0, "inserted": 0, "batches": 0, "errors": []})
+
+    async def add(self, coll: str, records: List[dict]):
+        if coll not in IMPORTABLE_COLLECTIONS:
+            self.skipped.add(coll)
+            return
+        buffer = self._buffers[coll]
+        buffer.extend(records)
+        while len(buffer) >= self.batch_size:
+            await self._schedule(coll, buffer[:self.batch_size])
+            del buffer[:self.batch_size]
+        await self._report()
+
+    async def _report(self):
+        # Runs on the parsing loop rather than in the write tasks, so a cancelled job stops parsing too
+        if self.progress and self._written > self._reported:
+            written = self._written
+            await self.progress(written - self._reported)
+            self._reported = written
+
+    async def _schedule(self, coll: str, batch: List[dict]):
+        stats = self._coll_stats(coll)
+        stats["batches"] += 1
+        await self._slots.acquire()
+        task = asyncio.create_task(self._write(coll, stats["batches"], batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, coll: str, number: int, batch: List[dict]):
+        stats = self.stats[coll]
+        stats["rows"] += len(batch)
+        ops = [
+            UpdateOne({"id": rec["id"]}, {"$set": rec}, upsert=True) if "id" in rec else InsertOne(rec)
+            for rec in batch
+        ]
+        try:
+            if coll == "prices" and timeseries_enabled():
+                details = await price_store.import_batch(batch)
+            else:
+                result = await db[coll].bulk_write(ops, ordered=False)
+                details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            errors = details.get("writeErrors", [])
+            stats["errors"].append({
+                "batch": number,
+                "failed": len(errors),
+                "messages": [err.get("errmsg") for err in errors[:MAX_ERRORS_PER_BATCH]],
+            })
+        except Exception as e:
+            logger.exception(f"Import batch {number} of {coll} failed")
+            details = {}
+            stats["errors"].append({"batch": number, "failed": len(batch), "messages": [str(e)]})
+        finally:
+            self._slots.release()
+            self._written += len(batch)
+        stats["upserted"] += details.get("nUpserted", 0)
+        stats["modified"] += details.get("nModified", 0)
+        stats["inserted"] += details.get("nInserted", 0)
+
+    async def finish(self) -> dict:
+        for coll, buffer in list(self._buffers.items()):
+            if buffer:
+                await self._schedule(coll, list(buffer))
+        self._buffers.clear()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        await self._report()
+        return self.stats
+
+def _open_reader(fileobj: BinaryIO, fmt: str, filename: str, batch_size: int, collection: Optional[str]):
+    if fmt == "ndjson.gz":
+        return _NdjsonReader(gzip.GzipFile(fileobj=fileobj, mode="rb"), batch_size)
+    if fmt in ("ndjson", "jsonl"):
+        return _NdjsonReader(fileobj, batch_size)
+    if fmt in ("csv.zip", "zip"):
+        return _iter_csv_zip(fileobj, batch_size)
+    if fmt == "csv":
+        # A single CSV holds one collection, named by the parameter or the file name
+        name = collection or filename.rsplit("/", 1)[-1][:-4]
+        return _iter_csv(fileobj, name, batch_size)
+    if fmt == "xlsx":
+        return _iter_xlsx(fileobj, batch_size)
+    return _iter_spreadsheet(fileobj, batch_size)
+
+async def import_file(
+    fileobj: BinaryIO,
+    filename: str,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    collection: Optional[str] = None,
+    progress: Progress = None,
+) -> dict:
+    fmt = import_format(filename)
+    if fmt is None:
+        raise ValueError(f"Unsupported file type: {filename}")
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    importer = BulkImporter(batch_size, concurrency or settings.IMPORT_CONCURRENCY, progress)
+    started = time.monotonic()
+
+    reader = _open_reader(fileobj, fmt, filename, batch_size, collection)
+    chunks = iter(reader)
+    # Parsing is CPU-bound and runs in the threadpool one chunk at a time,
+    # overlapping with the writes already scheduled on the event loop
+    while True:
+        chunk = await run_in_threadpool(next, chunks, None)
+        if chunk is None:
+            break
+        await importer.add(*chunk)
+    stats = await importer.finish()
+
+    elapsed = time.monotonic() - started
+    rows = sum(s["rows"] for s in stats.values())
+    result = {
+        "format": fmt,
+        "results": stats,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else rows,
+        "skipped_collections": sorted(c for c in importer.skipped if c),
+    }
+    if isinstance(reader, _NdjsonReader):
+        result["manifest"] = reader.verify(stats)
+    logger.info(f"Imported {rows} rows from {filename} in {elapsed:.1f}s")
+    return result
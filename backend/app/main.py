@@ -1,15 +1,25 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 import logging
 from .core.config import settings
-from .core.database import close_db_connection
+from .core.compression import CompressionMiddleware
+from .core.pagination import NEXT_CURSOR_HEADER
+from .core.database import close_db_connection, ensure_indexes
+from .core.latest_prices import ensure_latest_prices
+from .core.price_rollups import ensure_price_daily
+from .core.product_search import ensure_product_search
+from .core.alerts import alert_engine
+from .core.jobs import job_runner
+from .core.ledger import ledger
+from .core.ranking import leaderboard
 from .routers import auth, admin, prices, shopping_lists, social, analytics, search, public, user_features
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title=settings.PROJECT_NAME)
+app = FastAPI(title=settings.PROJECT_NAME, default_response_class=ORJSONResponse)
 
 # CORS Middleware
 origins = [
@@ -24,7 +34,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["*"],
+    # Credentialed requests do not honour the "*" wildcard, so response headers read by the frontend are listed
+    expose_headers=[NEXT_CURSOR_HEADER, "X-Credits-Remaining", "Idempotent-Replayed", "ETag"],
+)
+
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    level=settings.COMPRESSION_LEVEL,
+    encodings=tuple(e.strip() for e in settings.COMPRESSION_ENCODINGS.split(",") if e.strip()),
 )
 
 # Include Routers
@@ -38,8 +56,23 @@ app.include_router(search.router, prefix="/api")
 app.include_router(public.router, prefix="/api")
 app.include_router(user_features.router, prefix="/api")
 
+@app.on_event("startup")
+async def startup_event():
+    await ensure_indexes()
+    await ensure_latest_prices()
+    await ensure_price_daily()
+    await ensure_product_search()
+    job_runner.start()
+    alert_engine.start()
+    ledger.start()
+    leaderboard.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    await job_runner.shutdown()
+    await alert_engine.stop()
+    await ledger.stop()
+    await leaderboard.stop()
     await close_db_connection()
 
 @app.get("/")
@@ -13,6 +13,7 @@ class PostResponse(BaseModel):
     user_id: str
     user_name: str
     reactions: dict
+    my_reaction: Optional[str] = None
     comments_count: int
     created_at: str
 
@@ -32,10 +33,18 @@ class ReactionCreate(BaseModel):
 
 # Analytics
 class PriceHistoryResponse(BaseModel):
+    # One bucket of the price_daily rollups; price/unit_price/quantity are those of the last observation
     date: str
     price: float
     unit_price: Optional[float] = None
     quantity: Optional[float] = None
+    open: Optional[float] = None
+    high: Optional[float] = None
+    low: Optional[float] = None
+    close: Optional[float] = None
+    avg_price: Optional[float] = None
+    avg_unit_price: Optional[float] = None
+    count: Optional[int] = None
 
 class ProductAnalyticsResponse(BaseModel):
     product_id: str
@@ -43,6 +52,7 @@ class ProductAnalyticsResponse(BaseModel):
     supermarket_id: Optional[str] = None
     supermarket_name: Optional[str] = None
     unit_name: Optional[str] = None
+    granularity: str = "day"
     current_price: Optional[float] = None
     current_unit_price: Optional[float] = None
     avg_price: Optional[float] = None
@@ -1,8 +1,30 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Query, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
+import os
 import uuid
-from ..core.database import db
+from ..core.database import db, ensure_indexes, index_report
 from ..core.auth import get_admin_user, get_current_user
+from ..core.alerts import alert_engine
+from ..core.auth_cache import auth_cache
+from ..core.http_cache import PRIVATE, catalog_etag, response_cache
+from ..core.jobs import JobContext, artifact, get_job, job_runner, save_file, spool_upload
+from ..core.latest_prices import rebuild_latest_prices
+from ..core.price_rollups import delete_price_rollups, rebuild_price_daily
+from ..core.price_store import source
+from ..core.product_search import index_product, rebuild_product_search, unindex_product
+from ..core.ledger import ledger
+from ..core.ranking import leaderboard
+from ..core.reference_cache import reference_cache
+from ..core.serialization import model_list
+from ..core.sellables import sellable_resolver
+from ..core.config import settings
+from ..core.exports import file_response, stream_response
+from ..core.system_import import IMPORTABLE_COLLECTIONS, import_file, import_format
+from ..core.system_export import (
+    CATALOG_COLLECTIONS, Progress, SYSTEM_EXPORT_FORMATS, iter_ndjson_gz, write_csv_zip, write_ods, write_xlsx
+)
 from ..models.product import (
     CategoryCreate, CategoryResponse, BrandCreate, BrandResponse,
     SupermarketCreate, SupermarketResponse, UnitCreate, UnitResponse,
@@ -12,9 +34,6 @@ from ..models.product import (
     BrandProductCatalogCreate, BrandProductCatalogBulkCreate, BrandProductCatalogResponse,
     AttributeCreate, AttributeResponse
 )
-import pandas as pd
-import io
-from fastapi.responses import StreamingResponse
 from fastapi import UploadFile, File
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -75,12 +94,13 @@ async def create_category(data: CategoryCreate, user: dict = Depends(get_admin_u
     cat_id = str(uuid.uuid4())
     doc = {"id": cat_id, "name": data.name, "description": data.description}
     await db.categories.insert_one(doc)
+    reference_cache.invalidate("categories")
     return CategoryResponse(**doc)
 
 @router.get("/categories", response_model=List[CategoryResponse])
 async def get_categories(user: dict = Depends(get_current_user)):
-    cats = await db.categories.find({}).to_list(1000)
-    return [CategoryResponse(**map_id(c)) for c in cats]
+    cats = await reference_cache.docs("categories")
+    return [CategoryResponse(**c) for c in cats.values()]
 
 @router.put("/categories/{cat_id}", response_model=CategoryResponse)
 async def update_category(cat_id: str, data: CategoryCreate, user: dict = Depends(get_admin_user)):
@@ -94,6 +114,7 @@ async def update_category(cat_id: str, data: CategoryCreate, user: dict = Depend
             pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    reference_cache.invalidate("categories")
     return CategoryResponse(id=cat_id, name=data.name, description=data.description)
 
 @router.delete("/categories/{cat_id}")
@@ -107,6 +128,7 @@ async def delete_category(cat_id: str, user: dict = Depends(get_admin_user)):
             pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    reference_cache.invalidate("categories")
     return {"message": "Category deleted"}
 
 # Brands
@@ -115,12 +137,17 @@ async def create_brand(data: BrandCreate, user: dict = Depends(get_admin_user)):
     brand_id = str(uuid.uuid4())
     doc = {"id": brand_id, "name": data.name, "logo_url": data.logo_url}
     await db.brands.insert_one(doc)
+    reference_cache.invalidate("brands")
     return BrandResponse(**doc)
 
 @router.get("/brands", response_model=List[BrandResponse])
-async def get_brands(user: dict = Depends(get_current_user)):
-    brands = await db.brands.find({}).to_list(1000)
-    return [BrandResponse(**map_id(b)) for b in brands]
+async def get_brands(request: Request, user: dict = Depends(get_current_user)):
+    async def build():
+        brands = await reference_cache.docs("brands")
+        return [BrandResponse(**b) for b in brands.values()]
+
+    etag = await catalog_etag("admin/brands", ["brands"])
+    return await response_cache.respond(request, etag, build, cache_control=PRIVATE)
 
 @router.put("/brands/{brand_id}", response_model=BrandResponse)
 async def update_brand(brand_id: str, data: BrandCreate, user: dict = Depends(get_admin_user)):
@@ -132,6 +159,7 @@ async def update_brand(brand_id: str, data: BrandCreate, user: dict = Depends(ge
         except: pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Brand not found")
+    reference_cache.invalidate("brands")
     return BrandResponse(id=brand_id, name=data.name, logo_url=data.logo_url)
 
 @router.delete("/brands/{brand_id}")
@@ -144,6 +172,7 @@ async def delete_brand(brand_id: str, user: dict = Depends(get_admin_user)):
         except: pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Brand not found")
+    reference_cache.invalidate("brands")
     return {"message": "Brand deleted"}
 
 # Supermarkets
@@ -152,12 +181,13 @@ async def create_supermarket(data: SupermarketCreate, user: dict = Depends(get_a
     sm_id = str(uuid.uuid4())
     doc = {"id": sm_id, "name": data.name, "logo_url": data.logo_url}
     await db.supermarkets.insert_one(doc)
+    reference_cache.invalidate("supermarkets")
     return SupermarketResponse(**doc)
 
 @router.get("/supermarkets", response_model=List[SupermarketResponse])
 async def get_supermarkets(user: dict = Depends(get_current_user)):
-    sms = await db.supermarkets.find({}).to_list(1000)
-    return [SupermarketResponse(**map_id(s)) for s in sms]
+    sms = await reference_cache.docs("supermarkets")
+    return [SupermarketResponse(**s) for s in sms.values()]
 
 @router.put("/supermarkets/{sm_id}", response_model=SupermarketResponse)
 async def update_supermarket(sm_id: str, data: SupermarketCreate, user: dict = Depends(get_admin_user)):
@@ -169,6 +199,7 @@ async def update_supermarket(sm_id: str, data: SupermarketCreate, user: dict = D
         except: pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Supermarket not found")
+    reference_cache.invalidate("supermarkets")
     return SupermarketResponse(id=sm_id, name=data.name, logo_url=data.logo_url)
 
 @router.delete("/supermarkets/{sm_id}")
@@ -181,6 +212,7 @@ async def delete_supermarket(sm_id: str, user: dict = Depends(get_admin_user)):
         except: pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Supermarket not found")
+    reference_cache.invalidate("supermarkets")
     return {"message": "Supermarket deleted"}
 
 # Attributes
@@ -189,12 +221,13 @@ async def create_attribute(data: AttributeCreate, user: dict = Depends(get_admin
     attr_id = str(uuid.uuid4())
     doc = {"id": attr_id, "name": data.name, "description": data.description, "values": data.values}
     await db.attributes.insert_one(doc)
+    reference_cache.invalidate("attributes")
     return AttributeResponse(**doc)
 
 @router.get("/attributes", response_model=List[AttributeResponse])
 async def get_attributes(user: dict = Depends(get_current_user)):
-    attrs = await db.attributes.find({}).to_list(1000)
-    return [AttributeResponse(**map_id(a)) for a in attrs]
+    attrs = await reference_cache.docs("attributes")
+    return [AttributeResponse(**a) for a in attrs.values()]
 
 @router.put("/attributes/{attr_id}", response_model=AttributeResponse)
 async def update_attribute(attr_id: str, data: AttributeCreate, user: dict = Depends(get_admin_user)):
@@ -207,6 +240,7 @@ async def update_attribute(attr_id: str, data: AttributeCreate, user: dict = Dep
         except: pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Attribute not found")
+    reference_cache.invalidate("attributes")
     return AttributeResponse(id=attr_id, **update_data)
 
 @router.delete("/attributes/{attr_id}")
@@ -219,6 +253,7 @@ async def delete_attribute(attr_id: str, user: dict = Depends(get_admin_user)):
         except: pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Attribute not found")
+    reference_cache.invalidate("attributes")
     return {"message": "Attribute deleted"}
 
 # Units
@@ -227,12 +262,17 @@ async def create_unit(data: UnitCreate, user: dict = Depends(get_admin_user)):
     unit_id = str(uuid.uuid4())
     doc = {"id": unit_id, "name": data.name, "abbreviation": data.abbreviation}
     await db.units.insert_one(doc)
+    reference_cache.invalidate("units")
     return UnitResponse(**doc)
 
 @router.get("/units", response_model=List[UnitResponse])
-async def get_units(user: dict = Depends(get_current_user)):
-    units = await db.units.find({}).to_list(1000)
-    return [UnitResponse(**map_id(u)) for u in units]
+async def get_units(request: Request, user: dict = Depends(get_current_user)):
+    async def build():
+        units = await reference_cache.docs("units")
+        return [UnitResponse(**u) for u in units.values()]
+
+    etag = await catalog_etag("admin/units", ["units"])
+    return await response_cache.respond(request, etag, build, cache_control=PRIVATE)
 
 @router.put("/units/{unit_id}", response_model=UnitResponse)
 async def update_unit(unit_id: str, data: UnitCreate, user: dict = Depends(get_admin_user)):
@@ -244,6 +284,7 @@ async def update_unit(unit_id: str, data: UnitCreate, user: dict = Depends(get_a
         except: pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Unit not found")
+    reference_cache.invalidate("units")
     return UnitResponse(id=unit_id, name=data.name, abbreviation=data.abbreviation)
 
 @router.delete("/units/{unit_id}")
@@ -256,6 +297,7 @@ async def delete_unit(unit_id: str, user: dict = Depends(get_admin_user)):
         except: pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Unit not found")
+    reference_cache.invalidate("units")
     return {"message": "Unit deleted"}
 
 # Products (Generic)
@@ -276,11 +318,13 @@ async def create_product(data: ProductCreate, user: dict = Depends(get_admin_use
         "attribute_values": data.attribute_values
     }
     await db.products.insert_one(doc)
+    reference_cache.invalidate("products")
+    await index_product(doc)
 
-    brand = await db.brands.find_one({"id": data.brand_id}, {"_id": 0}) if data.brand_id else None
-    category = await db.categories.find_one({"id": data.category_id}, {"_id": 0})
-    unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0}) if data.unit_id else None
-    base_product = await db.products.find_one({"id": data.base_product_id}, {"_id": 0}) if data.base_product_id else None
+    brand = await reference_cache.get("brands", data.brand_id)
+    category = await reference_cache.get("categories", data.category_id)
+    unit = await reference_cache.get("units", data.unit_id)
+    base_product = await reference_cache.get("products", data.base_product_id)
 
     return ProductResponse(
         **map_id(doc),
@@ -292,17 +336,16 @@ async def create_product(data: ProductCreate, user: dict = Depends(get_admin_use
 
 @router.get("/products", response_model=List[ProductResponse])
 async def get_products(user: dict = Depends(get_current_user)):
-    products_raw = await db.products.find({}).to_list(1000)
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
-    categories = {c.get("id") or str(c.get("_id")): c["name"] for c in await db.categories.find({}).to_list(1000)}
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.units.find({}).to_list(1000)}
+    products_raw = list((await reference_cache.docs("products")).values())
+    brands = await reference_cache.names("brands")
+    categories = await reference_cache.names("categories")
+    units = await reference_cache.names("units")
 
     # Pre-map base products for inheritance
     base_prods = {p.get("id") or str(p.get("_id")): p for p in products_raw if p.get("is_base")}
 
     result = []
     for p in products_raw:
-        p = map_id(p)
         base_id = p.get("base_product_id")
         base_p = base_prods.get(base_id) if base_id else None
 
@@ -319,7 +362,7 @@ async def get_products(user: dict = Depends(get_current_user)):
         resp_dict.pop("category_id", None)
         resp_dict.pop("unit_id", None)
 
-        result.append(ProductResponse(
+        result.append(dict(
             **resp_dict,
             brand_id=inherited_brand_id,
             brand_name=brands.get(inherited_brand_id),
@@ -329,7 +372,7 @@ async def get_products(user: dict = Depends(get_current_user)):
             unit_name=units.get(inherited_unit_id),
             base_product_name=base_p.get("name") if base_p else None
         ))
-    return result
+    return model_list(ProductResponse, result)
 
 @router.put("/products/{prod_id}", response_model=ProductResponse)
 async def update_product(prod_id: str, data: ProductCreate, user: dict = Depends(get_admin_user)):
@@ -353,11 +396,13 @@ async def update_product(prod_id: str, data: ProductCreate, user: dict = Depends
         except: pass
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    reference_cache.invalidate("products")
+    await index_product({"id": prod_id, **update_data})
 
-    brand = await db.brands.find_one({"id": data.brand_id}, {"_id": 0}) if data.brand_id else None
-    category = await db.categories.find_one({"id": data.category_id}, {"_id": 0})
-    unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0}) if data.unit_id else None
-    base_product = await db.products.find_one({"id": data.base_product_id}, {"_id": 0}) if data.base_product_id else None
+    brand = await reference_cache.get("brands", data.brand_id)
+    category = await reference_cache.get("categories", data.category_id)
+    unit = await reference_cache.get("units", data.unit_id)
+    base_product = await reference_cache.get("products", data.base_product_id)
 
     return ProductResponse(
         id=prod_id,
@@ -378,11 +423,12 @@ async def delete_product(prod_id: str, user: dict = Depends(get_admin_user)):
         except: pass
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    reference_cache.invalidate("products")
+    await unindex_product(prod_id)
     return {"message": "Product deleted"}
 
 # Sellable Products
-@router.post("/sellable-products/bulk")
-async def create_sellable_products_bulk(data: SellableProductBulkCreate, user: dict = Depends(get_admin_user)):
+async def _link_brand_products(data: SellableProductBulkCreate, progress: Progress = None) -> dict:
     results = []
 
     # Always link all active products of the brand to the supermarket
@@ -392,6 +438,8 @@ async def create_sellable_products_bulk(data: SellableProductBulkCreate, user: d
     }).to_list(1000)
 
     for entry in brand_entries:
+        if progress:
+            await progress(1)
         pid = entry["product_id"]
         # We don't store variant attributes in sellable_products anymore
         # as availability is defined at Brand-Product level, and variants
@@ -418,8 +466,25 @@ async def create_sellable_products_bulk(data: SellableProductBulkCreate, user: d
             existing_sp_id = existing.get("id") or str(existing.get("_id"))
             if existing_sp_id:
                 await _sync_product_units_to_sellable_product(existing_sp_id, pid)
+    if results:
+        await sellable_resolver.mark_changed()
     return {"message": f"Marca vinculada. {len(results)} productos operativos añadidos.", "product_ids": results}
 
+@router.post("/sellable-products/bulk")
+async def create_sellable_products_bulk(
+    data: SellableProductBulkCreate,
+    response: Response,
+    background: bool = False,
+    user: dict = Depends(get_admin_user)
+):
+    if background:
+        response.status_code = 202
+        return await job_runner.submit(
+            "sellable_products_bulk", lambda ctx: _link_brand_products(data, ctx.advance),
+            user["id"], data.model_dump()
+        )
+    return await _link_brand_products(data)
+
 @router.post("/sellable-products", response_model=SellableProductResponse)
 async def create_sellable_product(data: SellableProductCreate, user: dict = Depends(get_admin_user)):
     sp_id = str(uuid.uuid4())
@@ -443,11 +508,12 @@ async def create_sellable_product(data: SellableProductCreate, user: dict = Depe
         warning = f"El estado de este producto en el catálogo de marca es: {catalog_entry['status']}"
 
     await db.sellable_products.insert_one(doc)
+    await sellable_resolver.mark_changed()
     await _sync_product_units_to_sellable_product(sp_id, data.product_id)
 
-    supermarket = await db.supermarkets.find_one({"id": data.supermarket_id}, {"_id": 0})
-    product = await db.products.find_one({"id": data.product_id}, {"_id": 0})
-    brand = await db.brands.find_one({"id": data.brand_id}, {"_id": 0})
+    supermarket = await reference_cache.get("supermarkets", data.supermarket_id)
+    product = await reference_cache.get("products", data.product_id)
+    brand = await reference_cache.get("brands", data.brand_id)
 
     return SellableProductResponse(
         **map_id(doc),
@@ -469,9 +535,9 @@ async def get_sellable_products(
 
     items = await db.sellable_products.find(query).to_list(1000)
 
-    supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in await db.supermarkets.find({}).to_list(1000)}
-    products = {p.get("id") or str(p.get("_id")): p["name"] for p in await db.products.find({}).to_list(1000)}
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
+    supermarkets = await reference_cache.names("supermarkets")
+    products = await reference_cache.names("products")
+    brands = await reference_cache.names("brands")
 
     return [SellableProductResponse(
         **map_id(item),
@@ -493,6 +559,9 @@ async def delete_sellable_product(sp_id: str, user: dict = Depends(get_admin_use
         # Fallback: check if sp_id is actually a product_id and user wants to delete all variants (dangerous, but maybe helpful if UI is broken)
         # For now, let's just stick to 404 to be safe, but ensure the UI passes the right ID.
         raise HTTPException(status_code=404, detail=f"Sellable product with ID {sp_id} not found")
+    await sellable_resolver.mark_changed()
+    await db.latest_prices.delete_many({"sellable_product_id": sp_id})
+    await delete_price_rollups([sp_id])
 
     await db.sellable_product_units.delete_many({"sellable_product_id": sp_id})
     return {"message": "Sellable product deleted"}
@@ -510,12 +579,15 @@ async def delete_brand_from_supermarket(sm_id: str, brand_id: str, user: dict =
     # Delete associated units
     if sp_ids:
         await db.sellable_product_units.delete_many({"sellable_product_id": {"$in": sp_ids}})
+        await db.latest_prices.delete_many({"sellable_product_id": {"$in": sp_ids}})
+        await delete_price_rollups(sp_ids)
 
     # Deletes all products of the brand in the supermarket
     result = await db.sellable_products.delete_many({
         "supermarket_id": sm_id,
         "brand_id": brand_id
     })
+    await sellable_resolver.mark_changed()
 
     return {"message": f"Brand removed from supermarket. {result.deleted_count} products deleted."}
 
@@ -524,14 +596,14 @@ async def delete_brand_from_supermarket(sm_id: str, brand_id: str, user: dict =
 async def create_product_unit(data: ProductUnitCreate, user: dict = Depends(get_admin_user)):
     existing = await db.product_units.find_one({"product_id": data.product_id, "unit_id": data.unit_id})
     if existing:
-        unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0})
+        unit = await reference_cache.get("units", data.unit_id)
         return ProductUnitResponse(**map_id(existing), unit_name=unit["name"] if unit else None)
 
     pu_id = str(uuid.uuid4())
     doc = {"id": pu_id, "product_id": data.product_id, "unit_id": data.unit_id}
     await db.product_units.insert_one(doc)
     await _sync_product_unit_to_all_sellables(data.product_id, data.unit_id)
-    unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0})
+    unit = await reference_cache.get("units", data.unit_id)
     return ProductUnitResponse(**map_id(doc), unit_name=unit["name"] if unit else None)
 
 @router.get("/product-units", response_model=List[ProductUnitResponse])
@@ -540,13 +612,13 @@ async def get_all_product_units(product_id: Optional[str] = None, user: dict = D
     if product_id:
         query["product_id"] = product_id
     items = await db.product_units.find(query).to_list(10000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.units.find({}).to_list(1000)}
+    units = await reference_cache.names("units")
     return [ProductUnitResponse(**map_id(item), unit_name=units.get(item.get("unit_id"))) for item in items]
 
 @router.get("/product-units/{product_id}", response_model=List[ProductUnitResponse])
 async def get_product_units(product_id: str, user: dict = Depends(get_current_user)):
     items = await db.product_units.find({"product_id": product_id}).to_list(1000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.units.find({}).to_list(1000)}
+    units = await reference_cache.names("units")
     return [ProductUnitResponse(**map_id(item), unit_name=units.get(item.get("unit_id"))) for item in items]
 
 @router.delete("/product-units/{pu_id}")
@@ -572,11 +644,11 @@ async def delete_product_unit(pu_id: str, user: dict = Depends(get_admin_user)):
 
     return {"message": "Product unit deleted"}
 
-@router.post("/product-units/rebuild")
-async def rebuild_product_unit_relationships(user: dict = Depends(get_admin_user)):
-    product_units = await db.product_units.find({}).to_list(20000)
+async def _rebuild_product_units(progress: Progress = None) -> dict:
     processed = 0
-    for pu in product_units:
+    async for pu in db.product_units.find({}):
+        if progress:
+            await progress(1)
         product_id = pu.get("product_id")
         unit_id = pu.get("unit_id")
         if not product_id or not unit_id:
@@ -586,6 +658,17 @@ async def rebuild_product_unit_relationships(user: dict = Depends(get_admin_user
 
     return {"message": "Relaciones reconstruidas", "product_unit_links_processed": processed}
 
+async def _rebuild_product_units_job(ctx: JobContext) -> dict:
+    ctx.total = await db.product_units.count_documents({})
+    return await _rebuild_product_units(ctx.advance)
+
+@router.post("/product-units/rebuild")
+async def rebuild_product_unit_relationships(response: Response, background: bool = False, user: dict = Depends(get_admin_user)):
+    if background:
+        response.status_code = 202
+        return await job_runner.submit("product_units_rebuild", _rebuild_product_units_job, user["id"])
+    return await _rebuild_product_units()
+
 # Sellable Product Units
 @router.post("/sellable-product-units", response_model=SellableProductUnitResponse)
 async def create_sellable_product_unit(data: SellableProductUnitCreate, user: dict = Depends(get_admin_user)):
@@ -594,13 +677,13 @@ async def create_sellable_product_unit(data: SellableProductUnitCreate, user: di
         "unit_id": data.unit_id
     })
     if existing:
-        unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0})
+        unit = await reference_cache.get("units", data.unit_id)
         return SellableProductUnitResponse(**map_id(existing), unit_name=unit["name"] if unit else None)
 
     spu_id = str(uuid.uuid4())
     doc = {"id": spu_id, "sellable_product_id": data.sellable_product_id, "unit_id": data.unit_id}
     await db.sellable_product_units.insert_one(doc)
-    unit = await db.units.find_one({"id": data.unit_id}, {"_id": 0})
+    unit = await reference_cache.get("units", data.unit_id)
     return SellableProductUnitResponse(**map_id(doc), unit_name=unit["name"] if unit else None)
 
 @router.get("/sellable-product-units", response_model=List[SellableProductUnitResponse])
@@ -621,13 +704,13 @@ async def get_all_sellable_product_units(
         query["sellable_product_id"] = {"$in": sp_ids}
 
     items = await db.sellable_product_units.find(query).to_list(10000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.units.find({}).to_list(1000)}
+    units = await reference_cache.names("units")
     return [SellableProductUnitResponse(**map_id(item), unit_name=units.get(item.get("unit_id"))) for item in items]
 
 @router.get("/sellable-product-units/{sp_id}", response_model=List[SellableProductUnitResponse])
 async def get_sellable_product_units(sp_id: str, user: dict = Depends(get_current_user)):
     items = await db.sellable_product_units.find({"sellable_product_id": sp_id}).to_list(1000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.units.find({}).to_list(1000)}
+    units = await reference_cache.names("units")
     return [SellableProductUnitResponse(**map_id(item), unit_name=units.get(item.get("unit_id"))) for item in items]
 
 @router.delete("/sellable-product-units/{spu_id}")
@@ -700,8 +783,8 @@ async def create_brand_catalog_entry(data: BrandProductCatalogCreate, user: dict
         }
         await db.brand_product_catalog.insert_one(doc)
 
-    brand = await db.brands.find_one({"id": data.brand_id}, {"_id": 0})
-    product = await db.products.find_one({"id": data.product_id}, {"_id": 0})
+    brand = await reference_cache.get("brands", data.brand_id)
+    product = await reference_cache.get("products", data.product_id)
 
     return BrandProductCatalogResponse(
         **map_id(doc),
@@ -715,8 +798,8 @@ async def get_brand_catalog(brand_id: Optional[str] = None, user: dict = Depends
     if brand_id: query["brand_id"] = brand_id
     items = await db.brand_product_catalog.find(query).to_list(1000)
 
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
-    products = {p.get("id") or str(p.get("_id")): p["name"] for p in await db.products.find({}).to_list(1000)}
+    brands = await reference_cache.names("brands")
+    products = await reference_cache.names("products")
 
     return [BrandProductCatalogResponse(
         **map_id(item),
@@ -744,96 +827,185 @@ async def delete_brand_catalog_entry(entry_id: str, user: dict = Depends(get_adm
     return {"message": "Brand catalog entry deleted"}
 
 # --- SYSTEM MANAGEMENT (Bulk Export/Import) ---
-@router.get("/system/export")
-async def export_system_data(format: str = "xlsx", include_prices: bool = False, user: dict = Depends(get_admin_user)):
-    collections = [
-        "categories", "brands", "supermarkets", "attributes", 
-        "units", "products", "product_units", "brand_product_catalog", 
-        "sellable_products", "sellable_product_units"
-    ]
+def _export_collections(include_prices: bool) -> List[str]:
+    collections = list(CATALOG_COLLECTIONS)
     if include_prices:
         collections.append("prices")
-    
-    output = io.BytesIO()
-    engine = 'openpyxl' if format == "xlsx" else 'odf'
+    return collections
+
+def _check_export_format(format: str):
+    if format not in SYSTEM_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no soportado. Usa uno de: {', '.join(SYSTEM_EXPORT_FORMATS)}")
+
+EXPORT_WRITERS = {"csv.zip": write_csv_zip, "xlsx": write_xlsx, "ods": write_ods}
+# ndjson.gz chunks are written to the artifact file in slices of about this size
+EXPORT_WRITE_BUFFER_BYTES = 1 << 20
+
+@router.get("/system/export")
+async def export_system_data(
+    format: str = "ndjson.gz",
+    include_prices: bool = False,
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=100000),
+    user: dict = Depends(get_admin_user)
+):
+    _check_export_format(format)
+    collections = _export_collections(include_prices)
     filename = f"pricehive_system_data.{format}"
-    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if format == "xlsx" else "application/vnd.oasis.opendocument.spreadsheet"
-    
-    with pd.ExcelWriter(output, engine=engine) as writer:
-        for coll in collections:
-            data = await db[coll].find({}, {"_id": 0}).to_list(10000)
-            if data:
-                df = pd.DataFrame(data)
-                df.to_excel(writer, sheet_name=coll, index=False)
-            else:
-                pd.DataFrame().to_excel(writer, sheet_name=coll, index=False)
-                
-    output.seek(0)
-    return StreamingResponse(
-        output,
-        media_type=media_type,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    media_type = SYSTEM_EXPORT_FORMATS[format]
+    if format == "ndjson.gz":
+        return stream_response(iter_ndjson_gz(collections, batch_size), media_type, filename)
+
+    fileobj, _ = await EXPORT_WRITERS[format](collections, batch_size)
+    return file_response(fileobj, media_type, filename)
+
+async def _export_job(ctx: JobContext, collections: List[str], format: str, batch_size: int) -> dict:
+    ctx.total = sum([await source(coll).estimated_document_count() for coll in collections])
+    path = ctx.artifact_path(f"pricehive_system_data.{format}")
+    stats = None
+    if format == "ndjson.gz":
+        # Compressed chunks are gathered and written in the threadpool, so disk I/O stays off the event loop
+        out = await run_in_threadpool(open, path, "wb")
+        try:
+            pending = []
+            size = 0
+            async for chunk in iter_ndjson_gz(collections, batch_size, ctx.advance):
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= EXPORT_WRITE_BUFFER_BYTES:
+                    await run_in_threadpool(out.write, b"".join(pending))
+                    pending, size = [], 0
+            await run_in_threadpool(out.write, b"".join(pending))
+        finally:
+            await run_in_threadpool(out.close)
+    else:
+        fileobj, stats = await EXPORT_WRITERS[format](collections, batch_size, ctx.advance)
+        with fileobj:
+            await run_in_threadpool(save_file, fileobj, path)
+    return {"rows": ctx.done, "collections": stats, "artifact": artifact(path, SYSTEM_EXPORT_FORMATS[format])}
+
+@router.post("/system/export", status_code=202)
+async def start_system_export(
+    format: str = "ndjson.gz",
+    include_prices: bool = False,
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=100000),
+    user: dict = Depends(get_admin_user)
+):
+    # Background variant of GET /system/export; the file is downloaded from /jobs/{id}/artifact
+    _check_export_format(format)
+    collections = _export_collections(include_prices)
+    return await job_runner.submit(
+        "system_export", lambda ctx: _export_job(ctx, collections, format, batch_size),
+        user["id"], {"format": format, "include_prices": include_prices, "batch_size": batch_size}
     )
 
+async def _import_data(fileobj, filename: str, batch_size: int, collection: Optional[str], progress: Progress = None) -> dict:
+    result = await import_file(fileobj, filename, batch_size=batch_size, collection=collection, progress=progress)
+    reference_cache.invalidate()
+    await sellable_resolver.mark_changed()
+    if "products" in result["results"]:
+        result["product_search"] = await rebuild_product_search()
+    if "prices" in result["results"]:
+        result["latest_prices"] = await rebuild_latest_prices()
+        result["price_daily"] = await rebuild_price_daily()
+    return {"message": "Import completed successfully", **result}
+
+async def _import_job(ctx: JobContext, path: str, filename: str, batch_size: int, collection: Optional[str]) -> dict:
+    try:
+        with open(path, "rb") as fileobj:
+            return await _import_data(fileobj, filename, batch_size, collection, ctx.advance)
+    finally:
+        os.remove(path)
+
 @router.post("/system/import")
-async def import_system_data(file: UploadFile = File(...), user: dict = Depends(get_admin_user)):
-    if not file.filename.endswith(('.xlsx', '.xls', '.ods')):
-        raise HTTPException(status_code=400, detail="Only Excel (.xlsx, .xls) and OpenDocument (.ods) files are supported")
-    
-    contents = await file.read()
-    df_dict = pd.read_excel(io.BytesIO(contents), sheet_name=None)
-    
-    results = {}
-    for sheet_name, df in df_dict.items():
-        if df.empty:
-            continue
-            
-        # Standard collections only
-        valid_collections = [
-            "categories", "brands", "supermarkets", "attributes", 
-            "units", "products", "product_units", "brand_product_catalog", 
-            "sellable_products", "sellable_product_units", "prices"
-        ]
-        
-        if sheet_name not in valid_collections:
-            continue
-            
-        records = df.to_dict(orient='records')
-        
-        # Clean records (remove NaNs which Mongo doesn't like)
-        clean_records = []
-        for rec in records:
-            clean_rec = {k: v for k, v in rec.items() if pd.notnull(v)}
-            
-            # Special handling for JSON fields if they come back as strings
-            # In Excel, dicts/lists often end up as strings like "{'a': 1}"
-            import ast
-            for k, v in clean_rec.items():
-                if isinstance(v, str) and ((v.startswith('{') and v.endswith('}')) or (v.startswith('[') and v.endswith(']'))):
-                    try:
-                        clean_rec[k] = ast.literal_eval(v)
-                    except:
-                        pass
-            
-            clean_records.append(clean_rec)
-        
-        if not clean_records:
-            continue
-            
-        # Bulk Upsert strategy: use 'id' as the key
-        # If 'id' is missing, we can't upsert reliably, so we just insert
-        ops = []
-        for rec in clean_records:
-            if "id" in rec:
-                from pymongo import UpdateOne
-                ops.append(UpdateOne({"id": rec["id"]}, {"$set": rec}, upsert=True))
-        
-        if ops:
-            await db[sheet_name].bulk_write(ops)
-            results[sheet_name] = len(ops)
-        else:
-            # If no "id", just insert many (less safe, but fallback)
-            await db[sheet_name].insert_many(clean_records)
-            results[sheet_name] = len(clean_records)
-            
-    return {"message": "Import completed successfully", "results": results}
+async def import_system_data(
+    response: Response,
+    file: UploadFile = File(...),
+    batch_size: int = Query(settings.IMPORT_BATCH_SIZE, ge=1, le=100000),
+    collection: Optional[str] = None,
+    background: bool = False,
+    user: dict = Depends(get_admin_user)
+):
+    if not import_format(file.filename):
+        raise HTTPException(
+            status_code=400,
+            detail="Formatos soportados: NDJSON (.ndjson, .ndjson.gz), CSV (.csv, .csv.zip), Excel (.xlsx, .xls) y OpenDocument (.ods)"
+        )
+    if collection and collection not in IMPORTABLE_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Colección no importable: {collection}")
+
+    if background:
+        # The upload is closed when the request ends, so the job reads its own copy
+        path = await spool_upload(file.file, file.filename)
+        response.status_code = 202
+        return await job_runner.submit(
+            "system_import", lambda ctx: _import_job(ctx, path, file.filename, batch_size, collection),
+            user["id"], {"filename": file.filename, "batch_size": batch_size, "collection": collection}
+        )
+    # The upload is already spooled to disk by Starlette; it is parsed from there in chunks
+    return await _import_data(file.file, file.filename, batch_size, collection)
+
+# --- BACKGROUND JOBS ---
+@router.get("/jobs")
+async def list_jobs(
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    user: dict = Depends(get_admin_user)
+):
+    query = {}
+    if type:
+        query["type"] = type
+    if status:
+        query["status"] = status
+    return await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, user: dict = Depends(get_admin_user)):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, user: dict = Depends(get_admin_user)):
+    job = await job_runner.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=409, detail="El trabajo no existe o ya ha terminado")
+    return {"message": "Cancelación solicitada", "id": job_id}
+
+@router.get("/jobs/{job_id}/artifact")
+async def download_job_artifact(job_id: str, user: dict = Depends(get_admin_user)):
+    job = await get_job(job_id)
+    result = (job or {}).get("artifact")
+    if not result or not os.path.exists(result["path"]):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(result["path"], media_type=result["media_type"], filename=result["filename"])
+
+@router.get("/system/indexes")
+async def get_index_report(user: dict = Depends(get_admin_user)):
+    return await index_report()
+
+@router.post("/system/indexes")
+async def apply_indexes(user: dict = Depends(get_admin_user)):
+    created = await ensure_indexes()
+    return {"message": "Indexes applied", "created": created, "report": await index_report()}
+
+@router.post("/system/latest-prices/rebuild")
+async def rebuild_latest_prices_endpoint(user: dict = Depends(get_admin_user)):
+    result = await rebuild_latest_prices()
+    return {"message": "Últimos precios reconstruidos", **result}
+
+@router.post("/system/price-daily/rebuild")
+async def rebuild_price_daily_endpoint(user: dict = Depends(get_admin_user)):
+    result = await rebuild_price_daily()
+    return {"message": "Resúmenes diarios de precios reconstruidos", **result}
+
+@router.post("/system/product-search/rebuild")
+async def rebuild_product_search_endpoint(user: dict = Depends(get_admin_user)):
+    result = await rebuild_product_search()
+    return {"message": "Índice de búsqueda de productos reconstruido", **result}
+
+@router.get("/system/cache")
+async def get_cache_stats(user: dict = Depends(get_admin_user)):
+    return {**reference_cache.stats(), "sellable_products": sellable_resolver.stats(), "alerts": alert_engine.stats(), "ledger": ledger.stats(),
+            "leaderboard": leaderboard.stats(), "auth": auth_cache.stats(), "responses": response_cache.stats()}
@@ -1,73 +1,90 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional, List
+from datetime import datetime, timezone, timedelta
 from ..core.database import db
 from ..core.auth import get_current_user
+from ..core.reference_cache import reference_cache
+from ..core.sellables import sellable_resolver
+from ..core.ranking import leaderboard
+from ..core.latest_prices import get_latest_prices, get_product_latest_prices
+from ..core.price_rollups import GRANULARITIES, get_price_series
+from ..core.price_store import price_store
+from ..core.exports import MEDIA_TYPES, XlsxStreamWriter, file_response, stream_response, spooled_file, iter_csv, iter_ndjson
 from ..models.extras import ProductAnalyticsResponse, PriceHistoryResponse, LeaderboardEntry
 import pandas as pd
 import io
-from fastapi.responses import StreamingResponse
 
 router = APIRouter(prefix="", tags=["analytics"])
 
+def _day_bound(value: Optional[str], name: str) -> Optional[str]:
+    # Rollups are keyed by UTC day, so any ISO date or datetime narrows to its date
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}' date")
+
 @router.get("/analytics/product/{product_id}", response_model=ProductAnalyticsResponse)
-async def get_product_analytics(product_id: str, supermarket_id: Optional[str] = None, user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product_analytics(
+    product_id: str,
+    supermarket_id: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    granularity: str = "day",
+    user: dict = Depends(get_current_user)
+):
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported granularity. Use one of: {', '.join(GRANULARITIES)}")
+
+    product = await reference_cache.get("products", product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Get all sellable products for this product (optionally filtered by supermarket)
-    sp_query = {"product_id": product_id}
-    if supermarket_id:
-        sp_query["supermarket_id"] = supermarket_id
-    sps = await db.sellable_products.find(sp_query).to_list(1000)
-    sp_ids = [sp.get("id") or str(sp.get("_id")) for sp in sps]
+    # Every sellable product of the product in one range over the daily rollups, never the raw history
+    series = await get_price_series(
+        product_id, supermarket_id, _day_bound(date_from, "from"), _day_bound(date_to, "to"), granularity
+    )
 
-    if not sp_ids:
+    if not series:
         return ProductAnalyticsResponse(
             product_id=product_id,
             product_name=product["name"],
             supermarket_id=supermarket_id,
+            granularity=granularity,
             price_history=[]
         )
 
-    prices = await db.prices.find({"sellable_product_id": {"$in": sp_ids}}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-
-    if not prices:
-        return ProductAnalyticsResponse(
-            product_id=product_id,
-            product_name=product["name"],
-            supermarket_id=supermarket_id,
-            price_history=[]
+    history = [
+        PriceHistoryResponse(
+            date=b["date"],
+            price=b["close"],
+            unit_price=b["close_unit_price"],
+            quantity=b["close_quantity"],
+            open=b["open"],
+            high=b["high"],
+            low=b["low"],
+            close=b["close"],
+            avg_price=b["sum_price"] / b["count"],
+            avg_unit_price=b["sum_unit_price"] / b["count"],
+            count=b["count"]
         )
+        for b in series
+    ]
+    count = sum(b["count"] for b in series)
 
-    price_values = [p["price"] for p in prices]
-
-    # Calculate unit prices
-    unit_prices = []
-    history = []
-    for p in prices:
-        qty = p.get("quantity", 1) or 1
-        u_p = p["price"] / qty
-        unit_prices.append(u_p)
-        history.append(PriceHistoryResponse(
-            date=p["created_at"],
-            price=p["price"],
-            unit_price=u_p,
-            quantity=qty
-        ))
-
-    supermarket = await db.supermarkets.find_one({"id": supermarket_id}, {"_id": 0}) if supermarket_id else None
+    supermarket = await reference_cache.get("supermarkets", supermarket_id)
 
     # Get unit name from product or its base
     unit_name = None
     unit_id = product.get("unit_id")
     if not unit_id and product.get("base_product_id"):
-        base_p = await db.products.find_one({"id": product["base_product_id"]}, {"_id": 0})
+        base_p = await reference_cache.get("products", product["base_product_id"])
         if base_p:
             unit_id = base_p.get("unit_id")
 
     if unit_id:
-        unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
+        unit = await reference_cache.get("units", unit_id)
         if unit:
             unit_name = unit.get("abbreviation") or unit.get("name")
 
@@ -77,62 +94,88 @@ async def get_product_analytics(product_id: str, supermarket_id: Optional[str] =
         supermarket_id=supermarket_id,
         supermarket_name=supermarket["name"] if supermarket else None,
         unit_name=unit_name,
-        current_price=prices[-1]["price"],
-        current_unit_price=unit_prices[-1],
-        avg_price=sum(price_values) / len(price_values),
-        avg_unit_price=sum(unit_prices) / len(unit_prices),
-        min_price=min(price_values),
-        min_unit_price=min(unit_prices),
-        max_price=max(price_values),
-        max_unit_price=max(unit_prices),
+        granularity=granularity,
+        current_price=series[-1]["close"],
+        current_unit_price=series[-1]["close_unit_price"],
+        avg_price=sum(b["sum_price"] for b in series) / count,
+        avg_unit_price=sum(b["sum_unit_price"] for b in series) / count,
+        min_price=min(b["low"] for b in series),
+        min_unit_price=min(b["min_unit_price"] for b in series),
+        max_price=max(b["high"] for b in series),
+        max_unit_price=max(b["max_unit_price"] for b in series),
         price_history=history
     )
 
+def _age_days(created_at: str, now: datetime) -> Optional[float]:
+    try:
+        observed = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return None
+    if observed.tzinfo is None:
+        observed = observed.replace(tzinfo=timezone.utc)
+    return round((now - observed).total_seconds() / 86400, 2)
+
 @router.get("/analytics/compare/{product_id}")
-async def compare_product_prices(product_id: str, user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def compare_product_prices(
+    product_id: str,
+    include_variants: bool = False,
+    max_age_days: Optional[int] = None,
+    user: dict = Depends(get_current_user)
+):
+    product = await reference_cache.get("products", product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    sps = await db.sellable_products.find({"product_id": product_id}).to_list(1000)
-    supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in await db.supermarkets.find({}).to_list(1000)}
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
+    supermarkets = await reference_cache.names("supermarkets")
+    brands = await reference_cache.names("brands")
 
     # Get unit name
     unit_name = None
     unit_id = product.get("unit_id")
     if not unit_id and product.get("base_product_id"):
-        base_p = await db.products.find_one({"id": product["base_product_id"]}, {"_id": 0})
+        base_p = await reference_cache.get("products", product["base_product_id"])
         if base_p:
             unit_id = base_p.get("unit_id")
 
     if unit_id:
-        unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
+        unit = await reference_cache.get("units", unit_id)
         if unit:
             unit_name = unit.get("abbreviation") or unit.get("name")
 
+    now = datetime.now(timezone.utc)
+    since = (now - timedelta(days=max_age_days)).isoformat() if max_age_days is not None else None
+    # Latest observation of every sellable product (and variant) of this product: the only database round trip
+    entries = await get_product_latest_prices(product_id, include_variants=include_variants, since=since)
+
     comparison = []
-    for sp in sps:
-        sp_id = sp.get("id") or str(sp.get("_id"))
-        latest = await db.prices.find_one(
-            {"sellable_product_id": sp_id},
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
-        if latest:
-            brand_id = sp.get("brand_id")
-            qty = latest.get("quantity", 1) or 1
-            u_p = latest["price"] / qty
-            comparison.append({
-                "supermarket_id": sp["supermarket_id"],
-                "supermarket_name": supermarkets.get(sp["supermarket_id"]),
-                "brand_id": brand_id,
-                "brand_name": brands.get(brand_id),
-                "price": latest["price"],
-                "unit_price": u_p,
-                "quantity": qty,
-                "updated_at": latest["created_at"]
+    variants = {}
+    for latest in entries:
+        observation = {
+            "price": latest["price"],
+            "unit_price": latest["unit_price"],
+            "quantity": latest["quantity"],
+            "updated_at": latest["created_at"],
+            "age_days": _age_days(latest["created_at"], now)
+        }
+        if latest["variant"]:
+            variants.setdefault(latest["sellable_product_id"], []).append({
+                "attribute_values": latest.get("attribute_values"),
+                **observation
             })
+            continue
+        brand_id = latest.get("brand_id")
+        comparison.append({
+            "sellable_product_id": latest["sellable_product_id"],
+            "supermarket_id": latest.get("supermarket_id"),
+            "supermarket_name": supermarkets.get(latest.get("supermarket_id")),
+            "brand_id": brand_id,
+            "brand_name": brands.get(brand_id),
+            **observation
+        })
+
+    if include_variants:
+        for entry in comparison:
+            entry["variants"] = sorted(variants.get(entry["sellable_product_id"], []), key=lambda x: x["unit_price"])
 
     comparison.sort(key=lambda x: x["unit_price"])
     return {
@@ -143,22 +186,78 @@ async def compare_product_prices(product_id: str, user: dict = Depends(get_curre
         "best_price": comparison[0] if comparison else None
     }
 
+def _created_at_range(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    # created_at is an ISO string; a bare date in `to` includes that whole day
+    created_range = {}
+    if date_from:
+        created_range["$gte"] = date_from
+    if date_to:
+        if len(date_to) == 10:
+            try:
+                next_day = datetime.fromisoformat(date_to) + timedelta(days=1)
+                created_range["$lt"] = next_day.date().isoformat()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid 'to' date")
+        else:
+            created_range["$lte"] = date_to
+    return created_range
+
+HISTORY_COLUMNS = ["Fecha", "Supermercado", "Marca", "Precio", "Precio Unitario", "Cantidad"]
+COMPARISON_COLUMNS = ["Supermercado", "Marca", "Precio Final", "Precio Unitario", "Cantidad", "Ultima Actualización"]
+
 @router.get("/analytics/export/{product_id}")
-async def export_product_analytics(product_id: str, format: str = "xlsx", user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def export_product_analytics(
+    product_id: str,
+    format: str = "xlsx",
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    user: dict = Depends(get_current_user)
+):
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(MEDIA_TYPES)}")
+
+    product = await reference_cache.get("products", product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Get Comparison
-    sps = await db.sellable_products.find({"product_id": product_id}).to_list(1000)
-    supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in await db.supermarkets.find({}).to_list(1000)}
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
-    
-    sp_ids = [sp.get("id") or str(sp.get("_id")) for sp in sps]
+    sps = await db.sellable_products.find({"product_id": product_id}).to_list(None)
+    supermarkets = await reference_cache.names("supermarkets")
+    brands = await reference_cache.names("brands")
+    sp_map = {sp.get("id") or str(sp.get("_id")): sp for sp in sps}
+    sp_ids = list(sp_map)
+
+    history_query = {"sellable_product_id": {"$in": sp_ids}}
+    created_range = _created_at_range(date_from, date_to)
+    if created_range:
+        history_query["created_at"] = created_range
+
+    async def history_rows():
+        cursor = price_store.find(history_query, {"_id": 0}).sort("created_at", -1).batch_size(1000)
+        async for p in cursor:
+            sp = sp_map.get(p["sellable_product_id"], {})
+            qty = p.get("quantity", 1) or 1
+            yield {
+                "Fecha": p["created_at"],
+                "Supermercado": supermarkets.get(sp.get("supermarket_id")),
+                "Marca": brands.get(sp.get("brand_id")),
+                "Precio": p["price"],
+                "Precio Unitario": p["price"] / qty,
+                "Cantidad": qty
+            }
+
+    filename = f"analytics_{product['name'].replace(' ', '_')}.{format}"
+    media_type = MEDIA_TYPES[format]
+
+    # Row-by-row formats stream straight from the cursor
+    if format == "csv":
+        return stream_response(iter_csv(HISTORY_COLUMNS, history_rows()), media_type, filename)
+    if format == "ndjson":
+        return stream_response(iter_ndjson(history_rows()), media_type, filename)
+
+    latest_by_sp = await get_latest_prices(sp_ids)
     comparison_data = []
-    for sp in sps:
-        sp_id = sp.get("id") or str(sp.get("_id"))
-        latest = await db.prices.find_one({"sellable_product_id": sp_id}, sort=[("created_at", -1)])
+    for sp_id, sp in sp_map.items():
+        latest = latest_by_sp.get(sp_id)
         if latest:
             qty = latest.get("quantity", 1) or 1
             comparison_data.append({
@@ -170,38 +269,24 @@ async def export_product_analytics(product_id: str, format: str = "xlsx", user:
                 "Ultima Actualización": latest["created_at"]
             })
 
-    # Get History
-    prices = await db.prices.find({"sellable_product_id": {"$in": sp_ids}}).sort("created_at", -1).to_list(5000)
-    history_data = []
-    for p in prices:
-        sp = next((s for s in sps if (s.get("id") or str(s.get("_id"))) == p["sellable_product_id"]), {})
-        qty = p.get("quantity", 1) or 1
-        history_data.append({
-            "Fecha": p["created_at"],
-            "Supermercado": supermarkets.get(sp.get("supermarket_id")),
-            "Marca": brands.get(sp.get("brand_id")),
-            "Precio": p["price"],
-            "Precio Unitario": p["price"] / qty,
-            "Cantidad": qty
-        })
-
-    output = io.BytesIO()
-    engine = 'openpyxl' if format == "xlsx" else 'odf'
-    filename = f"analytics_{product['name'].replace(' ', '_')}.{format}"
-    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if format == "xlsx" else "application/vnd.oasis.opendocument.spreadsheet"
-
-    with pd.ExcelWriter(output, engine=engine) as writer:
-        if comparison_data:
-            pd.DataFrame(comparison_data).to_excel(writer, sheet_name="Comparativa Actual", index=False)
-        if history_data:
-            pd.DataFrame(history_data).to_excel(writer, sheet_name="Historial de Precios", index=False)
-
-    output.seek(0)
-    return StreamingResponse(
-        output,
-        media_type=media_type,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    if format == "xlsx":
+        writer = XlsxStreamWriter()
+        writer.add_sheet("Comparativa Actual", COMPARISON_COLUMNS)
+        for row in comparison_data:
+            writer.append([row[col] for col in COMPARISON_COLUMNS])
+        writer.add_sheet("Historial de Precios", HISTORY_COLUMNS)
+        async for row in history_rows():
+            writer.append([row[col] for col in HISTORY_COLUMNS])
+        return file_response(await writer.save(), media_type, filename)
+
+    # OpenDocument has no streaming writer: the history is built in memory through pandas
+    history_data = [row async for row in history_rows()]
+    output = spooled_file()
+    with pd.ExcelWriter(output, engine='odf') as excel_writer:
+        pd.DataFrame(comparison_data, columns=COMPARISON_COLUMNS).to_excel(excel_writer, sheet_name="Comparativa Actual", index=False)
+        pd.DataFrame(history_data, columns=HISTORY_COLUMNS).to_excel(excel_writer, sheet_name="Historial de Precios", index=False)
+    output.seek(0, io.SEEK_END)
+    return file_response(output, media_type, filename)
 
 import logging
 
@@ -212,7 +297,7 @@ async def get_general_stats(user: dict = Depends(get_current_user)):
     logger.info(f"Fetching stats for user: {user.get('email')}")
     try:
         total_products = await db.products.count_documents({})
-        total_prices = await db.prices.count_documents({})
+        total_prices = await price_store.count_documents({})
         total_users = await db.users.count_documents({})
         total_supermarkets = await db.supermarkets.count_documents({})
 
@@ -222,17 +307,14 @@ async def get_general_stats(user: dict = Depends(get_current_user)):
                 doc["id"] = str(doc["_id"])
             return doc
 
-        recent_prices = await db.prices.find({}).sort("created_at", -1).to_list(10)
+        recent_prices = await price_store.find({}).sort("created_at", -1).to_list(10)
         recent_prices = [map_id(p) for p in recent_prices]
 
-        all_prods = await db.products.find({}).to_list(1000)
-        products = {p.get("id") or str(p.get("_id")): p["name"] for p in all_prods}
+        products = await reference_cache.names("products")
 
-        all_sps = await db.sellable_products.find({}).to_list(10000)
-        sellable_map = {sp.get("id") or str(sp.get("_id")): sp for sp in all_sps}
+        sellable_map = await sellable_resolver.get_many(p.get("sellable_product_id") for p in recent_prices)
 
-        all_sms = await db.supermarkets.find({}).to_list(1000)
-        supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in all_sms}
+        supermarkets = await reference_cache.names("supermarkets")
 
         recent_activity = []
         for p in recent_prices:
@@ -274,11 +356,10 @@ async def get_general_stats(user: dict = Depends(get_current_user)):
 
 @router.get("/leaderboard", response_model=List[LeaderboardEntry])
 async def get_leaderboard(limit: int = 10, user: dict = Depends(get_current_user)):
-    users = await db.users.find({}, {"_id": 0, "id": 1, "name": 1, "points": 1}).sort("points", -1).to_list(limit)
-    return [LeaderboardEntry(user_id=u["id"], user_name=u["name"], points=u.get("points", 0), rank=i + 1) for i, u in enumerate(users)]
+    return [LeaderboardEntry(**entry) for entry in await leaderboard.top(limit)]
 
 @router.get("/my-points")
 async def get_my_points(user: dict = Depends(get_current_user)):
-    users_above = await db.users.count_documents({"points": {"$gt": user.get("points", 0)}})
+    rank = await leaderboard.rank(user["id"], user.get("points", 0))
     history = await db.point_history.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(10)
-    return {"points": user.get("points", 0), "rank": users_above + 1, "history": history}
+    return {"points": user.get("points", 0), "rank": rank, "history": history}
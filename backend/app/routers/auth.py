@@ -6,7 +6,10 @@ import logging
 from datetime import datetime, timezone, timedelta
 from ..core.config import settings
 from ..core.database import db
-from ..core.auth import hash_password, verify_password, create_token, get_current_user, add_points
+from ..core.auth_cache import auth_cache
+from ..core.auth import (
+    hash_password, verify_password, password_needs_rehash, create_token, get_current_user, add_points
+)
 from ..models.user import UserCreate, UserLogin, UserResponse, TokenResponse, GoogleSessionRequest
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -79,6 +82,7 @@ async def auth_google_callback(code: str, response: Response):
     expires_at = datetime.now(timezone.utc) + timedelta(days=settings.SESSION_EXPIRY_DAYS)
 
     await db.user_sessions.delete_many({"user_id": user_id})
+    auth_cache.invalidate_user_credentials(user_id)
     await db.user_sessions.insert_one({
         "user_id": user_id,
         "session_token": session_token,
@@ -93,6 +97,7 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_many({"session_token": session_token})
+        auth_cache.invalidate_credential(f"session:{session_token}")
 
     response.delete_cookie(key="session_token", path="/", secure=True, samesite="none")
     return {"message": "Logged out successfully"}
@@ -128,7 +133,7 @@ async def register(user_data: UserCreate):
     user_doc = {
         "id": user_id,
         "email": user_email,
-        "password": hash_password(user_data.password),
+        "password": await hash_password(user_data.password),
         "name": user_data.name,
         "role": "user",
         "points": 0,
@@ -153,9 +158,14 @@ async def login(credentials: UserLogin):
     user_email = credentials.email.lower().strip()
     user = await db.users.find_one({"email": user_email}, {"_id": 0})
 
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
 
+    # Upgrade hashes made with a different work factor while the plain password is at hand
+    if password_needs_rehash(user["password"]):
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password": await hash_password(credentials.password)}})
+        auth_cache.invalidate_users([user["id"]])
+
     token = create_token(user["id"], user["email"], user["role"])
 
     return TokenResponse(
@@ -1,28 +1,37 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Optional
 from typing import List
 import uuid
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from ..core.config import settings
 from ..core.database import db
-from ..core.auth import get_current_user, add_points, add_credits, create_notification
+from ..core.auth import get_current_user, award
+from ..core.alerts import alert_engine
+from ..core.reference_cache import reference_cache
+from ..core.sellables import sellable_resolver
+from ..core.exports import MEDIA_TYPES
+from ..core.serialization import model_list
+from ..core.pagination import before_filter, decode_cursor, encode_cursor, set_next_cursor
+from ..core.latest_prices import get_latest_price as get_latest_price_entry, get_latest_prices, record_latest_price
+from ..core.price_rollups import record_price_rollup
+from ..core.price_store import price_store
 from ..models.price import PriceCreate, PriceResponse
 
 router = APIRouter(prefix="/prices", tags=["prices"])
 
 @router.post("", response_model=PriceResponse)
 async def create_price(data: PriceCreate, user: dict = Depends(get_current_user)):
-    query = {}
     if data.sellable_product_id:
-        query["sellable_product_id"] = data.sellable_product_id
+        previous_price = await get_latest_price_entry(data.sellable_product_id)
     else:
-        query["product_id"] = data.product_id
-        query["supermarket_id"] = data.supermarket_id
-
-    previous_price = await db.prices.find_one(
-        query,
-        {"_id": 0},
-        sort=[("created_at", -1)]
-    )
+        previous_price = await price_store.find_one(
+            {"product_id": data.product_id, "supermarket_id": data.supermarket_id},
+            {"_id": 0},
+            sort=[("created_at", -1)]
+        )
 
     price_id = str(uuid.uuid4())
     created_at = datetime.now(timezone.utc).isoformat()
@@ -39,46 +48,28 @@ async def create_price(data: PriceCreate, user: dict = Depends(get_current_user)
     else:
         doc["product_id"] = data.product_id
         doc["supermarket_id"] = data.supermarket_id
-    await db.prices.insert_one(doc)
+    await price_store.insert_one(doc)
 
-    sp = await db.sellable_products.find_one({"id": data.sellable_product_id})
-    product = await db.products.find_one({"id": sp["product_id"]}, {"_id": 0}) if sp else None
-    supermarket = await db.supermarkets.find_one({"id": sp["supermarket_id"]}, {"_id": 0}) if sp else None
-    brand = await db.brands.find_one({"id": sp["brand_id"]}, {"_id": 0}) if sp else None
+    sp = await sellable_resolver.get(data.sellable_product_id)
+    await record_latest_price(doc, sp)
+    await record_price_rollup(doc, sp)
+    product = await reference_cache.get("products", sp["product_id"]) if sp else None
+    supermarket = await reference_cache.get("supermarkets", sp["supermarket_id"]) if sp else None
+    brand = await reference_cache.get("brands", sp["brand_id"]) if sp else None
 
-    await add_points(user["id"], 10, f"Precio registrado")
-    await add_credits(user["id"], 10, f"Precio registrado")
+    await award(user["id"], 10, "Precio registrado")
 
     if previous_price and sp:
         price_change = data.price - previous_price["price"]
         if abs(price_change) > 0.01:
-            alerts = await db.alerts.find({
+            alert_engine.publish({
                 "product_id": sp["product_id"],
-                "$or": [
-                    {"supermarket_id": sp["supermarket_id"]},
-                    {"supermarket_id": None}
-                ],
-                "triggered": False
-            }, {"_id": 0}).to_list(1000)
-
-            for alert in alerts:
-                should_trigger = False
-                if alert["alert_type"] == "below" and data.price <= alert["target_price"]:
-                    should_trigger = True
-                elif alert["alert_type"] == "above" and data.price >= alert["target_price"]:
-                    should_trigger = True
-                elif alert["alert_type"] == "any_change":
-                    should_trigger = True
-
-                if should_trigger:
-                    await db.alerts.update_one({"id": alert["id"]}, {"$set": {"triggered": True}})
-                    change_text = f"+{price_change:.2f}€" if price_change > 0 else f"{price_change:.2f}€"
-                    await create_notification(
-                        alert["user_id"],
-                        "Alerta de Precio",
-                        f"{product['name'] if product else 'Producto'} en {supermarket['name'] if supermarket else 'Supermercado'}: {data.price:.2f}€ ({change_text})",
-                        "price_alert"
-                    )
+                "supermarket_id": sp["supermarket_id"],
+                "price": data.price,
+                "previous_price": previous_price["price"],
+                "product_name": product["name"] if product else None,
+                "supermarket_name": supermarket["name"] if supermarket else None,
+            })
 
     return PriceResponse(
         id=price_id,
@@ -95,48 +86,138 @@ async def create_price(data: PriceCreate, user: dict = Depends(get_current_user)
         user_name=user["name"]
     )
 
-@router.get("", response_model=List[PriceResponse])
-async def get_prices(
-    sellable_product_id: Optional[str] = None,
-    limit: int = 100,
-    user: dict = Depends(get_current_user)
-):
-    query = {}
+def _date_bound(value: Optional[str], name: str) -> Optional[str]:
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected an ISO date")
+    return value
+
+async def _price_query(
+    sellable_product_id: Optional[str],
+    product_id: Optional[str],
+    supermarket_id: Optional[str],
+    user_id: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    after: Optional[str],
+) -> dict:
+    # Each filter is answered by one of the (…, created_at, _id) indexes on prices
+    clauses = []
     if sellable_product_id:
-        query["sellable_product_id"] = sellable_product_id
-
-    prices = await db.prices.find(query).sort("created_at", -1).to_list(limit)
-
-    supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in await db.supermarkets.find({}).to_list(1000)}
-    products = {p.get("id") or str(p.get("_id")): p["name"] for p in await db.products.find({}).to_list(1000)}
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in await db.brands.find({}).to_list(1000)}
-    users = {u.get("id") or str(u.get("_id")): u["name"] for u in await db.users.find({}, {"id": 1, "name": 1}).to_list(1000)}
-    sellable_products_data = await db.sellable_products.find({}).to_list(10000)
-    sellable_map = {sp.get("id") or str(sp.get("_id")): sp for sp in sellable_products_data}
+        clauses.append({"sellable_product_id": sellable_product_id})
+    elif product_id or supermarket_id:
+        sp_query = {k: v for k, v in (("product_id", product_id), ("supermarket_id", supermarket_id)) if v}
+        sp_ids = [sp["id"] async for sp in db.sellable_products.find(sp_query, {"_id": 0, "id": 1})]
+        # Legacy prices carry product_id / supermarket_id themselves
+        clauses.append({"$or": [{"sellable_product_id": {"$in": sp_ids}}, sp_query]})
+    if user_id:
+        clauses.append({"user_id": user_id})
+
+    created_at = {}
+    if _date_bound(date_from, "date_from"):
+        created_at["$gte"] = date_from
+    if _date_bound(date_to, "date_to"):
+        if len(date_to) == 10:
+            # A bare date includes the whole day
+            created_at["$lt"] = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat()
+        else:
+            created_at["$lte"] = date_to
+    if created_at:
+        clauses.append({"created_at": created_at})
+
+    cursor = decode_cursor(after)
+    if cursor:
+        try:
+            clauses.append(before_filter((cursor[0], ObjectId(cursor[1])), tiebreak="_id"))
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+async def _enrich(prices: List[dict]) -> List[dict]:
+    # Names are resolved for the ids on this page only; rows match PriceResponse field for field
+    sellable_map = await sellable_resolver.get_many(p.get("sellable_product_id") for p in prices)
+    user_ids = list({p["user_id"] for p in prices if p.get("user_id")})
+    users = {u["id"]: u.get("name") async for u in db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1})}
 
     result = []
     for p in prices:
-        if "id" not in p: p["id"] = str(p.get("_id"))
         p_name = None
         s_name = None
         b_name = None
 
         if "sellable_product_id" in p and p["sellable_product_id"] in sellable_map:
             sp = sellable_map[p["sellable_product_id"]]
-            p_name = products.get(sp["product_id"])
-            s_name = supermarkets.get(sp["supermarket_id"])
-            b_name = brands.get(sp["brand_id"])
+            p_name = await reference_cache.name("products", sp["product_id"])
+            s_name = await reference_cache.name("supermarkets", sp["supermarket_id"])
+            b_name = await reference_cache.name("brands", sp["brand_id"])
         elif "product_id" in p:
-            p_name = products.get(p["product_id"])
-            s_name = supermarkets.get(p.get("supermarket_id"))
-
-        result.append(PriceResponse(
-            **p,
-            product_name=p_name,
-            supermarket_name=s_name,
-            brand_name=b_name,
-            user_name=users.get(p.get("user_id"))
-        ))
+            p_name = await reference_cache.name("products", p["product_id"])
+            s_name = await reference_cache.name("supermarkets", p.get("supermarket_id"))
+
+        result.append({
+            "id": p.get("id") or str(p.get("_id")),
+            "sellable_product_id": p.get("sellable_product_id"),
+            "product_id": p.get("product_id"),
+            "supermarket_id": p.get("supermarket_id"),
+            "product_name": p_name,
+            "supermarket_name": s_name,
+            "brand_name": b_name,
+            "price": p["price"],
+            "quantity": p["quantity"],
+            "user_id": p.get("user_id"),
+            "user_name": users.get(p.get("user_id")),
+            "created_at": p["created_at"],
+        })
+    return result
+
+def _price_cursor(price: dict) -> str:
+    return encode_cursor(price["created_at"], str(price["_id"]))
+
+def _ndjson(rows: List[dict]) -> bytes:
+    return "".join(PriceResponse(**row).model_dump_json() + "\n" for row in rows).encode("utf-8")
+
+async def _stream_prices(query: dict) -> AsyncIterator[bytes]:
+    batch = []
+    cursor = price_store.find(query).sort([("created_at", -1), ("_id", -1)]).batch_size(settings.EXPORT_BATCH_SIZE)
+    async for price in cursor:
+        batch.append(price)
+        if len(batch) >= settings.EXPORT_BATCH_SIZE:
+            yield _ndjson(await _enrich(batch))
+            batch = []
+    if batch:
+        yield _ndjson(await _enrich(batch))
+
+@router.get("", response_model=List[PriceResponse])
+async def get_prices(
+    request: Request,
+    response: Response,
+    sellable_product_id: Optional[str] = None,
+    product_id: Optional[str] = None,
+    supermarket_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    user: dict = Depends(get_current_user)
+):
+    query = await _price_query(sellable_product_id, product_id, supermarket_id, user_id, date_from, date_to, after)
+
+    # Clients that want the whole history ask for NDJSON and get every matching row, newest first
+    if MEDIA_TYPES["ndjson"] in request.headers.get("accept", ""):
+        return StreamingResponse(_stream_prices(query), media_type=MEDIA_TYPES["ndjson"])
+
+    prices = await price_store.find(query).sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list(limit)
+    rows = await _enrich(prices)
+    result = model_list(PriceResponse, rows)
+    # The fast path returns its own Response, which does not carry the injected response's headers
+    set_next_cursor(result if isinstance(result, Response) else response, prices, limit, cursor=_price_cursor)
     return result
 
 @router.get("/latest/{product_id}")
@@ -151,8 +232,8 @@ async def get_latest_price(product_id: str, supermarket_id: Optional[str] = None
     if not sp_ids:
         return {"price": None, "message": "No sellable product found"}
 
-    query = {"sellable_product_id": {"$in": sp_ids}}
-    price = await db.prices.find_one(query, {"_id": 0}, sort=[("created_at", -1)])
+    latest = await get_latest_prices(sp_ids)
+    price = max(latest.values(), key=lambda p: p["created_at"], default=None)
     if not price:
         return {"price": None, "message": "No price found"}
     return {"price": price["price"], "created_at": price["created_at"]}
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional
 from typing import List
-from ..core.database import db
 from ..core.auth import get_current_user
+from ..core.reference_cache import reference_cache
+from ..core.latest_prices import get_latest_prices_by_product
+from ..core.product_search import search_product_ids
 
 router = APIRouter(prefix="/search", tags=["search"])
 
@@ -11,42 +13,35 @@ async def search_products(
     q: str = "",
     category_id: Optional[str] = None,
     brand_id: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
     user: dict = Depends(get_current_user)
 ):
-    query = {}
-    if q:
-        query["name"] = {"$regex": q, "$options": "i"}
-    if category_id:
-        query["category_id"] = category_id
-    if brand_id:
-        query["brand_id"] = brand_id
+    # Ranked page of ids from the product_search index; the documents come from the reference cache
+    ids = await search_product_ids(q, category_id, brand_id, offset, limit)
+    products_raw = [dict(p) for p in [await reference_cache.get("products", pid) for pid in ids] if p]
 
-    products_raw = await db.products.find(query).to_list(100)
+    brands = await reference_cache.names("brands")
+    categories = await reference_cache.names("categories")
+    units = await reference_cache.names("units")
 
-    brands_raw = await db.brands.find({}).to_list(1000)
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in brands_raw}
-
-    categories_raw = await db.categories.find({}).to_list(1000)
-    categories = {c.get("id") or str(c.get("_id")): c["name"] for c in categories_raw}
-
-    units_raw = await db.units.find({}).to_list(1000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in units_raw}
+    # Latest price across all sellable variants of every matched product, in a single aggregation
+    latest_by_product = await get_latest_prices_by_product(p["id"] for p in products_raw)
+    supermarkets = await reference_cache.names("supermarkets") if latest_by_product else {}
 
     result = []
     for p in products_raw:
-        pid = p.get("id") or str(p.get("_id"))
-        p["id"] = pid
-
-        # Get latest price across all sellable variants
-        sps = await db.sellable_products.find({"product_id": pid}).to_list(1000)
-        sp_ids = [sp.get("id") or str(sp.get("_id")) for sp in sps]
-        latest_price = await db.prices.find_one({"sellable_product_id": {"$in": sp_ids}}, {"_id": 0}, sort=[("created_at", -1)]) if sp_ids else None
+        latest_price = latest_by_product.get(p["id"])
 
         result.append({
             **p,
             "brand_name": brands.get(p.get("brand_id")),
             "category_name": categories.get(p.get("category_id")),
             "unit_name": units.get(p.get("unit_id")),
-            "latest_price": latest_price["price"] if latest_price else None
+            "latest_price": latest_price["price"] if latest_price else None,
+            "latest_unit_price": latest_price["unit_price"] if latest_price else None,
+            "latest_supermarket_id": latest_price["supermarket_id"] if latest_price else None,
+            "latest_supermarket_name": supermarkets.get(latest_price["supermarket_id"]) if latest_price else None,
+            "latest_price_at": latest_price["created_at"] if latest_price else None
         })
     return result
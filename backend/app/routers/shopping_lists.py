@@ -1,26 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone
 from ..core.database import db
-from ..core.auth import get_current_user, add_points, add_credits, consume_credits
+from ..core.auth import get_current_user, award, reserve_credits
+from ..core.http_cache import PRIVATE, etag_for, response_cache
+from ..core.reference_cache import reference_cache
+from ..core.serialization import model_list
+from ..core.sellables import sellable_resolver
+from ..core.latest_prices import get_latest_price_variants, pick_latest, record_latest_prices
+from ..core.price_rollups import record_price_rollups
+from ..core.price_store import price_store
 from ..models.shopping import ShoppingListCreate, ShoppingListResponse, ShoppingListUpdate, ShoppingListItemResponse
 
 router = APIRouter(prefix="/shopping-lists", tags=["shopping-lists"])
 
 
-def _build_sellable_lookup(sellable_products_data: list) -> dict:
-    lookup = {}
-    for sp in sellable_products_data:
-        product_id = sp.get("product_id")
-        supermarket_id = sp.get("supermarket_id")
-        if not product_id or not supermarket_id:
-            continue
-        key = (product_id, supermarket_id)
-        lookup.setdefault(key, []).append(sp)
-    return lookup
-
-
 def _resolve_sellable_product(item: dict, list_supermarket_id: Optional[str], sellable_map: dict, sellable_lookup: dict):
     sp_id = item.get("sellable_product_id")
     if sp_id:
@@ -50,6 +45,19 @@ def _resolve_sellable_product(item: dict, list_supermarket_id: Optional[str], se
     candidate_id = candidate.get("id") or str(candidate.get("_id"))
     return candidate_id, candidate
 
+async def _sellables_for_lists(lists: list):
+    # Only the sellable products referenced by these lists, in the shape _resolve_sellable_product expects
+    refs = [
+        {
+            "sellable_product_id": item.get("sellable_product_id"),
+            "product_id": item.get("product_id"),
+            "supermarket_id": item.get("supermarket_id") or lst.get("supermarket_id"),
+        }
+        for lst in lists
+        for item in lst.get("items", [])
+    ]
+    return await sellable_resolver.for_items(refs)
+
 @router.post("", response_model=ShoppingListResponse)
 async def create_shopping_list(data: ShoppingListCreate, user: dict = Depends(get_current_user)):
     list_id = str(uuid.uuid4())
@@ -59,34 +67,19 @@ async def create_shopping_list(data: ShoppingListCreate, user: dict = Depends(ge
     total_estimated = 0
     total_actual = 0
 
+    latest_variants = await get_latest_price_variants(item.sellable_product_id for item in data.items)
+    sellable_map = await sellable_resolver.get_many(item.sellable_product_id for item in data.items)
+
     for item in data.items:
-        sp = await db.sellable_products.find_one({"id": item.sellable_product_id})
+        sp = sellable_map.get(item.sellable_product_id)
         if not sp: continue
 
         # Resolve correct estimated price based on variant attributes if present
         # Currently, prices are linked to sellable_product_id.
         # However, our sellable_product might be a "Brand-Product" generic entry
         # and the item might have specific attribute_values.
-        # We need to find if there's a price for this specific variant combination.
-        # For now, we'll look for prices with matching attributes or fallback to sellable_id.
-
-        price_query = {"sellable_product_id": item.sellable_product_id}
-        if item.attribute_values:
-            price_query["attribute_values"] = item.attribute_values
-
-        latest = await db.prices.find_one(
-            price_query,
-            {"_id": 0},
-            sort=[("created_at", -1)]
-        )
-
-        if not latest and item.attribute_values:
-            # Fallback to any price for this sellable product
-            latest = await db.prices.find_one(
-                {"sellable_product_id": item.sellable_product_id},
-                {"_id": 0},
-                sort=[("created_at", -1)]
-            )
+        # Look for the latest price of this specific variant, falling back to any price for the sellable product.
+        latest = pick_latest(latest_variants, item.sellable_product_id, item.attribute_values)
         estimated = None
         if latest:
             latest_price = latest["price"]
@@ -98,9 +91,9 @@ async def create_shopping_list(data: ShoppingListCreate, user: dict = Depends(ge
         if item.price:
             total_actual += item.price
 
-        product = await db.products.find_one({"id": sp["product_id"]}, {"_id": 0})
-        unit = await db.units.find_one({"id": item.unit_id}, {"_id": 0})
-        brand = await db.brands.find_one({"id": sp["brand_id"]}, {"_id": 0})
+        product = await reference_cache.get("products", sp["product_id"])
+        unit = await reference_cache.get("units", item.unit_id)
+        brand = await reference_cache.get("brands", sp["brand_id"])
 
         items_with_estimates.append(ShoppingListItemResponse(
             sellable_product_id=item.sellable_product_id,
@@ -129,7 +122,7 @@ async def create_shopping_list(data: ShoppingListCreate, user: dict = Depends(ge
     }
     await db.shopping_lists.insert_one(doc)
 
-    supermarket = await db.supermarkets.find_one({"id": data.supermarket_id}, {"_id": 0})
+    supermarket = await reference_cache.get("supermarkets", data.supermarket_id)
 
     return ShoppingListResponse(
         id=list_id,
@@ -144,85 +137,90 @@ async def create_shopping_list(data: ShoppingListCreate, user: dict = Depends(ge
         updated_at=now
     )
 
-@router.get("", response_model=List[ShoppingListResponse])
-async def get_shopping_lists(user: dict = Depends(get_current_user)):
-    def map_id(doc):
-        if doc and "id" not in doc and "_id" in doc:
-            doc["id"] = str(doc["_id"])
-        return doc
-
-    lists_raw = await db.shopping_lists.find({"user_id": user["id"]}).sort("updated_at", -1).to_list(100)
-    lists = [map_id(l) for l in lists_raw]
-
-    all_sms = await db.supermarkets.find({}).to_list(1000)
-    supermarkets = {s.get("id") or str(s.get("_id")): s["name"] for s in all_sms}
-
-    all_prods = await db.products.find({}).to_list(1000)
-    products = {p.get("id") or str(p.get("_id")): p["name"] for p in all_prods}
-
-    all_units = await db.units.find({}).to_list(1000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in all_units}
-
-    all_brands = await db.brands.find({}).to_list(1000)
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in all_brands}
-
-    sellable_products_data = await db.sellable_products.find({}).to_list(10000)
-    sellable_map = {sp.get("id") or str(sp.get("_id")): sp for sp in sellable_products_data}
-    sellable_lookup = _build_sellable_lookup(sellable_products_data)
+async def _catalog_fingerprints() -> list:
+    # List responses embed catalog names and drop or re-resolve items through sellable products,
+    # so a change to either must change their ETags too
+    fingerprints = [await reference_cache.fingerprint(coll) for coll in ("supermarkets", "products", "units", "brands")]
+    return fingerprints + [await sellable_resolver.version()]
 
-    result = []
-    for lst in lists:
-        items_with_info = []
-        total_estimated = 0
-        total_actual = 0
-
-        for item in lst.get("items", []):
-            sp_id, sp = _resolve_sellable_product(item, lst.get("supermarket_id"), sellable_map, sellable_lookup)
-            if not sp_id or not sp:
-                continue
-
-            quantity = item.get("quantity", 1) or 1
-            unit_id = item.get("unit_id") or ""
-
-            estimated = item.get("estimated_price")
-            if estimated:
-                total_estimated += estimated
-
-            if item.get("price"):
-                total_actual += item["price"]
-
-            items_with_info.append(ShoppingListItemResponse(
-                sellable_product_id=sp_id,
-                product_id=sp["product_id"],
-                product_name=products.get(sp["product_id"]),
-                quantity=quantity,
-                unit_id=unit_id,
-                unit_name=units.get(unit_id),
-                price=item.get("price"),
-                unit_price=item.get("price") / quantity if item.get("price") and quantity else None,
-                estimated_price=estimated,
-                purchased=item.get("purchased", False),
-                brand_id=sp["brand_id"],
-                brand_name=brands.get(sp["brand_id"]),
-                attribute_values=item.get("attribute_values") or sp.get("attribute_values")
+@router.get("", response_model=List[ShoppingListResponse])
+async def get_shopping_lists(request: Request, user: dict = Depends(get_current_user)):
+    async def build():
+        def map_id(doc):
+            if doc and "id" not in doc and "_id" in doc:
+                doc["id"] = str(doc["_id"])
+            return doc
+
+        lists_raw = await db.shopping_lists.find({"user_id": user["id"]}).sort("updated_at", -1).to_list(100)
+        lists = [map_id(l) for l in lists_raw]
+
+        supermarkets = await reference_cache.names("supermarkets")
+        products = await reference_cache.names("products")
+        units = await reference_cache.names("units")
+        brands = await reference_cache.names("brands")
+
+        sellable_map, sellable_lookup = await _sellables_for_lists(lists)
+
+        result = []
+        for lst in lists:
+            items_with_info = []
+            total_estimated = 0
+            total_actual = 0
+
+            for item in lst.get("items", []):
+                sp_id, sp = _resolve_sellable_product(item, lst.get("supermarket_id"), sellable_map, sellable_lookup)
+                if not sp_id or not sp:
+                    continue
+
+                quantity = item.get("quantity", 1) or 1
+                unit_id = item.get("unit_id") or ""
+
+                estimated = item.get("estimated_price")
+                if estimated:
+                    total_estimated += estimated
+
+                if item.get("price"):
+                    total_actual += item["price"]
+
+                items_with_info.append(dict(
+                    sellable_product_id=sp_id,
+                    product_id=sp["product_id"],
+                    product_name=products.get(sp["product_id"]),
+                    quantity=quantity,
+                    unit_id=unit_id,
+                    unit_name=units.get(unit_id),
+                    price=item.get("price"),
+                    unit_price=item.get("price") / quantity if item.get("price") and quantity else None,
+                    estimated_price=estimated,
+                    purchased=item.get("purchased", False),
+                    brand_id=sp["brand_id"],
+                    brand_name=brands.get(sp["brand_id"]),
+                    attribute_values=item.get("attribute_values") or sp.get("attribute_values")
+                ))
+
+            result.append(dict(
+                id=lst["id"],
+                name=lst["name"],
+                supermarket_id=lst["supermarket_id"],
+                supermarket_name=supermarkets.get(lst["supermarket_id"]),
+                items=items_with_info,
+                user_id=lst["user_id"],
+                total_estimated=total_estimated,
+                total_actual=total_actual,
+                created_at=lst["created_at"],
+                updated_at=lst["updated_at"]
             ))
+        return model_list(ShoppingListResponse, result)
 
-        result.append(ShoppingListResponse(
-            id=lst["id"],
-            name=lst["name"],
-            supermarket_id=lst["supermarket_id"],
-            supermarket_name=supermarkets.get(lst["supermarket_id"]),
-            items=items_with_info,
-            user_id=lst["user_id"],
-            total_estimated=total_estimated,
-            total_actual=total_actual,
-            created_at=lst["created_at"],
-            updated_at=lst["updated_at"]
-        ))
-    return result
+    # Any create, update or delete changes the count or the newest updated_at of the user's lists
+    summary = await db.shopping_lists.aggregate([
+        {"$match": {"user_id": user["id"]}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "updated_at": {"$max": "$updated_at"}}},
+    ]).to_list(1)
+    etag = etag_for("shopping-lists", user["id"], summary[0] if summary else None, await _catalog_fingerprints())
+    return await response_cache.respond(request, etag, build, cache_control=PRIVATE, keep=False)
 
-@router.get("/{list_id}", response_model=ShoppingListResponse)
-async def get_shopping_list(list_id: str, user: dict = Depends(get_current_user)):
+async def _shopping_list_response(list_id: str, user: dict) -> ShoppingListResponse:
     def map_id(doc):
         if doc and "id" not in doc and "_id" in doc:
             doc["id"] = str(doc["_id"])
@@ -241,21 +239,12 @@ async def get_shopping_list(list_id: str, user: dict = Depends(get_current_user)
 
     lst = map_id(lst_raw)
 
-    sm_raw = await db.supermarkets.find_one({"id": lst["supermarket_id"]})
-    supermarket = map_id(sm_raw)
+    supermarket = await reference_cache.get("supermarkets", lst["supermarket_id"])
+    products = await reference_cache.names("products")
+    units = await reference_cache.names("units")
+    brands = await reference_cache.names("brands")
 
-    all_prods = await db.products.find({}).to_list(1000)
-    products = {p.get("id") or str(p.get("_id")): p["name"] for p in all_prods}
-
-    all_units = await db.units.find({}).to_list(1000)
-    units = {u.get("id") or str(u.get("_id")): u["name"] for u in all_units}
-
-    all_brands = await db.brands.find({}).to_list(1000)
-    brands = {b.get("id") or str(b.get("_id")): b["name"] for b in all_brands}
-
-    sellable_products_data = await db.sellable_products.find({}).to_list(10000)
-    sellable_map = {sp.get("id") or str(sp.get("_id")): sp for sp in sellable_products_data}
-    sellable_lookup = _build_sellable_lookup(sellable_products_data)
+    sellable_map, sellable_lookup = await _sellables_for_lists([lst])
 
     items_with_info = []
     total_estimated = 0
@@ -305,6 +294,18 @@ async def get_shopping_list(list_id: str, user: dict = Depends(get_current_user)
         updated_at=lst["updated_at"]
     )
 
+@router.get("/{list_id}", response_model=ShoppingListResponse)
+async def get_shopping_list(list_id: str, request: Request, user: dict = Depends(get_current_user)):
+    async def build():
+        return await _shopping_list_response(list_id, user)
+
+    stamp = await db.shopping_lists.find_one({"id": list_id, "user_id": user["id"]}, {"_id": 0, "updated_at": 1})
+    if not stamp:
+        # Legacy lists addressed by ObjectId are rare; serve them without validation
+        return await build()
+    etag = etag_for("shopping-list", list_id, user["id"], stamp.get("updated_at"), await _catalog_fingerprints())
+    return await response_cache.respond(request, etag, build, cache_control=PRIVATE, keep=False)
+
 @router.put("/{list_id}", response_model=ShoppingListResponse)
 async def update_shopping_list(list_id: str, data: ShoppingListUpdate, user: dict = Depends(get_current_user)):
     lst = await db.shopping_lists.find_one({"id": list_id, "user_id": user["id"]}, {"_id": 0})
@@ -320,7 +321,7 @@ async def update_shopping_list(list_id: str, data: ShoppingListUpdate, user: dic
         update_data["items"] = [item.model_dump() for item in data.items]
 
     await db.shopping_lists.update_one({"id": list_id}, {"$set": update_data})
-    return await get_shopping_list(list_id, user)
+    return await _shopping_list_response(list_id, user)
 
 @router.delete("/{list_id}")
 async def delete_shopping_list(list_id: str, user: dict = Depends(get_current_user)):
@@ -335,11 +336,10 @@ async def submit_prices_from_list(list_id: str, user: dict = Depends(get_current
     if not lst:
         raise HTTPException(status_code=404, detail="Shopping list not found")
 
-    sellable_products_data = await db.sellable_products.find({}).to_list(10000)
-    sellable_map = {sp.get("id") or str(sp.get("_id")): sp for sp in sellable_products_data}
-    sellable_lookup = _build_sellable_lookup(sellable_products_data)
+    sellable_map, sellable_lookup = await _sellables_for_lists([lst])
 
     prices_created = 0
+    price_docs = []
     for item in lst.get("items", []):
         if item.get("price") and item.get("purchased"):
             sp_id, sp = _resolve_sellable_product(item, lst.get("supermarket_id"), sellable_map, sellable_lookup)
@@ -378,31 +378,47 @@ async def submit_prices_from_list(list_id: str, user: dict = Depends(get_current
                 "user_id": user["id"],
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
-            await db.prices.insert_one(price_doc)
+            price_docs.append(price_doc)
             prices_created += 1
 
     if prices_created > 0:
-        await add_points(user["id"], prices_created * 10, f"Precios subidos desde lista de compra")
-        await add_credits(user["id"], prices_created * 10, f"Precios subidos desde lista de compra")
+        await price_store.insert_many(price_docs, ordered=False)
+        await record_latest_prices(price_docs)
+        await record_price_rollups(price_docs)
+        await award(user["id"], prices_created * 10, "Precios subidos desde lista de compra")
 
     return {"message": f"{prices_created} precios subidos correctamente", "points_earned": prices_created * 10, "credits_earned": prices_created * 10}
 
 @router.post("/{list_id}/estimate")
-async def estimate_list(list_id: str, user: dict = Depends(get_current_user)):
+async def estimate_list(
+    list_id: str,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    user: dict = Depends(get_current_user)
+):
     lst = await db.shopping_lists.find_one({"id": list_id, "user_id": user["id"]}, {"_id": 0})
     if not lst:
         raise HTTPException(status_code=404, detail="Shopping list not found")
     
     items = lst.get("items", [])
     if not items:
-        return await get_shopping_list(list_id, user)
+        return await _shopping_list_response(list_id, user)
     
     # 1 credit per product
     cost = len(items)
-    if not await consume_credits(user["id"], cost, f"Estimación de lista: {lst['name']}"):
+    # Retries carrying the same Idempotency-Key are charged once
+    key = f"estimate:{list_id}:{idempotency_key}" if idempotency_key else None
+    charge = await reserve_credits(user["id"], cost, f"Estimación de lista: {lst['name']}", key)
+    if charge is None:
         raise HTTPException(status_code=402, detail=f"Créditos insuficientes. Necesitas {cost} créditos.")
+    if charge.get("pending"):
+        raise HTTPException(status_code=409, detail="Una solicitud con la misma Idempotency-Key está en curso")
+    response.headers["X-Credits-Remaining"] = str(charge["balance"])
+    if charge["replayed"]:
+        response.headers["Idempotent-Replayed"] = "true"
 
     # Calculate estimates
+    latest_variants = await get_latest_price_variants(item.get("sellable_product_id") for item in items)
     updated_items = []
     for item in items:
         sp_id = item.get("sellable_product_id")
@@ -412,23 +428,7 @@ async def estimate_list(list_id: str, user: dict = Depends(get_current_user)):
             
         estimated = None
         if sp_id:
-            price_query = {"sellable_product_id": sp_id}
-            if item.get("attribute_values"):
-                price_query["attribute_values"] = item["attribute_values"]
-
-            latest = await db.prices.find_one(
-                price_query,
-                {"_id": 0},
-                sort=[("created_at", -1)]
-            )
-
-            if not latest and item.get("attribute_values"):
-                latest = await db.prices.find_one(
-                    {"sellable_product_id": sp_id},
-                    {"_id": 0},
-                    sort=[("created_at", -1)]
-                )
-
+            latest = pick_latest(latest_variants, sp_id, item.get("attribute_values"))
             if latest:
                 latest_price = latest["price"]
                 latest_qty = latest.get("quantity", 1) or 1
@@ -443,4 +443,4 @@ async def estimate_list(list_id: str, user: dict = Depends(get_current_user)):
         {"$set": {"items": updated_items, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
-    return await get_shopping_list(list_id, user)
+    return await _shopping_list_response(list_id, user)
@@ -1,13 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import List, Optional
 import uuid
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
 from ..core.database import db
-from ..core.auth import get_current_user, add_points, add_credits
+from ..core.auth import get_current_user, award
+from ..core.pagination import before_filter, parse_before, set_next_cursor
 from ..models.extras import PostCreate, PostResponse, CommentCreate, CommentResponse, ReactionCreate
 
 router = APIRouter(prefix="/posts", tags=["social"])
 
+REACTION_TYPES = ("like", "love", "useful", "warning")
+
 @router.post("", response_model=PostResponse)
 async def create_post(data: PostCreate, user: dict = Depends(get_current_user)):
     post_id = str(uuid.uuid4())
@@ -17,13 +21,12 @@ async def create_post(data: PostCreate, user: dict = Depends(get_current_user)):
         "content": data.content,
         "post_type": data.post_type,
         "user_id": user["id"],
-        "reactions": {"like": 0, "love": 0, "useful": 0, "warning": 0},
-        "user_reactions": {},
+        "reactions": {r: 0 for r in REACTION_TYPES},
+        "comments_count": 0,
         "created_at": now
     }
     await db.posts.insert_one(doc)
-    await add_points(user["id"], 5, "Publicación creada")
-    await add_credits(user["id"], 5, "Publicación creada")
+    await award(user["id"], 5, "Publicación creada")
 
     return PostResponse(
         id=post_id,
@@ -36,51 +39,94 @@ async def create_post(data: PostCreate, user: dict = Depends(get_current_user)):
         created_at=now
     )
 
+def _page_with_authors(match: dict, limit: int, fields: dict) -> List[dict]:
+    # Newest first. One round trip per page: rows are read off a (created_at, id) index and each
+    # joins its author through the unique users.id index instead of loading every user's name
+    return [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "author"}},
+        {"$project": {"_id": 0, **fields, "user_name": {"$ifNull": [{"$arrayElemAt": ["$author.name", 0]}, "Unknown"]}}},
+    ]
+
 @router.get("", response_model=List[PostResponse])
-async def get_posts(limit: int = 50, user: dict = Depends(get_current_user)):
-    posts = await db.posts.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
-    users = {u["id"]: u["name"] for u in await db.users.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(1000)}
-
-    result = []
-    for p in posts:
-        comments_count = await db.comments.count_documents({"post_id": p["id"]})
-        result.append(PostResponse(
-            id=p["id"],
-            content=p["content"],
-            post_type=p.get("post_type", "update"),
-            user_id=p["user_id"],
-            user_name=users.get(p["user_id"], "Unknown"),
-            reactions=p.get("reactions", {"like": 0, "love": 0, "useful": 0, "warning": 0}),
-            comments_count=comments_count,
-            created_at=p["created_at"]
-        ))
-    return result
+async def get_posts(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    pipeline = _page_with_authors(
+        before_filter(parse_before(before)), limit,
+        {"id": 1, "content": 1, "post_type": 1, "user_id": 1, "reactions": 1, "comments_count": 1, "created_at": 1}
+    )
+    posts = await db.posts.aggregate(pipeline).to_list(limit)
+    set_next_cursor(response, posts, limit)
+    # Only the caller's own reactions, by the unique (post_id, user_id) index
+    mine = {r["post_id"]: r["reaction_type"] async for r in db.post_reactions.find(
+        {"post_id": {"$in": [p["id"] for p in posts]}, "user_id": user["id"]},
+        {"_id": 0, "post_id": 1, "reaction_type": 1}
+    )}
+
+    return [PostResponse(
+        id=p["id"],
+        content=p["content"],
+        post_type=p.get("post_type", "update"),
+        user_id=p["user_id"],
+        user_name=p["user_name"],
+        reactions=p.get("reactions", {r: 0 for r in REACTION_TYPES}),
+        my_reaction=mine.get(p["id"]),
+        comments_count=p.get("comments_count", 0),
+        created_at=p["created_at"]
+    ) for p in posts]
 
 @router.post("/{post_id}/react")
 async def react_to_post(post_id: str, data: ReactionCreate, user: dict = Depends(get_current_user)):
-    post = await db.posts.find_one({"id": post_id}, {"_id": 0})
-    if not post:
+    # Each user's reaction is one post_reactions document; the post only holds the counters,
+    # moved with $inc, so concurrent reactions never overwrite each other
+    reaction = data.reaction_type
+    if reaction not in REACTION_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid reaction type")
+    if not await db.posts.find_one({"id": post_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Post not found")
 
-    user_reactions = post.get("user_reactions", {})
-    reactions = post.get("reactions", {"like": 0, "love": 0, "useful": 0, "warning": 0})
-
-    previous_reaction = user_reactions.get(user["id"])
-    if previous_reaction:
-        reactions[previous_reaction] = max(0, reactions.get(previous_reaction, 0) - 1)
-
-    if previous_reaction != data.reaction_type:
-        reactions[data.reaction_type] = reactions.get(data.reaction_type, 0) + 1
-        user_reactions[user["id"]] = data.reaction_type
+    key = {"post_id": post_id, "user_id": user["id"]}
+    # Reacting again with the same type removes the reaction
+    removed = await db.post_reactions.delete_one({**key, "reaction_type": reaction})
+    if removed.deleted_count:
+        inc, mine = {f"reactions.{reaction}": -1}, None
     else:
-        user_reactions.pop(user["id"], None)
-
-    await db.posts.update_one({"id": post_id}, {"$set": {"reactions": reactions, "user_reactions": user_reactions}})
-    return {"reactions": reactions}
+        previous = await db.post_reactions.find_one_and_update(
+            key,
+            {"$set": {"reaction_type": reaction}, "$setOnInsert": {"created_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0, "reaction_type": 1},
+            upsert=True
+        )
+        previous = previous and previous.get("reaction_type")
+        inc, mine = {}, reaction
+        if previous != reaction:
+            inc[f"reactions.{reaction}"] = 1
+            if previous:
+                inc[f"reactions.{previous}"] = -1
+
+    if inc:
+        post = await db.posts.find_one_and_update(
+            {"id": post_id}, {"$inc": inc}, projection={"_id": 0, "reactions": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        post = await db.posts.find_one({"id": post_id}, {"_id": 0, "reactions": 1})
+    if not post:
+        # Deleted while we were reacting
+        await db.post_reactions.delete_many({"post_id": post_id})
+        raise HTTPException(status_code=404, detail="Post not found")
+    return {"reactions": post.get("reactions", {}), "my_reaction": mine}
 
 @router.post("/{post_id}/comments", response_model=CommentResponse)
 async def create_comment(post_id: str, data: CommentCreate, user: dict = Depends(get_current_user)):
-    post = await db.posts.find_one({"id": post_id}, {"_id": 0})
+    # The existence check and the counter update are the same write
+    post = await db.posts.find_one_and_update({"id": post_id}, {"$inc": {"comments_count": 1}}, projection={"_id": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -93,9 +139,12 @@ async def create_comment(post_id: str, data: CommentCreate, user: dict = Depends
         "user_id": user["id"],
         "created_at": now
     }
-    await db.comments.insert_one(doc)
-    await add_points(user["id"], 2, "Comentario añadido")
-    await add_credits(user["id"], 2, "Comentario añadido")
+    try:
+        await db.comments.insert_one(doc)
+    except Exception:
+        await db.posts.update_one({"id": post_id}, {"$inc": {"comments_count": -1}})
+        raise
+    await award(user["id"], 2, "Comentario añadido")
 
     return CommentResponse(
         id=comment_id,
@@ -107,22 +156,34 @@ async def create_comment(post_id: str, data: CommentCreate, user: dict = Depends
     )
 
 @router.get("/{post_id}/comments", response_model=List[CommentResponse])
-async def get_comments(post_id: str, user: dict = Depends(get_current_user)):
-    comments = await db.comments.find({"post_id": post_id}, {"_id": 0}).sort("created_at", 1).to_list(100)
-    users = {u["id"]: u["name"] for u in await db.users.find({}, {"_id": 0, "id": 1, "name": 1}).to_list(1000)}
+async def get_comments(
+    post_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    # Pages walk backwards from the newest comment; each page is returned oldest first
+    match = {"post_id": post_id, **before_filter(parse_before(before))}
+    pipeline = _page_with_authors(
+        match, limit,
+        {"id": 1, "post_id": 1, "content": 1, "user_id": 1, "created_at": 1}
+    )
+    comments = await db.comments.aggregate(pipeline).to_list(limit)
+    set_next_cursor(response, comments, limit)
 
     return [CommentResponse(
         id=c["id"],
         post_id=c["post_id"],
         content=c["content"],
         user_id=c["user_id"],
-        user_name=users.get(c["user_id"], "Unknown"),
+        user_name=c["user_name"],
         created_at=c["created_at"]
-    ) for c in comments]
+    ) for c in reversed(comments)]
 
 @router.delete("/{post_id}")
 async def delete_post(post_id: str, user: dict = Depends(get_current_user)):
-    post = await db.posts.find_one({"id": post_id})
+    post = await db.posts.find_one({"id": post_id}, {"_id": 0, "user_id": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
         
@@ -132,5 +193,6 @@ async def delete_post(post_id: str, user: dict = Depends(get_current_user)):
     await db.posts.delete_one({"id": post_id})
     # Also delete associated comments to avoid orphans
     await db.comments.delete_many({"post_id": post_id})
+    await db.post_reactions.delete_many({"post_id": post_id})
     
     return {"message": "Post deleted successfully"}
@@ -4,6 +4,7 @@ import uuid
 from datetime import datetime, timezone
 from ..core.database import db
 from ..core.auth import get_current_user
+from ..core.reference_cache import reference_cache
 from ..models.extras import AlertCreate, AlertResponse, NotificationResponse
 
 router = APIRouter(prefix="", tags=["user-features"])
@@ -24,8 +25,8 @@ async def create_alert(data: AlertCreate, user: dict = Depends(get_current_user)
     }
     await db.alerts.insert_one(doc)
 
-    product = await db.products.find_one({"id": data.product_id}, {"_id": 0})
-    supermarket = await db.supermarkets.find_one({"id": data.supermarket_id}, {"_id": 0}) if data.supermarket_id else None
+    product = await reference_cache.get("products", data.product_id)
+    supermarket = await reference_cache.get("supermarkets", data.supermarket_id)
 
     return AlertResponse(
         **doc,
@@ -36,8 +37,8 @@ async def create_alert(data: AlertCreate, user: dict = Depends(get_current_user)
 @router.get("/alerts", response_model=List[AlertResponse])
 async def get_alerts(user: dict = Depends(get_current_user)):
     alerts = await db.alerts.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    products = {p["id"]: p["name"] for p in await db.products.find({}, {"_id": 0}).to_list(1000)}
-    supermarkets = {s["id"]: s["name"] for s in await db.supermarkets.find({}, {"_id": 0}).to_list(1000)}
+    products = await reference_cache.names("products")
+    supermarkets = await reference_cache.names("supermarkets")
 
     return [AlertResponse(
         **a,
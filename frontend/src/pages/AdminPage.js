@@ -453,11 +453,24 @@ const AdminPage = () => {
         }
     };
 
+    // Polls a background admin job until it finishes; rejects on failure or cancellation
+    const waitForJob = async (jobId) => {
+        for (;;) {
+            const { data: job } = await axios.get(`${API}/admin/jobs/${jobId}`);
+            if (job.status === "succeeded") return job;
+            if (job.status === "failed" || job.status === "cancelled") {
+                throw new Error(job.error || "El trabajo no se completó");
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1500));
+        }
+    };
+
     const handleRebuildProductUnitRelationships = async () => {
         setRelationRebuildLoading(true);
         try {
-            const response = await axios.post(`${API}/admin/product-units/rebuild`);
-            toast.success(`${response.data.message}: ${response.data.product_unit_links_processed} relaciones procesadas`);
+            const response = await axios.post(`${API}/admin/product-units/rebuild?background=true`);
+            const job = await waitForJob(response.data.id);
+            toast.success(`${job.result.message}: ${job.result.product_unit_links_processed} relaciones procesadas`);
             await fetchAllData();
         } catch (error) {
             console.error("Error rebuilding relations:", error);
@@ -681,8 +694,10 @@ const AdminPage = () => {
     const handleExportDB = async () => {
         try {
             setSystemLoading(true);
+            const started = await axios.post(`${API}/admin/system/export?format=${exportFormat}&include_prices=${includePrices}`);
+            const job = await waitForJob(started.data.id);
             const response = await axios({
-                url: `${API}/admin/system/export?format=${exportFormat}&include_prices=${includePrices}`,
+                url: `${API}/admin/jobs/${job.id}/artifact`,
                 method: 'GET',
                 responseType: 'blob',
             });
@@ -711,11 +726,12 @@ const AdminPage = () => {
 
         try {
             setSystemLoading(true);
-            const res = await axios.post(`${API}/admin/system/import`, formData, {
+            const res = await axios.post(`${API}/admin/system/import?background=true`, formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
+            const job = await waitForJob(res.data.id);
             toast.success("Base de datos importada correctamente");
-            console.log("Import results:", res.data.results);
+            console.log("Import results:", job.result.results);
             await fetchAllData();
         } catch (error) {
             console.error("Import error:", error);
@@ -2041,7 +2057,7 @@ const AdminPage = () => {
                                     </div>
                                     <div>
                                         <CardTitle className="text-base text-emerald-900">Exportar Configuración</CardTitle>
-                                        <p className="text-[11px] text-slate-500">Descarga estructura en XLSX u ODS</p>
+                                        <p className="text-[11px] text-slate-500">Descarga estructura en XLSX, ODS, NDJSON o CSV</p>
                                     </div>
                                 </div>
                             </CardHeader>
@@ -2062,6 +2078,18 @@ const AdminPage = () => {
                                             >
                                                 ODS
                                             </button>
+                                            <button 
+                                                onClick={() => setExportFormat("ndjson.gz")}
+                                                className={`px-3 py-1 text-[10px] font-bold rounded-sm transition-all ${exportFormat === "ndjson.gz" ? "bg-white text-emerald-600 shadow-sm" : "text-slate-400"}`}
+                                            >
+                                                NDJSON
+                                            </button>
+                                            <button 
+                                                onClick={() => setExportFormat("csv.zip")}
+                                                className={`px-3 py-1 text-[10px] font-bold rounded-sm transition-all ${exportFormat === "csv.zip" ? "bg-white text-emerald-600 shadow-sm" : "text-slate-400"}`}
+                                            >
+                                                CSV
+                                            </button>
                                         </div>
                                     </div>
                                     <div className="flex items-center space-x-2 p-2 bg-slate-50 rounded-lg border border-slate-100 mb-2">
@@ -2105,7 +2133,7 @@ const AdminPage = () => {
                                 <div className="relative">
                                     <Input 
                                         type="file" 
-                                        accept=".xlsx, .xls, .ods"
+                                        accept=".xlsx, .xls, .ods, .ndjson, .jsonl, .gz, .csv, .zip"
                                         onChange={(e) => { handleImportDB(e); setSystemDialog(false); }}
                                         disabled={systemLoading}
                                         className="opacity-0 absolute inset-0 w-full h-full cursor-pointer z-10"
@@ -32,6 +32,8 @@ const FeedPage = () => {
     const [expandedComments, setExpandedComments] = useState({});
     const [comments, setComments] = useState({});
     const [newComments, setNewComments] = useState({});
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         fetchPosts();
@@ -41,6 +43,7 @@ const FeedPage = () => {
         try {
             const response = await axios.get(`${API}/posts`);
             setPosts(response.data);
+            setNextCursor(response.headers["x-next-cursor"] || null);
         } catch (error) {
             console.error("Error fetching posts:", error);
         } finally {
@@ -48,6 +51,20 @@ const FeedPage = () => {
         }
     };
 
+    const fetchMorePosts = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const response = await axios.get(`${API}/posts`, { params: { before: nextCursor } });
+            setPosts([...posts, ...response.data]);
+            setNextCursor(response.headers["x-next-cursor"] || null);
+        } catch (error) {
+            toast.error("Error al cargar publicaciones");
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const handleCreatePost = async () => {
         if (!newPost.trim()) return;
         setPosting(true);
@@ -66,7 +83,7 @@ const FeedPage = () => {
     const handleReaction = async (postId, reactionType) => {
         try {
             const response = await axios.post(`${API}/posts/${postId}/react`, { reaction_type: reactionType });
-            setPosts(posts.map(p => p.id === postId ? { ...p, reactions: response.data.reactions } : p));
+            setPosts(posts.map(p => p.id === postId ? { ...p, reactions: response.data.reactions, my_reaction: response.data.my_reaction } : p));
         } catch (error) {
             toast.error("Error al reaccionar");
         }
@@ -253,7 +270,7 @@ const FeedPage = () => {
                                                 variant="ghost"
                                                 size="sm"
                                                 onClick={() => handleReaction(post.id, btn.type)}
-                                                className={`gap-1.5 ${post.reactions[btn.type] > 0 ? 'text-emerald-600' : 'text-slate-500'}`}
+                                                className={`gap-1.5 ${post.my_reaction === btn.type ? 'text-emerald-600' : 'text-slate-500'}`}
                                                 data-testid={`reaction-${btn.type}-${post.id}`}
                                             >
                                                 {btn.icon}
@@ -315,6 +332,18 @@ const FeedPage = () => {
                                 </CardContent>
                             </Card>
                         ))}
+                        {nextCursor && (
+                            <div className="text-center">
+                                <Button
+                                    variant="outline"
+                                    onClick={fetchMorePosts}
+                                    disabled={loadingMore}
+                                    data-testid="load-more-posts"
+                                >
+                                    {loadingMore ? "Cargando..." : "Cargar más"}
+                                </Button>
+                            </div>
+                        )}
                     </div>
                 )}
             </div>
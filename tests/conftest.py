@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend is not an installed package; tests import it as `app` the way uvicorn does from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
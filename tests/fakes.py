@@ -0,0 +1,174 @@
+import copy
+from typing import List, Optional, Sequence, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+# Just enough of the Motor collection API, in memory, for tests of code that talks to db.<collection>.
+# Filters support equality and $in/$nin/$ne/$lt/$lte/$gt/$gte/$exists; updates support $set/$inc/$unset
+# and $push with $each/$slice.
+
+def _get(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+def _matches_op(value, present: bool, op: str, arg) -> bool:
+    if op == "$exists":
+        return present == bool(arg)
+    if op == "$in":
+        return present and value in arg
+    if op == "$nin":
+        return not present or value not in arg
+    if op == "$ne":
+        return value != arg
+    if not present or value is None:
+        return False
+    return {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+            continue
+        value, present = _get(doc, key)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_matches_op(value, present, op, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+def apply_update(doc: dict, update: dict):
+    for field, value in update.get("$set", {}).items():
+        doc[field] = value
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+    for field, amount in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + amount
+    for field, value in update.get("$push", {}).items():
+        items = doc.setdefault(field, [])
+        if isinstance(value, dict) and "$each" in value:
+            items.extend(value["$each"])
+            if "$slice" in value:
+                doc[field] = items[value["$slice"]:] if value["$slice"] < 0 else items[:value["$slice"]]
+        else:
+            items.append(value)
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    doc = copy.deepcopy(doc)
+    doc.pop("_id", None)
+    fields = [k for k, v in (projection or {}).items() if v and k != "_id"]
+    return {k: v for k, v in doc.items() if k in fields} if fields else doc
+
+class Result:
+    def __init__(self, matched: int = 0, modified: int = 0, deleted: int = 0):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.deleted_count = deleted
+
+class FakeCursor:
+    def __init__(self, docs: List[dict]):
+        self._docs = docs
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        for field, d in reversed(keys):
+            self._docs.sort(key=lambda doc: _get(doc, field)[0] or "", reverse=d < 0)
+        return self
+
+    def limit(self, n: int):
+        self._docs = self._docs[:n] if n else self._docs
+        return self
+
+    def batch_size(self, n: int):
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+class FakeCollection:
+    def __init__(self, docs: Sequence[dict] = (), unique: Sequence[Tuple[str, ...]] = ()):
+        self.docs = [copy.deepcopy(d) for d in docs]
+        self.unique = list(unique)
+
+    def _check_unique(self, doc: dict):
+        for fields in self.unique:
+            key = [_get(doc, f) for f in fields]
+            if all(present for _, present in key) and any(
+                    [_get(other, f) for f in fields] == key for other in self.docs):
+                raise DuplicateKeyError(f"duplicate key {fields}")
+
+    async def insert_one(self, doc: dict):
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True):
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        for doc in self.docs:
+            if matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> FakeCursor:
+        return FakeCursor([_project(doc, projection) for doc in self.docs if matches(doc, query)])
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None, return_document=False, **kwargs):
+        for doc in self.docs:
+            if matches(doc, query):
+                before = _project(doc, projection)
+                apply_update(doc, update)
+                return _project(doc, projection) if return_document else before
+        return None
+
+    async def update_one(self, query: dict, update: dict, **kwargs) -> Result:
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return Result(matched=1, modified=1)
+        return Result()
+
+    async def update_many(self, query: dict, update: dict, **kwargs) -> Result:
+        hits = [doc for doc in self.docs if matches(doc, query)]
+        for doc in hits:
+            apply_update(doc, update)
+        return Result(matched=len(hits), modified=len(hits))
+
+    async def delete_one(self, query: dict) -> Result:
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return Result(deleted=1)
+        return Result()
+
+    async def delete_many(self, query: dict) -> Result:
+        kept = [doc for doc in self.docs if not matches(doc, query)]
+        deleted, self.docs = len(self.docs) - len(kept), kept
+        return Result(deleted=deleted)
+
+    async def count_documents(self, query: Optional[dict] = None) -> int:
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+class FakeDB:
+    def __init__(self, **collections: FakeCollection):
+        self._collections = dict(collections)
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return getattr(self, name)
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app.core import alerts
+from tests.fakes import FakeCollection, FakeDB
+
+EVENT = {"product_id": "p1", "supermarket_id": "s1", "price": 1.5, "previous_price": 2.0,
+         "product_name": "Leche", "supermarket_name": "Súper"}
+
+def _alert(alert_id, alert_type, target_price=None, supermarket_id="s1"):
+    return {"id": alert_id, "user_id": f"user-{alert_id}", "product_id": "p1", "supermarket_id": supermarket_id,
+            "alert_type": alert_type, "target_price": target_price, "triggered": False}
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB(alerts=FakeCollection([
+        _alert("below", "below", 1.8),
+        _alert("any", "any_change", supermarket_id=None),
+        _alert("above", "above", 1.8),
+        _alert("elsewhere", "any_change", supermarket_id="s2"),
+    ]))
+    monkeypatch.setattr(alerts, "db", fake)
+    return fake
+
+def test_matching_alerts_are_notified_once(db):
+    assert asyncio.run(alerts.evaluate_price_event(EVENT)) == 2
+    assert sorted(n["user_id"] for n in db.notifications.docs) == ["user-any", "user-below"]
+    assert {a["id"] for a in db.alerts.docs if a["triggered"]} == {"below", "any"}
+
+    assert asyncio.run(alerts.evaluate_price_event(EVENT)) == 0
+    assert len(db.notifications.docs) == 2
+
+def test_overlapping_evaluations_do_not_notify_twice(db):
+    matched = [{"id": "below", "user_id": "user-below"}, {"id": "any", "user_id": "user-any"}]
+
+    async def scenario():
+        return await asyncio.gather(alerts._trigger(matched, EVENT), alerts._trigger(matched, EVENT))
+
+    assert sorted(asyncio.run(scenario())) == [0, 2]
+    assert len(db.notifications.docs) == 2
@@ -0,0 +1,52 @@
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from app.core.compression import CompressionMiddleware, choose_encoding
+
+PREFERRED = ["br", "zstd", "gzip"]
+
+def test_server_preference_breaks_ties():
+    assert choose_encoding("gzip, br", PREFERRED) == "br"
+
+def test_highest_q_value_wins():
+    assert choose_encoding("br;q=0.5, gzip;q=0.9", PREFERRED) == "gzip"
+
+def test_refused_and_unknown_encodings():
+    assert choose_encoding("gzip;q=0", PREFERRED) is None
+    assert choose_encoding("deflate", PREFERRED) is None
+    assert choose_encoding("", PREFERRED) is None
+
+def test_wildcard_and_explicit_refusal():
+    assert choose_encoding("*", ["gzip"]) == "gzip"
+    assert choose_encoding("*, gzip;q=0", ["gzip"]) is None
+
+def test_malformed_q_value_is_refused():
+    assert choose_encoding("gzip;q=abc", ["gzip"]) is None
+
+def _client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100, encodings=("gzip",))
+
+    @app.get("/big")
+    def big():
+        return Response(b'{"rows": "' + b"x" * 500 + b'"}', media_type="application/json", headers={"ETag": '"v1"'})
+
+    @app.get("/small")
+    def small():
+        return {"ok": True}
+
+    return TestClient(app)
+
+def test_large_json_is_gzipped_with_a_weak_etag():
+    response = _client().get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()["rows"]) == 500
+
+def test_small_bodies_and_refusals_pass_through():
+    client = _client()
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    raw = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert raw.headers["etag"] == '"v1"'
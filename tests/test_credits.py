@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core import auth
+from tests.fakes import FakeCollection, FakeDB
+
+KEY = "estimate:l1:k1"
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB(
+        users=FakeCollection([{"id": "u1", "credits": 10}]),
+        credit_history=FakeCollection(unique=[("user_id", "idempotency_key")]),
+    )
+    monkeypatch.setattr(auth, "db", fake)
+    return fake
+
+def _reserve(amount=3, key=KEY):
+    return asyncio.run(auth.reserve_credits("u1", amount, "test", key))
+
+def _ago(seconds: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+def test_retry_is_replayed_without_charging_twice(db):
+    assert _reserve() == {"balance": 7, "replayed": False}
+    assert _reserve() == {"balance": 7, "replayed": True}
+    [entry] = db.credit_history.docs
+    assert entry["status"] == "charged"
+    assert db.users.docs[0]["recent_charges"] == [entry["id"]]
+
+def test_insufficient_balance_releases_the_key(db):
+    assert _reserve(amount=11) is None
+    assert db.credit_history.docs == []
+    assert _reserve(amount=10) == {"balance": 0, "replayed": False}
+
+def test_retry_while_first_attempt_is_pending(db):
+    db.credit_history.docs.append({"id": "e1", "user_id": "u1", "idempotency_key": KEY, "status": "pending", "created_at": _ago(1)})
+    assert _reserve() == {"balance": 10, "replayed": False, "pending": True}
+    assert db.users.docs[0]["credits"] == 10
+
+def test_stale_pending_entry_is_reclaimed(db):
+    stale = _ago(auth.RESERVATION_TIMEOUT_SECONDS + 5)
+    db.credit_history.docs.append({"id": "e1", "user_id": "u1", "idempotency_key": KEY, "status": "pending", "created_at": stale})
+    assert _reserve() == {"balance": 7, "replayed": False}
+    [entry] = db.credit_history.docs
+    assert entry["id"] != "e1" and entry["status"] == "charged"
+
+def test_pending_entry_whose_debit_committed_is_replayed(db):
+    db.users.docs[0].update(credits=7, recent_charges=["e1"])
+    db.credit_history.docs.append({"id": "e1", "user_id": "u1", "idempotency_key": KEY, "status": "pending", "created_at": _ago(3600)})
+    assert _reserve() == {"balance": 7, "replayed": True}
+    assert db.credit_history.docs[0]["status"] == "charged"
+    assert db.users.docs[0]["credits"] == 7
+
+def test_without_key_history_is_written_after_the_debit(db):
+    assert asyncio.run(auth.reserve_credits("u1", 4, "test")) == {"balance": 6, "replayed": False}
+    assert [e["amount"] for e in db.credit_history.docs] == [4]
+    assert "recent_charges" not in db.users.docs[0]
@@ -0,0 +1,45 @@
+import asyncio
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core import database
+
+class Collection:
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.calls = []
+
+    async def create_indexes(self, models):
+        names = [m.document["name"] for m in models]
+        self.calls.append(names)
+        if self.failing.intersection(names):
+            raise OperationFailure("E11000 duplicate key error")
+        return names
+
+def _create(monkeypatch, models, failing):
+    coll = Collection(failing)
+    monkeypatch.setattr(database, "db", {"products": coll})
+    return asyncio.run(database._create_indexes("products", models)), coll.calls
+
+MODELS = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    IndexModel([("category_id", ASCENDING)], name="category_id"),
+    IndexModel([("brand_id", ASCENDING)], name="brand_id"),
+]
+
+def test_failing_unique_index_does_not_block_the_others(monkeypatch):
+    result, calls = _create(monkeypatch, MODELS, failing={"id_unique"})
+    assert calls == [["category_id", "brand_id"], ["id_unique"]]
+    assert result["created"] == ["category_id", "brand_id"]
+    assert list(result["errors"]) == ["id_unique"]
+
+def test_failing_plain_index_is_isolated(monkeypatch):
+    result, calls = _create(monkeypatch, MODELS, failing={"brand_id"})
+    assert calls == [["category_id", "brand_id"], ["category_id"], ["brand_id"], ["id_unique"]]
+    assert result["created"] == ["category_id", "id_unique"]
+    assert list(result["errors"]) == ["brand_id"]
+
+def test_all_created(monkeypatch):
+    result, _ = _create(monkeypatch, MODELS, failing=())
+    assert result == ["category_id", "brand_id", "id_unique"]
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core import jobs
+from tests.fakes import FakeCollection, FakeDB
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB(jobs=FakeCollection())
+    monkeypatch.setattr(jobs, "db", fake)
+    return fake
+
+def _ago(seconds: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+STALE = jobs.HEARTBEAT_INTERVAL_SECONDS * 6 + 5
+
+@pytest.mark.parametrize("job", [
+    {"id": "j", "status": jobs.JOB_RUNNING, "created_at": _ago(600), "started_at": _ago(600), "heartbeat_at": _ago(STALE)},
+    {"id": "j", "status": jobs.JOB_QUEUED, "created_at": _ago(STALE), "started_at": None},
+])
+def test_orphaned_jobs_are_failed(db, job):
+    db.jobs.docs.append(job)
+    result = asyncio.run(jobs.get_job("j"))
+    assert result["status"] == jobs.JOB_FAILED
+    assert db.jobs.docs[0]["status"] == jobs.JOB_FAILED
+
+@pytest.mark.parametrize("job", [
+    {"id": "j", "status": jobs.JOB_RUNNING, "created_at": _ago(600), "started_at": _ago(600), "heartbeat_at": _ago(1)},
+    {"id": "j", "status": jobs.JOB_QUEUED, "created_at": _ago(600), "started_at": None, "heartbeat_at": _ago(1)},
+    {"id": "j", "status": jobs.JOB_SUCCEEDED, "created_at": _ago(600), "finished_at": _ago(500)},
+])
+def test_live_and_finished_jobs_are_left_alone(db, job):
+    db.jobs.docs.append(dict(job))
+    assert asyncio.run(jobs.get_job("j"))["status"] == job["status"]
+
+def test_queued_jobs_heartbeat_while_waiting_for_a_slot(db, monkeypatch):
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL_SECONDS", 0.01)
+
+    async def scenario():
+        runner = jobs.JobRunner(workers=1)
+        release = asyncio.Event()
+
+        async def blocking(ctx):
+            await release.wait()
+
+        await runner.submit("first", blocking)
+        second = await runner.submit("second", blocking)
+        await asyncio.sleep(0.05)
+        waiting = await db.jobs.find_one({"id": second["id"]})
+        release.set()
+        await asyncio.gather(*runner._tasks.values())
+        return waiting
+
+    waiting = asyncio.run(scenario())
+    assert waiting["status"] == jobs.JOB_QUEUED
+    assert waiting["heartbeat_at"] > waiting["created_at"]
+    assert [doc["status"] for doc in db.jobs.docs] == [jobs.JOB_SUCCEEDED, jobs.JOB_SUCCEEDED]
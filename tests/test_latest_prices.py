@@ -0,0 +1,8 @@
+from app.core.latest_prices import BASE_VARIANT, _newest_by_variant, variant_key
+
+def test_newest_by_variant_picks_base_among_all_groups():
+    plain = {"price": 1, "created_at": "2026-01-01T00:00:00+00:00"}
+    red_old = {"price": 2, "attribute_values": {"color": "red", "size": "L"}, "created_at": "2026-01-02T00:00:00+00:00"}
+    red_new = {"price": 3, "attribute_values": {"size": "L", "color": "red"}, "created_at": "2026-01-03T00:00:00+00:00"}
+    newest = _newest_by_variant([plain, red_new, red_old])
+    assert newest == {BASE_VARIANT: red_new, variant_key({"color": "red", "size": "L"}): red_new}
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.core import ledger as ledger_module
+from app.core.ledger import Ledger
+from tests.fakes import FakeCollection, FakeDB, apply_update, matches
+
+class FlakyUsers(FakeCollection):
+    # Unordered bulk_write where the $inc for the users in `failing` is rejected
+    def __init__(self, docs, failing=()):
+        super().__init__(docs)
+        self.failing = set(failing)
+
+    async def bulk_write(self, ops, ordered=True):
+        errors = []
+        for i, op in enumerate(ops):
+            if op._filter["id"] in self.failing:
+                errors.append({"index": i, "code": 121, "errmsg": "Document failed validation"})
+                continue
+            for doc in self.docs:
+                if matches(doc, op._filter):
+                    apply_update(doc, op._doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nModified": len(ops) - len(errors)})
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB(users=FlakyUsers([{"id": "u1", "points": 0, "credits": 0}, {"id": "u2", "points": 0, "credits": 0}], failing={"u2"}))
+    monkeypatch.setattr(ledger_module, "db", fake)
+    return fake
+
+def _buffering_ledger() -> Ledger:
+    ledger = Ledger(flush_interval=60, max_pending=1000)
+    # As if the periodic flusher were running, so awards stay buffered until flush()
+    ledger._flusher = object()
+    return ledger
+
+def test_partial_bulk_write_failure_keeps_only_the_failed_users(db):
+    ledger = _buffering_ledger()
+
+    async def scenario():
+        await ledger.award("u1", points=5, credits=5, reason="a")
+        await ledger.award("u2", points=3, reason="b")
+        return await ledger.flush()
+
+    assert asyncio.run(scenario()) == 2
+    assert db.users.docs[0] == {"id": "u1", "points": 5, "credits": 5}
+    assert db.users.docs[1] == {"id": "u2", "points": 0, "credits": 0}
+    assert [d["user_id"] for d in db.point_history.docs] == ["u1"]
+    assert ledger.pending_for("u1") == {"points": 0, "credits": 0}
+    assert ledger.pending_for("u2") == {"points": 3, "credits": 0}
+
+    db.users.failing.clear()
+    assert asyncio.run(ledger.flush()) == 1
+    assert db.users.docs[1]["points"] == 3
+    assert [d["user_id"] for d in db.point_history.docs] == ["u1", "u2"]
+    assert ledger.stats()["pending_entries"] == 0
+
+def test_flush_of_selected_users_leaves_the_rest_buffered(db):
+    db.users.failing.clear()
+    ledger = _buffering_ledger()
+
+    async def scenario():
+        await ledger.award("u1", credits=2)
+        await ledger.award("u2", credits=4)
+        await ledger.flush(["u2"])
+
+    asyncio.run(scenario())
+    assert db.users.docs[1]["credits"] == 4
+    assert db.users.docs[0]["credits"] == 0
+    assert ledger.pending_for("u1") == {"points": 0, "credits": 2}
@@ -0,0 +1,57 @@
+import pytest
+from fastapi import HTTPException, Response
+
+from app.core.pagination import (
+    NEXT_CURSOR_HEADER, before_filter, cursor_of, decode_cursor, encode_cursor, parse_before, set_next_cursor,
+)
+
+def test_parse_before():
+    assert parse_before(None) is None
+    assert parse_before("2026-10-17T10:00:00+00:00,abc") == ("2026-10-17T10:00:00+00:00", "abc")
+    with pytest.raises(HTTPException) as exc:
+        parse_before("no-comma")
+    assert exc.value.status_code == 400
+
+def test_before_filter_defaults_to_id_tiebreak():
+    assert before_filter(None) == {}
+    assert before_filter(("2026-10-17", "x")) == {"$or": [
+        {"created_at": {"$lt": "2026-10-17"}},
+        {"created_at": "2026-10-17", "id": {"$lt": "x"}},
+    ]}
+
+def test_next_cursor_only_on_full_pages():
+    page = [{"created_at": "2026-10-17T10:00:00+00:00", "id": "b"}, {"created_at": "2026-10-16T10:00:00+00:00", "id": "a"}]
+    full = Response()
+    set_next_cursor(full, page, limit=2)
+    assert full.headers[NEXT_CURSOR_HEADER] == cursor_of(page[-1]) == "2026-10-16T10:00:00+00:00,a"
+    assert parse_before(full.headers[NEXT_CURSOR_HEADER]) == ("2026-10-16T10:00:00+00:00", "a")
+    short = Response()
+    set_next_cursor(short, page, limit=3)
+    assert NEXT_CURSOR_HEADER not in short.headers
+
+def test_cursor_round_trip():
+    token = encode_cursor("2026-10-17T10:00:00+00:00", "65f0c0ffee")
+    assert "=" not in token
+    assert decode_cursor(token) == ("2026-10-17T10:00:00+00:00", "65f0c0ffee")
+
+def test_missing_cursor():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+@pytest.mark.parametrize("token", ["not base64!", encode_cursor("a", "b")[:-3], "WzEsMl0"])
+def test_invalid_cursor_is_a_400(token):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(token)
+    assert exc.value.status_code == 400
+
+def test_before_filter_with_object_id_tiebreak():
+    assert before_filter(("2026-10-17", "x"), tiebreak="_id") == {"$or": [
+        {"created_at": {"$lt": "2026-10-17"}},
+        {"created_at": "2026-10-17", "_id": {"$lt": "x"}},
+    ]}
+
+def test_next_cursor_with_custom_encoder():
+    response = Response()
+    set_next_cursor(response, [{"created_at": "2026-10-17", "_id": "65f0"}], limit=1,
+                    cursor=lambda doc: encode_cursor(doc["created_at"], doc["_id"]))
+    assert decode_cursor(response.headers[NEXT_CURSOR_HEADER]) == ("2026-10-17", "65f0")
@@ -0,0 +1,25 @@
+from app.core.price_rollups import _summaries, bucket_of, day_of
+
+def test_day_of_uses_utc_days():
+    assert day_of("2026-01-02T00:30:00+02:00") == "2026-01-01"
+    assert day_of("2026-01-02T10:00:00") == "2026-01-02"
+    assert day_of("garbage-value") == "garbage-va"
+
+def test_bucket_of():
+    assert bucket_of("2026-10-17", "day") == "2026-10-17"
+    assert bucket_of("2026-10-17", "week") == "2026-10-12"
+    assert bucket_of("2026-10-17", "month") == "2026-10-01"
+
+def test_summaries_fold_a_batch_out_of_order():
+    docs = [
+        {"sellable_product_id": "sp1", "price": 2, "quantity": 2, "created_at": "2026-01-01T10:00:00+00:00"},
+        {"sellable_product_id": "sp1", "price": 1, "quantity": 0, "created_at": "2026-01-01T08:00:00+00:00"},
+        {"sellable_product_id": "sp1", "price": 3, "created_at": "2026-01-02T09:00:00+00:00"},
+        {"price": 9, "created_at": "2026-01-01T09:00:00+00:00"},
+    ]
+    summaries = _summaries(docs, {"sp1": {"product_id": "p1", "supermarket_id": "s1", "brand_id": "b1"}})
+    assert set(summaries) == {("sp1", "2026-01-01"), ("sp1", "2026-01-02")}
+    day = summaries[("sp1", "2026-01-01")]
+    assert (day["open"], day["close"], day["high"], day["low"]) == (1, 2, 2, 1)
+    assert (day["count"], day["sum_price"], day["sum_unit_price"]) == (2, 3, 2.0)
+    assert (day["close_unit_price"], day["close_quantity"], day["product_id"]) == (1.0, 2, "p1")
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+from app.core.price_store import (
+    LEGACY_SHAPE, from_observation, to_observation, translate_filter, translate_pipeline, translate_sort
+)
+
+def test_translate_filter_maps_meta_and_time_fields():
+    query = {
+        "$and": [
+            {"$or": [{"sellable_product_id": {"$in": ["sp1"]}}, {"product_id": "p1", "supermarket_id": "s1"}]},
+            {"created_at": {"$gte": "2026-01-01", "$lt": "2026-02-01T00:00:00+01:00"}},
+        ],
+        "user_id": "u1",
+    }
+    assert translate_filter(query) == {
+        "$and": [
+            {"$or": [{"meta.sellable_product_id": {"$in": ["sp1"]}},
+                     {"meta.product_id": "p1", "meta.supermarket_id": "s1"}]},
+            {"observed_at": {"$gte": datetime(2026, 1, 1, tzinfo=timezone.utc),
+                             "$lt": datetime(2026, 1, 31, 23, tzinfo=timezone.utc)}},
+        ],
+        "user_id": "u1",
+    }
+    assert translate_filter(None) == {}
+
+def test_translate_sort():
+    assert translate_sort("created_at", -1) == [("observed_at", -1)]
+    assert translate_sort([("created_at", -1), ("_id", -1)]) == [("observed_at", -1), ("_id", -1)]
+
+def test_observation_round_trip():
+    doc = {"id": "pr1", "sellable_product_id": "sp1", "brand_id": None, "price": 1.5,
+           "created_at": "2026-10-17T10:00:00.123456+00:00"}
+    observation = to_observation(doc)
+    assert observation["meta"] == {"sellable_product_id": "sp1"}
+    assert "created_at" not in observation and "sellable_product_id" not in observation
+    # The driver returns naive UTC datetimes truncated to milliseconds
+    observation["observed_at"] = observation["observed_at"].replace(tzinfo=None, microsecond=123000)
+    assert from_observation(observation) == {
+        "id": "pr1", "price": 1.5, "sellable_product_id": "sp1", "created_at": "2026-10-17T10:00:00.123+00:00",
+    }
+
+def test_translate_pipeline_keeps_leading_match_and_sort_first():
+    pipeline = [
+        {"$match": {"sellable_product_id": {"$exists": True}}},
+        {"$sort": {"sellable_product_id": 1, "created_at": -1}},
+        {"$group": {"_id": "$sellable_product_id"}},
+    ]
+    assert translate_pipeline(pipeline) == [
+        {"$match": {"meta.sellable_product_id": {"$exists": True}}},
+        {"$sort": {"meta.sellable_product_id": 1, "observed_at": -1}},
+        *LEGACY_SHAPE,
+        {"$group": {"_id": "$sellable_product_id"}},
+    ]
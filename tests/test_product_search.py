@@ -0,0 +1,19 @@
+from app.core.product_search import MAX_PREFIX, normalize, search_entry, words
+
+def test_normalize_folds_case_accents_and_punctuation():
+    assert normalize("Plátano de Canarias, 1kg") == "platano de canarias 1kg"
+    assert normalize("  PIÑA—Ñandú ") == "pina nandu"
+    assert normalize(None) == ""
+
+def test_query_words_match_stored_prefixes():
+    entry = search_entry({"id": "p1", "name": "Plátano Canario", "category_id": "c1"})
+    assert entry["name"] == "platano canario"
+    assert entry["words"] == ["canario", "platano"]
+    assert all(word in entry["terms"] for word in words("pla CAN platano"))
+    assert "lat" not in entry["terms"]
+    assert entry["category_id"] == "c1" and entry["brand_id"] is None
+
+def test_prefixes_are_capped():
+    entry = search_entry({"_id": "abc", "name": "x" * 40})
+    assert entry["product_id"] == "abc"
+    assert max(len(t) for t in entry["terms"]) == MAX_PREFIX
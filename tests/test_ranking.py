@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.core import ranking
+from app.core.ranking import Leaderboard
+from tests.fakes import FakeCollection, FakeDB
+
+class RacingUsers(FakeCollection):
+    # The full scan hands out u1 and only then lets `during_scan` run, like an award whose write lands
+    # after the scan has already read that user
+    during_scan = None
+
+    def find(self, query=None, projection=None):
+        cursor = super().find(query, projection)
+        if query or self.during_scan is None:
+            return cursor
+        hook, self.during_scan = self.during_scan, None
+
+        async def scan():
+            async for doc in cursor:
+                yield doc
+                if doc["id"] == "u1":
+                    hook()
+        return scan()
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB(users=RacingUsers([
+        {"id": "u1", "name": "Ana", "points": 10},
+        {"id": "u2", "name": "Luis", "points": 20},
+    ]))
+    monkeypatch.setattr(ranking, "db", fake)
+    return fake
+
+def test_award_applied_during_resync_survives_the_swap(db):
+    board = Leaderboard(resync_seconds=60)
+
+    def award():
+        db.users.docs[0]["points"] += 15
+        board.apply({"u1": 15})
+
+    async def scenario():
+        await board.top(10)
+        db.users.during_scan = award
+        await board._resync()
+        return await board.top(10)
+
+    top = asyncio.run(scenario())
+    assert [(e["user_id"], e["points"], e["rank"]) for e in top] == [("u1", 25, 1), ("u2", 20, 2)]
+
+def test_rank_counts_users_with_strictly_more_points(db):
+    board = Leaderboard(resync_seconds=60)
+
+    async def scenario():
+        board.apply({"u3": 5})
+        return await board.rank("u1"), await board.rank("u2"), await board.rank("new", points=20)
+
+    assert asyncio.run(scenario()) == (2, 1, 1)
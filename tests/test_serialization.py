@@ -0,0 +1,73 @@
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+
+from app.core.serialization import model_list, render_list
+from app.core.config import settings
+from app.models.price import PriceResponse
+from app.models.product import ProductResponse
+from app.models.shopping import ShoppingListResponse
+
+PRODUCT_ROWS = [
+    {
+        "id": "p1", "name": "Plátano de Canarias", "brand_id": "b1", "brand_name": "Marca",
+        "category_id": "c1", "category_name": "Fruta", "unit_id": "u1", "unit_name": "kg",
+        "latest_price": 2, "is_base": True, "allowed_attribute_ids": ["a1"],
+        "attribute_values": {"color": "amarillo"},
+    },
+    {"id": "p2", "name": "Leche entera", "category_id": "", "latest_price": None},
+]
+
+PRICE_ROWS = [
+    {
+        "id": "pr1", "sellable_product_id": "sp1", "product_name": "Leche", "supermarket_name": "Súper",
+        "price": 1, "quantity": 6, "user_id": "u1", "user_name": "Ana", "created_at": "2026-10-17T10:00:00+00:00",
+    },
+    {
+        "id": "pr2", "product_id": "p1", "supermarket_id": "s1", "price": 0.99, "quantity": 1.5,
+        "user_id": "u2", "created_at": "2026-10-16T09:30:00.123456+00:00",
+    },
+]
+
+SHOPPING_LIST_ROWS = [
+    {
+        "id": "l1", "name": "Semana", "supermarket_id": "s1", "supermarket_name": "Súper",
+        "items": [
+            {"sellable_product_id": "sp1", "product_id": "p1", "quantity": 2, "unit_id": "u1", "price": 3,
+             "unit_price": 1.5, "purchased": True, "attribute_values": {"talla": "L"}},
+            {"sellable_product_id": "sp2", "quantity": 1, "unit_id": "", "purchased": False},
+        ],
+        "user_id": "u1", "total_estimated": 0, "total_actual": 3,
+        "created_at": "2026-10-01T00:00:00+00:00", "updated_at": "2026-10-02T00:00:00+00:00",
+    },
+]
+
+CASES = [(ProductResponse, PRODUCT_ROWS), (PriceResponse, PRICE_ROWS), (ShoppingListResponse, SHOPPING_LIST_ROWS)]
+
+def _default_path_body(model, rows) -> bytes:
+    # What FastAPI renders for the same rows through response_model, with the app's response class
+    app = FastAPI(default_response_class=ORJSONResponse)
+
+    @app.get("/rows", response_model=List[model])
+    async def rows_endpoint():
+        return [model(**row) for row in rows]
+
+    return TestClient(app).get("/rows").content
+
+def test_render_list_matches_response_model_path():
+    for model, rows in CASES:
+        assert render_list(model, rows) == _default_path_body(model, rows), model.__name__
+
+def test_int_prices_are_rendered_as_floats():
+    body = render_list(PriceResponse, PRICE_ROWS[:1])
+    assert b'"price":1.0' in body
+    assert b'"quantity":6.0' in body
+
+def test_model_list_honours_fast_serialization_setting(monkeypatch):
+    monkeypatch.setattr(settings, "FAST_SERIALIZATION", False)
+    models = model_list(PriceResponse, PRICE_ROWS)
+    assert [m.id for m in models] == ["pr1", "pr2"]
+    monkeypatch.setattr(settings, "FAST_SERIALIZATION", True)
+    assert model_list(PriceResponse, PRICE_ROWS).body == render_list(PriceResponse, PRICE_ROWS)
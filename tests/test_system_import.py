@@ -0,0 +1,26 @@
+import io
+
+import pandas as pd
+
+from app.core.system_import import _frame_records, _iter_csv
+
+def test_bool_column_with_blanks_is_imported():
+    df = pd.read_csv(io.StringIO("a,is_base\nx,True\ny,\n"))
+    assert _frame_records(df) == [{"a": "x", "is_base": True}, {"a": "y"}]
+
+def test_json_cells_are_parsed_including_multiline_ones():
+    df = pd.DataFrame({
+        "id": ["1", "2", "3"],
+        "attribute_values": ['{"color": "red"}', '{\n  "size": "L"\n}', None],
+        "tags": ["['a', 'b']", "plain text", True],
+    })
+    assert _frame_records(df) == [
+        {"id": "1", "attribute_values": {"color": "red"}, "tags": ["a", "b"]},
+        {"id": "2", "attribute_values": {"size": "L"}, "tags": "plain text"},
+        {"id": "3", "tags": True},
+    ]
+
+def test_csv_chunks_keep_ids_as_strings():
+    data = io.BytesIO(b"id,brand_id,price\n007,01,1.5\n008,,2\n")
+    chunks = list(_iter_csv(data, "prices", batch_size=1))
+    assert chunks == [("prices", [{"id": "007", "brand_id": "01", "price": 1.5}]), ("prices", [{"id": "008", "price": 2.0}])]